@@ -0,0 +1,251 @@
+#!python3
+
+"""
+An asyncio interface to the backend database, for callers which want to
+overlap requests to the backend with other work rather than block on them.
+
+Requires aiohttp
+"""
+
+# from standard library
+import asyncio
+import json
+import logging
+
+# third party
+import aiohttp
+
+# our code
+from Database import Database
+
+# Definitions aka constants
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_MAX_IN_FLIGHT = 4
+
+class AsyncDatabase:
+    '''
+    An asyncio counterpart to Database
+
+    Every request accepts an optional timeout, in seconds, which bounds the
+    whole request. On expiry asyncio.TimeoutError is raised; the request may
+    also be cancelled by cancelling the task awaiting it. Up to max_in_flight
+    requests are sent concurrently over a shared pool of connections.
+    '''
+
+    # the interpretation of the database's records is shared with Database
+    profile_from_record = Database.profile_from_record
+    card_details_from_record = Database.card_details_from_record
+    is_user_authorized_for_equipment_type = Database.is_user_authorized_for_equipment_type
+
+    def __init__(self, settings):
+        '''
+        Prepare to connect to the database specified. Connections are made
+        when the first request is sent
+
+        @param (dict)settings - a dictionary describing the database to
+            connect to. In addition to the keys used by Database it may
+            include 'request_timeout', the default timeout in seconds, and
+            'max_in_flight', the number of concurrent requests allowed
+        '''
+
+        # insure a minimum configuration
+        if (not 'website' in settings or not 'bearer_token' in settings):
+            raise ValueError("Database configuration must at a minimum include the 'website', 'api', and 'bearer_token' keys")
+
+        self.api_url= f"{settings['website']}/api/box.php"
+        self.api_header = {"Authorization" : f"Bearer {settings['bearer_token']}"}
+
+        self.timeout = DEFAULT_TIMEOUT
+        if "request_timeout" in settings:
+            self.timeout = float(settings["request_timeout"])
+
+        self.max_in_flight = DEFAULT_MAX_IN_FLIGHT
+        if "max_in_flight" in settings:
+            self.max_in_flight = int(settings["max_in_flight"])
+
+        self.session = None
+
+
+    async def close(self):
+        '''
+        Close the connections to the database
+        '''
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+
+    async def _request(self, method, params, timeout = None):
+        '''
+        Send a request to the database
+
+        @return a tuple of the response status code and the decoded JSON body,
+            the body is None unless the status code is 200
+        '''
+        if timeout is None:
+            timeout = self.timeout
+
+        status, body = await asyncio.wait_for(self._send(method, params), timeout)
+
+        logging.debug(f"Got response from server\nstatus: {status}\nbody: {body}")
+
+        if status != 200:
+            logging.error(f"API error")
+            return (status, None)
+
+        return (status, json.loads(body))
+
+
+    async def _send(self, method, params):
+        '''
+        @return a tuple of the response status code and body
+        '''
+        if self.session is None:
+            # aiohttp sessions must be created inside the running event loop
+            self.session = aiohttp.ClientSession(
+                headers = self.api_header,
+                connector = aiohttp.TCPConnector(limit = self.max_in_flight))
+
+        async with self.session.request(method, self.api_url, params = params) as response:
+            return (response.status, await response.text())
+
+
+    async def get_equipment_profile(self, mac_address, timeout = None):
+        '''
+        Discover the equipment profile assigned to the Portal Box in the database
+
+        @return a tuple consisting of: (int)equipment id,
+        (int)equipment type id, (str)equipment type, (int)location id,
+        (str)location, (int)time limit in minutes, (int) allow proxy
+        '''
+        logging.debug("Querying database for equipment profile")
+
+        params = {
+                "mode" : "get_profile",
+                "mac_adr" : mac_address
+                }
+
+        status, response_details = await self._request("GET", params, timeout)
+        if status != 200:
+            raise Exception('Error checking if portalbox is registered')
+
+        return self.profile_from_record(response_details[0])
+
+
+    async def log_started_status(self, equipment_id, timeout = None):
+        '''
+        Logs that this portal box has started up
+        '''
+        params = {
+                "mode" : "log_started_status",
+                "equipment_id" : equipment_id
+                }
+
+        await self._request("POST", params, timeout)
+
+
+    async def log_shutdown_status(self, equipment_id, card_id, timeout = None):
+        '''
+        Logs that this portal box is shutting down
+        '''
+        params = {
+                "mode" : "log_shutdown_status",
+                "equipment_id" : equipment_id,
+                "card_id" : card_id
+                }
+
+        await self._request("POST", params, timeout)
+
+
+    async def log_access_attempt(self, card_id, equipment_id, successful, timeout = None):
+        '''
+        Logs start time for user using a resource.
+        '''
+        params = {
+                "mode" : "log_access_attempt",
+                "equipment_id" : equipment_id,
+                "card_id" : card_id,
+                "successful" : int(successful)
+                }
+
+        await self._request("POST", params, timeout)
+
+
+    async def log_access_completion(self, card_id, equipment_id, timeout = None):
+        '''
+        Logs end time for user using a resource.
+        '''
+        params = {
+                "mode" : "log_access_completion",
+                "equipment_id" : equipment_id,
+                "card_id" : card_id
+                }
+
+        await self._request("POST", params, timeout)
+
+
+    async def record_ip(self, equipment_id, ip, timeout = None):
+        '''
+        Records the IP address of the portal box
+        '''
+        params = {
+                "mode" : "record_ip",
+                "equipment_id" : equipment_id,
+                "ip_address" : ip
+                }
+
+        await self._request("POST", params, timeout)
+
+
+    async def get_card_details(self, card_id, equipment_type_id, timeout = None):
+        '''
+        Get the details of a card in the form returned by
+        Database.get_card_details()
+        '''
+        params = {
+                "mode" : "get_card_details",
+                "card_id" : card_id,
+                "equipment_id" : equipment_type_id
+                }
+
+        status, response_details = await self._request("GET", params, timeout)
+        if status != 200:
+            return self.card_details_from_record(None)
+
+        return self.card_details_from_record(response_details[0])
+
+
+    async def get_user(self, card_id, timeout = None):
+        '''
+        Get details for the user identified by (card) id
+
+        @return, a tuple of name and email
+        '''
+        params = {
+                "mode" : "get_user",
+                "card_id" : card_id
+                }
+
+        status, response_details = await self._request("GET", params, timeout)
+        if status != 200:
+            return (None, None)
+
+        return (response_details[0]["name"], response_details[0]["email"])
+
+
+    async def get_equipment_name(self, equipment_id, timeout = None):
+        '''
+        Gets the name of the equipment given the equipment id
+
+        @return, a string of the name
+        '''
+        params = {
+                "mode" : "get_equipment_name",
+                "equipment_id" : equipment_id
+                }
+
+        status, response_details = await self._request("GET", params, timeout)
+        if status != 200:
+            return "Unknown"
+
+        return response_details[0]["name"]
@@ -0,0 +1,111 @@
+#!python3
+
+"""
+Fold repeated failed access attempts by the same card into a single counted
+record so a user repeatedly tapping a refused card does not flood the backend
+with log requests.
+"""
+
+# from standard library
+import logging
+import threading
+
+# Definitions aka constants
+DEFAULT_WINDOW = 60
+
+class AttemptAggregator:
+    '''
+    Count failed access attempts per (card id, equipment id)
+
+    The first failed attempt by a card opens a window of window seconds and
+    should be logged immediately. Further failed attempts by the card during
+    the window are only counted. When the window closes, if there were any
+    further attempts, send(card_id, equipment_id, attempts) is called once
+    with their count.
+    '''
+
+    def __init__(self, send, settings = {}):
+        '''
+        @param (callable)send - called with the card id, equipment id and
+            number of attempts which were counted rather than logged
+        @param (dict)settings - a dictionary which may include the key
+            'failed_attempt_window', the length of a window in seconds
+        '''
+        self.send = send
+
+        self.window = DEFAULT_WINDOW
+        if "failed_attempt_window" in settings:
+            self.window = float(settings["failed_attempt_window"])
+
+        self.lock = threading.Lock()
+        # (card_id, equipment_id) -> [attempts, timer]
+        self.windows = {}
+        self.aggregated = 0
+        self.summaries = 0
+
+
+    def add(self, card_id, equipment_id):
+        '''
+        Note a failed access attempt
+
+        @return True if the attempt opened a window and should be logged,
+            False if it was counted
+        '''
+        key = (card_id, equipment_id)
+        with self.lock:
+            if key in self.windows:
+                self.windows[key][0] += 1
+                self.aggregated += 1
+                return False
+
+            timer = threading.Timer(self.window, self.flush, key)
+            timer.daemon = True
+            self.windows[key] = [0, timer]
+            timer.start()
+            return True
+
+
+    def flush(self, card_id, equipment_id):
+        '''
+        Close the window for a card early, sending its count if any. Called
+        before logging a successful attempt by the card so the records stay in
+        order.
+        '''
+        with self.lock:
+            attempts, timer = self.windows.pop((card_id, equipment_id), (0, None))
+            if attempts:
+                self.summaries += 1
+
+        if timer:
+            timer.cancel()
+
+        if attempts:
+            logging.debug("Logging %d repeated failed attempts by card %d", attempts, card_id)
+            try:
+                self.send(card_id, equipment_id, attempts)
+            except Exception as e:
+                logging.error(f"Unable to log repeated access attempts: {e}")
+
+
+    def close(self):
+        '''
+        Close every open window, sending the counts
+        '''
+        with self.lock:
+            keys = list(self.windows)
+
+        for key in keys:
+            self.flush(*key)
+
+
+    def stats(self):
+        '''
+        @return a dictionary of the number of attempts counted rather than
+            logged and the number of counted records sent
+        '''
+        with self.lock:
+            return {
+                "windows": len(self.windows),
+                "aggregated": self.aggregated,
+                "summaries": self.summaries
+            }
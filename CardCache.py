@@ -0,0 +1,260 @@
+#!python3
+
+"""
+A persistent local cache of the card records returned by the backend so that
+a repeat tap does not have to wait on a round trip to the website.
+"""
+
+# from standard library
+from collections import OrderedDict
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+# Definitions aka constants
+DEFAULT_PATH = "card_cache.sqlite"
+DEFAULT_TTL = 300
+DEFAULT_NEGATIVE_TTL = 30
+DEFAULT_MAX_STALE = 3600
+DEFAULT_MAX_ENTRIES = 1024
+
+class CardCache:
+    '''
+    A size bounded, least recently used cache of card records keyed by
+    (card id, equipment type id) and backed by a SQLite database so that it
+    survives a restart of the service.
+
+    Lookups are answered from memory; SQLite is only touched when an entry is
+    added, evicted or invalidated.
+
+    Records of cards which were refused, negative entries, are kept for their
+    own, usually shorter, ttl. Unlike a stale positive entry a stale negative
+    entry is not returned so the card is looked up again straight away.
+
+    A positive entry which could not be refreshed within max_stale seconds of
+    being fetched is not returned either, so a card revoked while the backend
+    is unreachable is not authorized for long.
+    '''
+
+    def __init__(self, settings = {}):
+        '''
+        Open (creating if necessary) the cache described by settings
+
+        @param (dict)settings - a dictionary which may include the keys
+            'card_cache_path' the file to store the cache in,
+            'card_cache_ttl' the number of seconds an entry is considered
+            fresh, 'card_cache_negative_ttl' the number of seconds a negative
+            entry is kept, 0 to not keep them, 'card_cache_max_stale' the
+            number of seconds after which an entry is no longer used, and
+            'card_cache_max_entries' the number of entries to keep before the
+            least recently used entries are evicted
+        '''
+        path = DEFAULT_PATH
+        if "card_cache_path" in settings:
+            path = settings["card_cache_path"]
+
+        ttl = DEFAULT_TTL
+        if "card_cache_ttl" in settings:
+            ttl = int(settings["card_cache_ttl"])
+
+        negative_ttl = DEFAULT_NEGATIVE_TTL
+        if "card_cache_negative_ttl" in settings:
+            negative_ttl = float(settings["card_cache_negative_ttl"])
+
+        max_stale = DEFAULT_MAX_STALE
+        if "card_cache_max_stale" in settings:
+            max_stale = float(settings["card_cache_max_stale"])
+
+        max_entries = DEFAULT_MAX_ENTRIES
+        if "card_cache_max_entries" in settings:
+            max_entries = int(settings["card_cache_max_entries"])
+
+        if 0 >= max_entries:
+            raise ValueError("Card cache must be allowed at least one entry")
+
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_stale = max_stale
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+        self.closed = False
+        self.connection = sqlite3.connect(path, check_same_thread = False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS card_records ("
+            "card_id INTEGER NOT NULL, "
+            "equipment_type_id INTEGER NOT NULL, "
+            "record TEXT NOT NULL, "
+            "fetched_at REAL NOT NULL, "
+            "last_used REAL NOT NULL, "
+            "negative INTEGER NOT NULL DEFAULT 0, "
+            "PRIMARY KEY (card_id, equipment_type_id))")
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(card_records)")]
+        if "negative" not in columns:
+            # a cache written before negative entries were kept
+            self.connection.execute(
+                "ALTER TABLE card_records ADD COLUMN negative INTEGER NOT NULL DEFAULT 0")
+        self.connection.commit()
+
+        # (card_id, equipment_type_id) -> [record, fetched_at, last_used, negative]
+        # ordered from least to most recently used
+        self.entries = OrderedDict()
+        rows = self.connection.execute(
+            "SELECT card_id, equipment_type_id, record, fetched_at, last_used, negative "
+            "FROM card_records ORDER BY last_used")
+        for card_id, equipment_type_id, record, fetched_at, last_used, negative in rows:
+            self.entries[(card_id, equipment_type_id)] = [json.loads(record), fetched_at, last_used, bool(negative)]
+        self._evict()
+        self.connection.commit()
+
+        logging.debug("Loaded %d entries into the card cache", len(self.entries))
+
+
+    def get(self, card_id, equipment_type_id):
+        '''
+        Look up the record for a card
+
+        @return a tuple of the cached record, or None if the card is not
+            cached, its negative entry has expired or its entry is older than
+            max_stale, and a boolean which is True when the record is still
+            fresh
+        '''
+        key = (card_id, equipment_type_id)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return (None, False)
+
+            self.entries.move_to_end(key)
+            entry[2] = now
+            if entry[3]:
+                if now - entry[1] > self.negative_ttl:
+                    self.stale += 1
+                    return (None, False)
+
+                self.negative_hits += 1
+                return (entry[0], True)
+
+            if now - entry[1] > self.ttl:
+                self.stale += 1
+                if now - entry[1] > self.max_stale:
+                    return (None, False)
+                return (entry[0], False)
+
+            self.hits += 1
+            return (entry[0], True)
+
+
+    def put(self, card_id, equipment_type_id, record, negative = False):
+        '''
+        Add or replace the record for a card
+
+        @param (dict)record - the card record as returned by the backend
+        @param (boolean)negative - True if the card was refused, the entry is
+            then kept for the negative ttl
+        '''
+        key = (card_id, equipment_type_id)
+        now = time.time()
+        with self.lock:
+            if self.closed:
+                return
+
+            if negative and 0 >= self.negative_ttl:
+                # a positive entry for the card is no longer correct
+                if self.entries.pop(key, None) is not None:
+                    self.connection.execute(
+                        "DELETE FROM card_records WHERE card_id = ? AND equipment_type_id = ?",
+                        key)
+                    self.connection.commit()
+                return
+
+            self.entries[key] = [record, now, now, negative]
+            self.entries.move_to_end(key)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO card_records "
+                "(card_id, equipment_type_id, record, fetched_at, last_used, negative) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (card_id, equipment_type_id, json.dumps(record), now, now, int(negative)))
+            self._evict()
+            self.connection.commit()
+
+
+    def invalidate(self, card_id = None, equipment_type_id = None):
+        '''
+        Remove entries from the cache. With no arguments the whole cache is
+        cleared, otherwise only entries matching the given card id and/or
+        equipment type id are removed.
+        '''
+        with self.lock:
+            keys = [key for key in self.entries
+                    if (card_id is None or key[0] == card_id) and
+                       (equipment_type_id is None or key[1] == equipment_type_id)]
+            for key in keys:
+                del self.entries[key]
+            self.connection.executemany(
+                "DELETE FROM card_records WHERE card_id = ? AND equipment_type_id = ?",
+                keys)
+            self.connection.commit()
+
+        logging.debug("Invalidated %d entries in the card cache", len(keys))
+
+
+    def stats(self):
+        '''
+        @return a dictionary of counters describing how well the cache is
+            performing
+        '''
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions
+            }
+
+
+    def close(self):
+        '''
+        Persist the recency of each entry, which is only tracked in memory
+        while running, and close the database
+        '''
+        with self.lock:
+            if self.closed:
+                return
+
+            self.closed = True
+            self.connection.executemany(
+                "UPDATE card_records SET last_used = ? WHERE card_id = ? AND equipment_type_id = ?",
+                [(entry[2], key[0], key[1]) for key, entry in self.entries.items()])
+            self.connection.commit()
+            self.connection.close()
+
+
+    def _evict(self):
+        '''
+        Drop least recently used entries until the cache fits in max_entries.
+        Caller must hold the lock (or be the constructor).
+        '''
+        evicted = []
+        while len(self.entries) > self.max_entries:
+            key, _ = self.entries.popitem(last = False)
+            evicted.append(key)
+
+        if evicted:
+            self.evictions += len(evicted)
+            self.connection.executemany(
+                "DELETE FROM card_records WHERE card_id = ? AND equipment_type_id = ?",
+                evicted)
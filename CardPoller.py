@@ -0,0 +1,203 @@
+#!python3
+
+"""
+Poll the RFID reader on a thread of its own so cards are noticed at a steady
+cadence whatever the main loop is doing.
+"""
+
+# from standard library
+import logging
+import threading
+from time import monotonic
+
+# our code
+from EventLoop import EventLoop
+
+# Definitions aka constants
+IDLE = "idle"
+RUNNING = "running"
+GRACE = "grace"
+DEFAULT_POLL_INTERVALS = {
+    IDLE: 0.25,
+    RUNNING: 0.1,
+    GRACE: 0.05
+}
+
+class CardPoller:
+    '''
+    Read the RFID reader periodically and post CARD_PRESENT and CARD_REMOVED
+    events, stamped with the time of the read which noticed the change, to an
+    EventLoop
+
+    The time between reads depends on the rate asked for by the state of the
+    service: IDLE while the equipment is off, RUNNING while it is on and GRACE
+    while a grace period is counting down. A change is noticed at most one
+    interval after it happens; the interval before each read noticing a
+    change is recorded, by state, as the bound on its detection latency.
+
+    Events are posted without blocking. If the loop's queue is full the
+    change is posted again after the next read, stamped with its original
+    time.
+
+    A read raising one of the fatal errors stops polling and posts a FATAL
+    event, with the error, so the main loop can stop the service. Other
+    errors are logged and the reader is read again at the next interval.
+    '''
+
+    def __init__(self, read_card, events, settings = {}, fatal_errors = ()):
+        '''
+        @param (callable)read_card - returns the id of the card present, or a
+            value <= 0 when there is none
+        @param (EventLoop)events - the loop to post events to
+        @param (dict)settings - a dictionary which may include the keys
+            'idle_poll_interval', 'running_poll_interval' and
+            'grace_poll_interval', the seconds between reads at each rate
+        @param (tuple)fatal_errors - the exception classes read_card raises
+            when the reader can no longer be used
+        '''
+        self.read_card = read_card
+        self.events = events
+        self.fatal_errors = fatal_errors
+
+        self.intervals = dict(DEFAULT_POLL_INTERVALS)
+        for rate in self.intervals:
+            if f"{rate}_poll_interval" in settings:
+                self.intervals[rate] = float(settings[f"{rate}_poll_interval"])
+
+        self.lock = threading.Lock()
+        self.state = None
+        self.poll_interval = self.intervals[IDLE]
+        self.last_read = None
+        # state -> [reads, changes, total latency bound, max latency bound]
+        self.metrics = {}
+
+        # the card the main loop has been told about
+        self.published = -1
+        # when the current reading was first seen
+        self.changed_at = None
+        self.reads = 0
+        self.read_errors = 0
+
+        self.stopped = threading.Event()
+        self.woken = threading.Event()
+        self.thread = None
+
+
+    def start(self):
+        self.thread = threading.Thread(target = self._run, name = "rfid_poll", daemon = True)
+        self.thread.start()
+
+
+    def set_state(self, state, rate):
+        '''
+        Poll at the rate for the state the service is in
+
+        @param (string)state - the name of the state, metrics are kept per
+            state
+        @param (string)rate - IDLE, RUNNING or GRACE
+        '''
+        with self.lock:
+            self.state = state
+            interval = self.intervals[rate]
+            if interval == self.poll_interval:
+                return
+            self.poll_interval = interval
+
+        # the next read may now be due sooner
+        self.woken.set()
+
+
+    def stop(self, timeout = 1.0):
+        '''
+        Stop polling, waiting up to timeout seconds for a read in progress
+        '''
+        self.stopped.set()
+        self.woken.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.poll()
+            while not self.stopped.is_set():
+                with self.lock:
+                    delay = self.last_read + self.poll_interval - monotonic()
+                if delay <= 0:
+                    break
+                self.woken.wait(delay)
+                self.woken.clear()
+
+
+    def poll(self):
+        '''
+        Read the reader once and post any change
+        '''
+        try:
+            card_id = self.read_card()
+        except self.fatal_errors as e:
+            logging.critical(f"RFID reader failed: {e}")
+            self.stopped.set()
+            self.events.post(EventLoop.FATAL, e)
+            return
+        except Exception as e:
+            self.read_errors += 1
+            logging.error(f"Unable to read RFID reader: {e}")
+            with self.lock:
+                self.last_read = monotonic()
+            return
+
+        now = monotonic()
+        with self.lock:
+            self.reads += 1
+            previous_read = self.last_read
+            self.last_read = now
+            metrics = self.metrics.setdefault(self.state, [0, 0, 0.0, 0.0])
+            metrics[0] += 1
+
+        if card_id <= 0:
+            card_id = -1
+        if card_id == self.published:
+            self.changed_at = None
+            return
+
+        if self.changed_at is None:
+            self.changed_at = now
+            if previous_read is not None:
+                # the change happened some time since the previous read
+                bound = now - previous_read
+                with self.lock:
+                    metrics[1] += 1
+                    metrics[2] += bound
+                    metrics[3] = max(metrics[3], bound)
+
+        if self.published > 0:
+            if not self.events.post(EventLoop.CARD_REMOVED, self.published, self.changed_at, block = False):
+                return
+            self.published = -1
+
+        if card_id > 0:
+            if not self.events.post(EventLoop.CARD_PRESENT, card_id, self.changed_at, block = False):
+                return
+            self.published = card_id
+
+        self.changed_at = None
+
+
+    def stats(self):
+        '''
+        @return a dictionary of the number of reads and failed reads and, by
+            state, the number of reads and changes noticed and the mean and
+            maximum bound on the latency of noticing a change in seconds
+        '''
+        with self.lock:
+            return {
+                "reads": self.reads,
+                "read_errors": self.read_errors,
+                "states": {state: {
+                        "reads": reads,
+                        "changes": changes,
+                        "mean_latency": total / changes if changes else None,
+                        "max_latency": longest if changes else None
+                    } for state, (reads, changes, total, longest) in self.metrics.items()}
+            }
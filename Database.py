@@ -9,22 +9,33 @@
 
 # from standard library
 import logging
-import requests
+import threading
 import time
+import uuid
 
 # our code
+from AttemptAggregator import AttemptAggregator
+from CardCache import CardCache
 from CardType import CardType
+from LogSpool import LogSpool
+from Roster import Roster
+from SingleFlight import SingleFlight
+from StartupSnapshot import StartupSnapshot
+from Transport import Transport
+from WebService import NotRegisteredError, OutOfServiceError
 
 class Database:
     '''
     A high level interface to the backend database
     '''
 
-    def __init__(self, settings):
+    def __init__(self, settings, transport = None):
         '''
         Create a connection to the database specified
 
         @param (dict)settings - a dictionary describing the database to connect to
+        @param (Transport)transport - an optional transport to share with other
+            clients, by default one is created from settings
         '''
 
         # insure a minimum configuration
@@ -34,8 +45,48 @@ class Database:
         self.api_url= f"{settings['website']}/api/box.php"
         self.api_header = {"Authorization" : f"Bearer {settings['bearer_token']}"}
 
-        self.request_session = requests.Session()
-        self.request_session.headers.update(self.api_header)
+        self.settings = settings
+
+        # authorization is sent with each request rather than set on the
+        # session so the transport can be shared with other clients
+        self.transport = transport if transport else Transport(settings)
+
+        # the roster is started once the equipment type is known
+        self.roster = None
+
+        # optionally keep a local cache of card records
+        self.card_cache = None
+        if "card_cache_enabled" in settings:
+            if settings["card_cache_enabled"].lower() in ("yes", "true", "1"):
+                self.card_cache = CardCache(settings)
+
+        # optionally send logging requests in the background
+        self.log_spool = None
+        if "log_spool_enabled" in settings:
+            if settings["log_spool_enabled"].lower() in ("yes", "true", "1"):
+                self.log_spool = LogSpool(self.post_log, settings)
+
+        # optionally remember the equipment profile so the box can start
+        # without the database
+        self.startup_snapshot = None
+        if "startup_snapshot_enabled" in settings:
+            if settings["startup_snapshot_enabled"].lower() in ("yes", "true", "1"):
+                self.startup_snapshot = StartupSnapshot(settings)
+
+        # optionally fold repeated failed access attempts into one record
+        self.attempt_aggregator = None
+        if "failed_attempt_window" in settings:
+            if 0 < float(settings["failed_attempt_window"]):
+                self.attempt_aggregator = AttemptAggregator(self.log_repeated_access_attempts, settings)
+
+        # whether the database understands the combined hello request, until
+        # it says otherwise assume it does
+        self.hello_supported = True
+        # equipment id -> name, as learned from the hello
+        self.equipment_names = {}
+
+        # concurrent lookups of the same card or user share one request
+        self.single_flight = SingleFlight()
 
 
     def is_registered(self, mac_address):
@@ -53,7 +104,7 @@ class Database:
                 "mac_adr" : mac_address
                 }
 
-        response = self.request_session.get(self.api_url, params = params)
+        response = self.transport.get(self.api_url, params = params, headers = self.api_header)
 
         logging.debug(f"Got response from server\nstatus: {response.status_code}\nbody: {response.text}")
         
@@ -78,7 +129,7 @@ class Database:
                 "mac_adr" : mac_address
                 }
 
-        response = self.request_session.put(self.api_url, params = params)
+        response = self.transport.put(self.api_url, params = params, headers = self.api_header)
 
         logging.debug(f"Got response from server\nstatus: {response.status_code}\nbody: {response.text}")
 
@@ -98,6 +149,8 @@ class Database:
         @return a tuple consisting of: (int)equipment id,
         (int)equipment type id, (str)equipment type, (int)location id,
         (str)location, (int)time limit in minutes, (int) allow proxy
+        @raise NotRegisteredError if the Portal Box is not registered
+        @raise OutOfServiceError if the Portal Box is out of service
         '''
         logging.debug("Querying database for equipment profile")
 
@@ -108,29 +161,147 @@ class Database:
                 "mac_adr" : mac_address
                 }
 
-        response = self.request_session.get(self.api_url, params = params)
+        response = self.transport.get(self.api_url, params = params, headers = self.api_header)
 
         logging.debug(f"Got response from server\nstatus: {response.status_code}\nbody: {response.text}")
 
         if(response.status_code == 200):
             response_details = response.json()[0]
-            profile = (
-                    int(response_details["id"]),
-                    int(response_details["type_id"]),
-                    response_details["name"][0],
-                    int(response_details["location_id"]),
-                    response_details["name"][1],
-                    int(response_details["timeout"]),
-                    int(response_details["allow_proxy"])
-                    )
-            self.requires_training = int(response_details["requires_training"])
-            self.requires_payment  = int(response_details["charge_policy"])
+            profile = self.profile_from_record(response_details)
+            self.remember_equipment_profile(mac_address, response_details)
+        elif(response.status_code == 404):
+            raise NotRegisteredError()
+        elif(response.status_code == 409):
+            raise OutOfServiceError()
         else:
             raise Exception('Error checking if portalbox is registered')
 
         return profile
 
 
+    def hello(self, mac_address, ip_address):
+        '''
+        Introduce the Portal Box to the database at startup in a single
+        request which logs that the box has started, records its IP address
+        and returns its equipment profile. If the database does not support
+        the request the separate legacy requests are made instead.
+
+        @param (string)mac_address - the MAC address of the portal box
+        @param (string)ip_address - the IP address of the portal box or None
+            if it is not known
+        @return a tuple of the equipment profile, in the form returned by
+            get_equipment_profile(), and the equipment's name, which is None
+            when the legacy requests were used
+        @raise NotRegisteredError if the Portal Box is not registered
+        @raise OutOfServiceError if the Portal Box is out of service
+        '''
+        if self.hello_supported:
+            logging.debug("Introducing this portalbox to the database")
+
+            params = {
+                    "mode" : "hello",
+                    "mac_adr" : mac_address,
+                    "status" : "started"
+                    }
+            if ip_address:
+                params["ip_address"] = ip_address
+
+            # the key lets the request be repeated without logging the start
+            # twice
+            headers = dict(self.api_header)
+            headers["Idempotency-Key"] = uuid.uuid4().hex
+
+            response = self.transport.post(self.api_url, params = params, headers = headers, retry = True)
+
+            logging.debug(f"Got response from server\nstatus: {response.status_code}\nbody: {response.text}")
+
+            if(response.status_code == 200):
+                response_details = response.json()
+                profile = self.profile_from_record(response_details["profile"])
+                self.remember_equipment_profile(mac_address, response_details["profile"])
+                name = response_details.get("equipment_name")
+                if name is not None:
+                    self.equipment_names[profile[0]] = name
+                return (profile, name)
+            elif response.status_code == 409:
+                raise OutOfServiceError()
+            elif response.status_code in (404, 405, 501):
+                logging.info("Database does not support hello, using the legacy requests")
+                self.hello_supported = False
+            else:
+                raise Exception('Error introducing portalbox to the database')
+
+        profile = self.get_equipment_profile(mac_address)
+        self.log_started_status(profile[0])
+        if ip_address:
+            self.record_ip(profile[0], ip_address)
+
+        return (profile, None)
+
+
+    def remember_equipment_profile(self, mac_address, response_details):
+        '''
+        Save an equipment profile record to the startup snapshot, if it is
+        enabled
+        '''
+        if self.startup_snapshot:
+            try:
+                self.startup_snapshot.save(mac_address, response_details)
+            except OSError as e:
+                logging.error(f"Unable to save startup snapshot: {e}")
+
+
+    def load_equipment_profile(self, mac_address):
+        '''
+        Get the equipment profile last assigned to the Portal Box from the
+        startup snapshot, if it is enabled
+
+        @return a tuple in the form returned by get_equipment_profile() or
+            None if there is no snapshot for the MAC address
+        '''
+        if not self.startup_snapshot:
+            return None
+
+        response_details = self.startup_snapshot.load(mac_address)
+        if response_details is None:
+            return None
+
+        return self.profile_from_record(response_details)
+
+
+    def forget_equipment_profile(self):
+        '''
+        Discard the startup snapshot, if it is enabled, once the database no
+        longer accepts the profile it holds
+        '''
+        if self.startup_snapshot:
+            try:
+                self.startup_snapshot.discard()
+            except OSError as e:
+                logging.error(f"Unable to discard startup snapshot: {e}")
+
+
+    def profile_from_record(self, response_details):
+        '''
+        Convert an equipment profile record from the database into the tuple
+        returned by get_equipment_profile() and remember the equipment type's
+        training and payment requirements
+        '''
+        profile = (
+                int(response_details["id"]),
+                int(response_details["type_id"]),
+                response_details["name"][0],
+                int(response_details["location_id"]),
+                response_details["name"][1],
+                int(response_details["timeout"]),
+                int(response_details["allow_proxy"])
+                )
+        self.requires_training = int(response_details["requires_training"])
+        self.requires_payment  = int(response_details["charge_policy"])
+
+        return profile
+
+
     def log_started_status(self, equipment_id):
         '''
         Logs that this portal box has started up
@@ -145,14 +316,7 @@ class Database:
                 "equipment_id" :equipment_id
                 }
 
-
-        response = self.request_session.post(self.api_url, params = params)
-
-        logging.debug(f"Got response from server\nstatus: {response.status_code}\nbody: {response.text}")
-        
-        if(response.status_code != 200):
-            #If we don't get a success status code, then return and unauthorized user 
-            logging.error(f"API error")
+        self.log(params)
 
 
     def log_shutdown_status(self, equipment_id, card_id):
@@ -171,14 +335,7 @@ class Database:
                 "card_id" : card_id
                 }
 
-
-        response = self.request_session.post(self.api_url, params = params)
-
-        logging.debug(f"Got response from server\nstatus: {response.status_code}\nbody: {response.text}")
-
-        if(response.status_code != 200):
-            # If we don't get a success status code, then return and unauthorized user 
-            logging.error(f"API error")
+        self.log(params)
 
 
     def log_access_attempt(self, card_id, equipment_id, successful):
@@ -189,6 +346,12 @@ class Database:
         @param equipment_id: The ID assigned to the portal box
         @param successful: If login was successful (user is authorized)
         '''
+        if self.attempt_aggregator:
+            if successful:
+                self.attempt_aggregator.flush(card_id, equipment_id)
+            elif not self.attempt_aggregator.add(card_id, equipment_id):
+                logging.debug("Counting repeated failed access attempt")
+                return
         
         logging.debug("Logging with database an access attempt")
 
@@ -199,14 +362,29 @@ class Database:
                 "successful" : int(successful)
                 }
 
+        self.log(params)
 
-        response = self.request_session.post(self.api_url, params = params)
 
-        logging.debug(f"Got response from server\nstatus: {response.status_code}\nbody: {response.text}")
-        logging.debug(f"Took {response.elapsed.total_seconds()}")
-        if(response.status_code != 200):
-            #If we don't get a success status code, then return and unauthorized user 
-            logging.error(f"API error")
+    def log_repeated_access_attempts(self, card_id, equipment_id, attempts):
+        '''
+        Logs failed access attempts which were counted rather than logged as
+        they were made
+
+        @param card_id: The ID read from the card presented by the user
+        @param equipment_id: The ID assigned to the portal box
+        @param attempts: The number of attempts
+        '''
+        logging.debug("Logging with database repeated access attempts")
+
+        params = {
+                "mode" : "log_access_attempt",
+                "equipment_id" : equipment_id,
+                "card_id" : card_id,
+                "successful" : 0,
+                "attempts" : attempts
+                }
+
+        self.log(params)
 
 
     def log_access_completion(self, card_id, equipment_id):
@@ -225,14 +403,7 @@ class Database:
                 "card_id" : card_id
                 }
 
-
-        response = self.request_session.post(self.api_url, params = params)
-
-        logging.debug(f"Got response from server\nstatus: {response.status_code}\nbody: {response.text}")
-        logging.debug(f"Took {response.elapsed.total_seconds()}")
-        if(response.status_code != 200):
-            #If we don't get a success status code, then return and unauthorized user 
-            logging.error(f"API error")
+        self.log(params)
 
 
     def get_card_details(self, card_id, equipment_type_id):
@@ -244,6 +415,64 @@ class Database:
             "card_type": CardType //The type of card
             "user_authority_level": int //Returns if the user is a normal user, trainer, or admin
             }
+
+        When the offline roster has been loaded the details are decided from
+        the roster alone. Otherwise when the card cache is enabled a cached
+        record is used if present. A record older than the cache's ttl is
+        still used but is refreshed from the database in the background, until
+        it is older than the cache's max stale when it is looked up again. The
+        records of refused cards are only cached for the cache's negative ttl
+        and are then looked up again before they are used.
+        '''
+        roster = self.roster
+        if roster and roster.is_loaded():
+            return self.card_details_from_record(roster.lookup(card_id))
+
+        record = None
+        if self.card_cache:
+            record, is_fresh = self.card_cache.get(card_id, equipment_type_id)
+            if record is not None and not is_fresh:
+                self.refresh_card_details(card_id, equipment_type_id)
+
+        if record is None:
+            record = self.get_card_record(card_id, equipment_type_id)
+            if record is not None and self.card_cache:
+                self.cache_card_record(card_id, equipment_type_id, record)
+
+        return self.card_details_from_record(record)
+
+
+    def cache_card_record(self, card_id, equipment_type_id, record):
+        '''
+        Add a card record to the card cache, as a negative entry if the card
+        is invalid or its holder is not authorized
+
+        @return the details of the card, see card_details_from_record()
+        '''
+        details = self.card_details_from_record(record)
+        negative = (not details["user_is_authorized"] or
+            details["card_type"] == CardType.INVALID_CARD)
+        self.card_cache.put(card_id, equipment_type_id, record, negative)
+
+        return details
+
+
+    def get_card_record(self, card_id, equipment_type_id):
+        '''
+        Get the record the database keeps about a card. Concurrent requests
+        for the same card share a single request to the database.
+
+        @return a dictionary of the card record as returned by the database or
+            None if the database reported an error
+        '''
+        return self.single_flight.do(("get_card_details", card_id, equipment_type_id),
+            self.request_card_record, card_id, equipment_type_id)
+
+
+    def request_card_record(self, card_id, equipment_type_id):
+        '''
+        Request the record the database keeps about a card, see
+        get_card_record()
         '''
         logging.debug("Starting to get user details for card with ID %d", card_id)
         params = {
@@ -253,7 +482,7 @@ class Database:
                 }
 
 
-        response = self.request_session.get(self.api_url, params = params)
+        response = self.transport.get(self.api_url, params = params, headers = self.api_header)
 
         logging.debug(f"Got response from server\nstatus: {response.status_code}\nbody: {response.text}")
         logging.debug(f"Took {response.elapsed.total_seconds()}")
@@ -261,25 +490,129 @@ class Database:
         if(response.status_code != 200):
             #If we don't get a success status code, then return and unauthorized user 
             logging.error(f"API error")
-            details = {
+            return None
+
+        return response.json()[0]
+
+
+    def get_roster_changes(self, equipment_type_id, revision = 0):
+        '''
+        Get the changes to the records of the cards which may be presented to
+        equipment of the given type since a revision of the roster. The
+        database sends a full snapshot instead when revision is 0 or too old
+        for it to have kept the changes.
+
+        @param (int)equipment_type_id - the equipment type of the roster
+        @param (int)revision - the revision of the roster already held, 0
+            for none
+        @return a dictionary of the form
+                "revision": (int) the revision of the roster after the changes,
+                "snapshot": (boolean) True if "cards" is the complete roster,
+                "cards": (dict) card records, in the form returned by
+                    get_card_record(), keyed by (int) card id,
+                "revoked": (list) the (int) ids of cards removed from the roster
+            or None if the database reported an error
+        '''
+        logging.debug("Getting roster changes since revision %d for equipment type %d", revision, equipment_type_id)
+        params = {
+                "mode" : "get_roster",
+                "equipment_id" : equipment_type_id,
+                "since" : revision
+                }
+
+        response = self.transport.get(self.api_url, params = params, headers = self.api_header)
+
+        logging.debug(f"Got response from server\nstatus: {response.status_code}")
+        logging.debug(f"Took {response.elapsed.total_seconds()}")
+
+        if(response.status_code != 200):
+            logging.error(f"API error")
+            return None
+
+        response_details = response.json()
+        if isinstance(response_details, list):
+            # a server without revision support always sends a snapshot
+            response_details = {
+                    "revision" : 0,
+                    "snapshot" : True,
+                    "cards" : response_details,
+                    "revoked" : []
+                    }
+
+        return {
+                "revision" : int(response_details["revision"]),
+                "snapshot" : bool(response_details["snapshot"]),
+                "cards" : {int(record["card_id"]): record for record in response_details["cards"]},
+                "revoked" : [int(card_id) for card_id in response_details["revoked"]]
+                }
+
+
+    def start_roster(self, equipment_type_id):
+        '''
+        Begin keeping an offline roster for the equipment type if the offline
+        roster is enabled in the settings, replacing the roster of any other
+        equipment type
+        '''
+        old_roster = self.roster
+        if old_roster and old_roster.equipment_type_id == equipment_type_id:
+            return
+
+        roster = None
+        if "offline_roster_enabled" in self.settings:
+            if self.settings["offline_roster_enabled"].lower() in ("yes", "true", "1"):
+                roster = Roster(self, equipment_type_id, self.settings)
+
+        # card lookups on other threads see either roster, never none between
+        self.roster = roster
+        if old_roster:
+            old_roster.stop()
+
+
+    def refresh_card_details(self, card_id, equipment_type_id):
+        '''
+        Replace the cached record for a card with a fresh copy from the
+        database without blocking the caller
+        '''
+        if self.single_flight.in_flight(("get_card_details", card_id, equipment_type_id)):
+            return
+
+        def refresh():
+            try:
+                record = self.get_card_record(card_id, equipment_type_id)
+                if record is not None:
+                    self.cache_card_record(card_id, equipment_type_id, record)
+            except Exception as e:
+                logging.info(f"Unable to refresh card details: {e}")
+
+        threading.Thread(target = refresh, name = "card_refresh", daemon = True).start()
+
+
+    def card_details_from_record(self, record):
+        '''
+        Convert a card record from the database into the details dictionary
+        returned by get_card_details(). A record of None results in the
+        details of an invalid, unauthorized card.
+        '''
+        if record is None:
+            return {
                     "user_is_authorized": False,
                     "card_type" : CardType(-1),
                     "user_authority_level": 0
                     }
-        else:
-            response_details = response.json()[0]
 
-            if response_details["user_role"] == None:
-                response_details["user_role"] = 0
+        user_role = record["user_role"]
+        if user_role == None:
+            user_role = 0
 
-            if response_details["card_type"] == None:
-                response_details["card_type"] = -1
-            details = {
-                    "user_is_authorized": self.is_user_authorized_for_equipment_type(response_details),
-                    "card_type" : CardType(int(response_details["card_type"])),
-                    "user_authority_level": int(response_details["user_role"])
-                    }
-        return details
+        card_type = record["card_type"]
+        if card_type == None:
+            card_type = -1
+
+        return {
+                "user_is_authorized": self.is_user_authorized_for_equipment_type(record),
+                "card_type" : CardType(int(card_type)),
+                "user_authority_level": int(user_role)
+                }
 
 
     def is_user_authorized_for_equipment_type(self, card_details):
@@ -320,13 +653,21 @@ class Database:
 
     def get_user(self, card_id):
         '''
-        Get details for the user identified by (card) id
+        Get details for the user identified by (card) id. Concurrent requests
+        for the same user share a single request to the database.
 
         @return, a tuple of name and email
         '''
+        return self.single_flight.do(("get_user", card_id), self.request_user, card_id)
+
+
+    def request_user(self, card_id):
+        '''
+        Request details for the user identified by (card) id, see get_user()
+        '''
         user = (None, None)
         
-        logging.debug(f"Getting user information from card ID: {id}")
+        logging.debug(f"Getting user information from card ID: {card_id}")
 
         params = {
                 "mode" : "get_user",
@@ -334,7 +675,7 @@ class Database:
                 }
 
 
-        response = self.request_session.get(self.api_url, params = params)
+        response = self.transport.get(self.api_url, params = params, headers = self.api_header)
 
         logging.debug(f"Got response from server\nstatus: {response.status_code}\nbody: {response.text}")
         
@@ -357,6 +698,8 @@ class Database:
 
         @return, a string of the name 
         '''
+        if equipment_id in self.equipment_names:
+            return self.equipment_names[equipment_id]
 
         logging.debug("Getting the equipment name")
 
@@ -366,7 +709,7 @@ class Database:
                 }
 
 
-        response = self.request_session.get(self.api_url, params = params)
+        response = self.transport.get(self.api_url, params = params, headers = self.api_header)
 
         logging.debug(f"Got response from server\nstatus: {response.status_code}\nbody: {response.text}")
         
@@ -381,12 +724,13 @@ class Database:
 
     def record_ip(self, equipment_id, ip):
         '''
-        Gets the name of the equipment given the equipment id 
+        Records the IP address of the portal box
 
-        @return, a string of the name 
+        @param equipment_id: The ID assigned to the portal box
+        @param ip: The IP address of the portal box
         '''
 
-        logging.debug("Getting the equipment name")
+        logging.debug("Recording the IP address of the portal box")
 
         params = {
                 "mode" : "record_ip",
@@ -394,13 +738,88 @@ class Database:
                 "ip_address" : ip
                 }
 
+        self.log(params)
+
+
+    def log(self, params):
+        '''
+        Send a logging request to the database. When the log spool is enabled
+        the request is written to the spool and sent in the background
+        otherwise it is sent immediately.
+
+        @param (dict)params - the parameters of the request
+        '''
+        if self.log_spool:
+            self.log_spool.append(params)
+        else:
+            try:
+                self.post_log(params)
+            except Exception as e:
+                # a lost record is better than stopping the box
+                logging.error(f"Unable to send logging request: {e}")
+
+
+    def post_log(self, params, idempotency_key = None):
+        '''
+        Send a logging request to the database
+
+        @param (dict)params - the parameters of the request
+        @param (string)idempotency_key - an optional key, unique to the
+            request, allowing the database to ignore a repeated request
+        @return True if the request needs no further attention, False if it
+            should be retried
+        '''
+        headers = dict(self.api_header)
+        if idempotency_key:
+            # a request carrying an idempotency key is safe to repeat
+            headers["Idempotency-Key"] = idempotency_key
 
-        response = self.request_session.post(self.api_url, params = params)
+        response = self.transport.post(self.api_url, params = params, headers = headers,
+            retry = idempotency_key is not None)
 
         logging.debug(f"Got response from server\nstatus: {response.status_code}\nbody: {response.text}")
-        
+        logging.debug(f"Took {response.elapsed.total_seconds()}")
+
         if(response.status_code != 200):
-            #If we don't get a succses status code, then return and unouthorized user 
             logging.error(f"API error")
-            return "Unknown"
+            # the request itself was rejected, repeating it will not help
+            return 400 <= response.status_code < 500
+
+        return True
 
+
+    def stats(self):
+        '''
+        Gather statistics about the client, for monitoring
+
+        @return a dictionary of statistics keyed by component
+        '''
+        stats = {
+                "transport": self.transport.stats(),
+                "single_flight": self.single_flight.stats()
+                }
+        if self.card_cache:
+            stats["card_cache"] = self.card_cache.stats()
+        if self.log_spool:
+            stats["log_spool"] = self.log_spool.stats()
+        if self.roster:
+            stats["roster"] = self.roster.stats()
+        if self.attempt_aggregator:
+            stats["attempt_aggregator"] = self.attempt_aggregator.stats()
+
+        return stats
+
+
+    def close(self):
+        '''
+        Release the resources held by the client
+        '''
+        if self.roster:
+            self.roster.stop()
+        if self.card_cache:
+            self.card_cache.close()
+        if self.attempt_aggregator:
+            # before the spool is closed so the counts are spooled
+            self.attempt_aggregator.close()
+        if self.log_spool:
+            self.log_spool.close()
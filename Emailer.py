@@ -51,6 +51,20 @@ class Emailer:
         logging.info("Emailed: %s about: %s", to, subject)
 
 
+    def check_connection(self, timeout = 10):
+        """
+        Connect to the configured server and disconnect again
+
+        params:
+            timeout - The number of seconds to wait for the server
+        raises:
+            OSError or smtplib.SMTPException if the server can't be reached
+        """
+        server = smtplib.SMTP(self.settings['smtp_server'], int(self.settings['smtp_port']), timeout = timeout)
+        server.noop()
+        server.quit()
+
+
 # Rest of this file is the test suite. Use `python3 Email.py` to run
 # check prevents running of test suite if loading (import) as a module
 if __name__ == "__main__":
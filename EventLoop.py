@@ -0,0 +1,183 @@
+#!python3
+
+"""
+The event queue the service's main loop blocks on, so the loop only wakes
+when there is something to do rather than spinning.
+"""
+
+# from standard library
+import logging
+import queue
+import threading
+from time import monotonic, thread_time
+
+# Definitions aka constants
+DEFAULT_IDLE_INTERVAL = 1.0
+DEFAULT_QUEUE_SIZE = 32
+DEFAULT_STATS_INTERVAL = 300
+
+class Event:
+    '''
+    Something the main loop must react to
+
+    kind is one of the EventLoop event kinds, data depends on the kind and
+    time is the monotonic time at which the event occurred
+    '''
+
+    def __init__(self, kind, data = None, time = None):
+        self.kind = kind
+        self.data = data
+        self.time = time if time is not None else monotonic()
+
+
+class EventLoop:
+    '''
+    Deliver events, posted from any thread, to the main loop through a
+    bounded queue
+
+    wait() produces a TIMEOUT event when the deadline it was given passes, or
+    after idle_interval seconds without an event so the loop can notice it
+    has been asked to stop. Wakeups, the delay between an event occurring and
+    the loop receiving it and the CPU time used by the thread calling wait()
+    are measured and logged every stats_interval seconds.
+    '''
+
+    # posted events
+    BUTTON = "button"
+    CARD_PRESENT = "card_present"
+    CARD_REMOVED = "card_removed"
+    CARD_DETAILS = "card_details"
+    PROFILE = "profile"
+    FATAL = "fatal"
+    # events produced by wait()
+    TIMEOUT = "timeout"
+
+    def __init__(self, settings = {}):
+        '''
+        @param (dict)settings - a dictionary which may include the keys
+            'idle_interval', the longest the loop sleeps without an event,
+            'queue_size', the number of events which may be waiting and
+            'stats_interval', the seconds between logging the loop's
+            statistics, 0 to not log them
+        '''
+        self.idle_interval = DEFAULT_IDLE_INTERVAL
+        if "idle_interval" in settings:
+            self.idle_interval = float(settings["idle_interval"])
+
+        queue_size = DEFAULT_QUEUE_SIZE
+        if "queue_size" in settings:
+            queue_size = int(settings["queue_size"])
+
+        self.stats_interval = DEFAULT_STATS_INTERVAL
+        if "stats_interval" in settings:
+            self.stats_interval = float(settings["stats_interval"])
+
+        self.events = queue.Queue(queue_size)
+
+        self.lock = threading.Lock()
+        self.dropped = 0
+        self.wakeups = 0
+        # event kind -> [count, total latency, max latency]
+        self.latencies = {}
+        self.started = monotonic()
+        self.started_cpu = None
+        self.last_cpu = None
+        self.report_at = self.started + self.stats_interval
+        self.report_wakeups = 0
+        self.report_started = self.started
+        self.report_started_cpu = None
+
+
+    def post(self, kind, data = None, time = None, block = True):
+        '''
+        Post an event for the main loop, may be called from any thread
+
+        @param time - the monotonic time the event occurred, by default now
+        @param (boolean)block - whether to wait for room in the queue
+        @return True if the event was queued, False if the queue was full
+        '''
+        try:
+            self.events.put(Event(kind, data, time), block)
+            return True
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return False
+
+
+    def wait(self, timeout = None):
+        '''
+        Block until an event is posted or timeout seconds pass
+
+        @param (float)timeout - the seconds until the caller's next deadline,
+            None if it has none
+        @return the Event
+        '''
+        if self.started_cpu is None:
+            # CPU time is measured on the thread running the loop
+            self.started_cpu = thread_time()
+            self.report_started_cpu = self.started_cpu
+            self.last_cpu = self.started_cpu
+
+        if timeout is None or timeout > self.idle_interval:
+            timeout = self.idle_interval
+
+        try:
+            event = self.events.get(timeout = max(0, timeout))
+            now = monotonic()
+            latency = now - event.time
+            with self.lock:
+                record = self.latencies.setdefault(event.kind, [0, 0.0, 0.0])
+                record[0] += 1
+                record[1] += latency
+                record[2] = max(record[2], latency)
+        except queue.Empty:
+            now = monotonic()
+            event = Event(EventLoop.TIMEOUT, time = now)
+
+        self.wakeups += 1
+        self.report_wakeups += 1
+        self.last_cpu = thread_time()
+        if 0 < self.stats_interval and now >= self.report_at:
+            self._report(now)
+
+        return event
+
+
+    def _report(self, now):
+        cpu = self.last_cpu
+        elapsed = now - self.report_started
+        logging.info("Main loop: %.2f wakeups per second, %.2f%% CPU",
+            self.report_wakeups / elapsed,
+            100 * (cpu - self.report_started_cpu) / elapsed)
+
+        self.report_at = now + self.stats_interval
+        self.report_started = now
+        self.report_started_cpu = cpu
+        self.report_wakeups = 0
+
+
+    def stats(self):
+        '''
+        @return a dictionary of the wakeups and the CPU utilization of the
+            loop, up to its last wakeup, since it started, the number of
+            events dropped because the queue was full and, by kind of event,
+            the number of events and their mean and maximum latency in seconds
+        '''
+        elapsed = max(monotonic() - self.started, 1e-9)
+        cpu = 0 if self.started_cpu is None else self.last_cpu - self.started_cpu
+        with self.lock:
+            latency = {kind: {
+                    "count": count,
+                    "mean": total / count,
+                    "max": longest
+                } for kind, (count, total, longest) in self.latencies.items()}
+            dropped = self.dropped
+
+        return {
+            "wakeups": self.wakeups,
+            "wakeups_per_second": self.wakeups / elapsed,
+            "cpu_utilization": cpu / elapsed,
+            "dropped": dropped,
+            "latency": latency
+        }
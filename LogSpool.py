@@ -0,0 +1,239 @@
+#!python3
+
+"""
+A durable, append only spool for the logging calls made to the backend so
+that the state machine never waits on, and never loses, a usage record.
+"""
+
+# from standard library
+from collections import deque
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+
+# Definitions aka constants
+DEFAULT_PATH = "log_spool.jsonl"
+DEFAULT_BATCH_SIZE = 20
+DEFAULT_MIN_RETRY_DELAY = 1.0
+DEFAULT_MAX_RETRY_DELAY = 60.0
+
+class LogSpool:
+    '''
+    Queue requests on disk and deliver them in order from a background thread
+
+    Each request is appended to a file as a line of JSON holding a sequence
+    number, an idempotency key and the request parameters. The flusher thread
+    delivers requests oldest first in batches, retrying with an exponential
+    backoff until the backend accepts them, then records the sequence number
+    of the last delivered request in an acknowledgement file. Requests still
+    in the file at startup are delivered again, the idempotency key allows the
+    backend to recognize any it has already seen.
+    '''
+
+    def __init__(self, send, settings = {}):
+        '''
+        Open (creating if necessary) the spool and start delivering requests
+
+        @param (callable)send - called as send(params, idempotency_key) to
+            deliver a request. It should return True when the request needs no
+            further attention and False or raise an exception when it should
+            be retried
+        @param (dict)settings - a dictionary which may include the keys
+            'log_spool_path', 'log_spool_batch_size', 'log_spool_fsync',
+            'log_spool_min_retry_delay' and 'log_spool_max_retry_delay'
+        '''
+        self.send = send
+
+        self.path = DEFAULT_PATH
+        if "log_spool_path" in settings:
+            self.path = settings["log_spool_path"]
+        self.ack_path = self.path + ".ack"
+
+        self.batch_size = DEFAULT_BATCH_SIZE
+        if "log_spool_batch_size" in settings:
+            self.batch_size = int(settings["log_spool_batch_size"])
+
+        # fsync'ing each request survives power loss but on an SD card costs
+        # milliseconds rather than microseconds per request
+        self.fsync = False
+        if "log_spool_fsync" in settings:
+            self.fsync = settings["log_spool_fsync"].lower() in ("yes", "true", "1")
+
+        self.min_retry_delay = DEFAULT_MIN_RETRY_DELAY
+        if "log_spool_min_retry_delay" in settings:
+            self.min_retry_delay = float(settings["log_spool_min_retry_delay"])
+
+        self.max_retry_delay = DEFAULT_MAX_RETRY_DELAY
+        if "log_spool_max_retry_delay" in settings:
+            self.max_retry_delay = float(settings["log_spool_max_retry_delay"])
+
+        self.sent = 0
+        self.retries = 0
+
+        self.condition = threading.Condition()
+        self.running = True
+        self.pending = deque()
+        self.last_acked = self._read_ack()
+        self.next_seq = self.last_acked + 1
+        self._load()
+
+        self.file = open(self.path, "a")
+
+        self.flusher = threading.Thread(target = self._run, name = "log_spool", daemon = True)
+        self.flusher.start()
+
+
+    def append(self, params):
+        '''
+        Add a request to the end of the spool
+
+        @param (dict)params - the parameters of the request
+        @return (string) the idempotency key assigned to the request
+        '''
+        with self.condition:
+            record = {
+                "seq": self.next_seq,
+                "key": uuid.uuid4().hex,
+                "time": time.time(),
+                "params": params
+            }
+            self.next_seq += 1
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+            if self.fsync:
+                os.fsync(self.file.fileno())
+            self.pending.append(record)
+            self.condition.notify()
+
+        return record["key"]
+
+
+    def close(self, timeout = 5.0):
+        '''
+        Try to deliver the pending requests before stopping the flusher.
+        Requests which could not be delivered in time remain on disk and are
+        delivered the next time the spool is opened.
+
+        @param (float)timeout - how long, in seconds, to wait for delivery
+        '''
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while self.pending and time.monotonic() < deadline:
+                self.condition.wait(deadline - time.monotonic())
+            self.running = False
+            self.condition.notify_all()
+
+        self.flusher.join(timeout)
+        with self.condition:
+            self.file.close()
+
+        if self.pending:
+            logging.info("%d logging requests remain in the spool", len(self.pending))
+
+
+    def stats(self):
+        '''
+        @return a dictionary of counters describing the spool
+        '''
+        with self.condition:
+            return {
+                "pending": len(self.pending),
+                "sent": self.sent,
+                "retries": self.retries
+            }
+
+
+    def _run(self):
+        '''
+        Deliver requests in order until stopped
+        '''
+        delay = self.min_retry_delay
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                batch = [self.pending[i] for i in range(min(self.batch_size, len(self.pending)))]
+
+            delivered = 0
+            for record in batch:
+                try:
+                    if not self.send(record["params"], record["key"]):
+                        break
+                except Exception as e:
+                    logging.info(f"Unable to deliver spooled request: {e}")
+                    break
+                delivered += 1
+
+            with self.condition:
+                if delivered:
+                    for _ in range(delivered):
+                        self.pending.popleft()
+                    self.sent += delivered
+                    self._acknowledge(batch[delivered - 1]["seq"])
+                    self.condition.notify_all()
+
+                if delivered < len(batch):
+                    # back off, with jitter so a fleet of boxes does not
+                    # retry in lock step when the backend comes back
+                    self.retries += 1
+                    deadline = time.monotonic() + delay * random.uniform(0.5, 1.0)
+                    while self.running and time.monotonic() < deadline:
+                        self.condition.wait(deadline - time.monotonic())
+                    delay = min(delay * 2, self.max_retry_delay)
+                else:
+                    delay = self.min_retry_delay
+
+
+    def _acknowledge(self, seq):
+        '''
+        Record that every request up to and including seq has been delivered.
+        When nothing is pending the spool file is emptied. Caller must hold
+        the condition's lock.
+        '''
+        self.last_acked = seq
+        temp_path = self.ack_path + ".tmp"
+        with open(temp_path, "w") as ack_file:
+            ack_file.write(str(seq))
+        os.replace(temp_path, self.ack_path)
+
+        if not self.pending:
+            self.file.truncate(0)
+
+
+    def _read_ack(self):
+        '''
+        @return the sequence number of the last delivered request
+        '''
+        try:
+            with open(self.ack_path) as ack_file:
+                return int(ack_file.read())
+        except (OSError, ValueError):
+            return 0
+
+
+    def _load(self):
+        '''
+        Queue the requests left in the spool by a previous run
+        '''
+        try:
+            with open(self.path) as spool_file:
+                for line in spool_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # a partial line left by a crash mid write
+                        continue
+                    if record["seq"] > self.last_acked:
+                        self.pending.append(record)
+                        self.next_seq = max(self.next_seq, record["seq"] + 1)
+        except FileNotFoundError:
+            pass
+
+        if self.pending:
+            logging.info("Found %d undelivered logging requests in the spool", len(self.pending))
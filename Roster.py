@@ -0,0 +1,202 @@
+#!python3
+
+"""
+A local copy of the card records for an equipment type so authorization
+decisions can be made without contacting the backend.
+"""
+
+# from standard library
+import json
+import logging
+import os
+import threading
+import time
+
+# Definitions aka constants
+DEFAULT_PATH = "roster.json"
+DEFAULT_SYNC_INTERVAL = 300
+
+class Roster:
+    '''
+    Hold every card record for an equipment type in memory and in a local
+    file, periodically bringing them up to date with the database
+
+    The roster remembers the revision it was last synced to and asks the
+    database only for the changes since then. Changes are applied to a copy
+    of the records which then replaces the roster in one step, so a lookup
+    never sees a partially applied sync.
+    '''
+
+    def __init__(self, db, equipment_type_id, settings = {}):
+        '''
+        Load the roster saved by a previous run, if any, and start syncing
+        with the database
+
+        @param (Database)db - the database to sync with
+        @param (int)equipment_type_id - the equipment type to hold records for
+        @param (dict)settings - a dictionary which may include the keys
+            'roster_path' the file to keep the roster in and
+            'roster_sync_interval' the number of seconds between syncs
+        '''
+        self.db = db
+        self.equipment_type_id = equipment_type_id
+
+        self.path = DEFAULT_PATH
+        if "roster_path" in settings:
+            self.path = settings["roster_path"]
+
+        self.sync_interval = DEFAULT_SYNC_INTERVAL
+        if "roster_sync_interval" in settings:
+            self.sync_interval = int(settings["roster_sync_interval"])
+
+        self.lock = threading.Lock()
+        self.records = None
+        self.revision = 0
+        self.synced_at = None
+        self.syncs = 0
+        self.snapshots = 0
+        self.sync_failures = 0
+        self._load()
+
+        self.stopped = threading.Event()
+        self.syncer = threading.Thread(target = self._run, name = "roster_sync", daemon = True)
+        self.syncer.start()
+
+
+    def is_loaded(self):
+        '''
+        @return True once a roster has been loaded from disk or the database
+        '''
+        with self.lock:
+            return self.records is not None
+
+
+    def lookup(self, card_id):
+        '''
+        @return the record for the card or None if the card is not in the
+            roster
+        '''
+        with self.lock:
+            if self.records is None:
+                return None
+            return self.records.get(card_id)
+
+
+    def sync(self):
+        '''
+        Bring the roster up to date with the database
+
+        @return True if the roster was updated
+        '''
+        with self.lock:
+            revision = self.revision if self.records is not None else 0
+
+        changes = self.db.get_roster_changes(self.equipment_type_id, revision)
+        if changes is None:
+            with self.lock:
+                self.sync_failures += 1
+            return False
+
+        with self.lock:
+            if changes["snapshot"]:
+                records = changes["cards"]
+                self.snapshots += 1
+            elif self.records is None:
+                # changes can only be applied to a roster already held
+                self.sync_failures += 1
+                logging.error("Ignoring roster changes sent without a roster to apply them to")
+                return False
+            else:
+                records = dict(self.records)
+                records.update(changes["cards"])
+                for card_id in changes["revoked"]:
+                    records.pop(card_id, None)
+
+            self.records = records
+            self.revision = changes["revision"]
+            self.synced_at = time.time()
+            self.syncs += 1
+            synced_at = self.synced_at
+
+        # the records are replaced, never modified, so can be written out
+        # without holding the lock
+        self._save(records, changes["revision"], synced_at)
+
+        logging.debug("Synced roster to revision %d, %d changed and %d revoked cards",
+            changes["revision"], len(changes["cards"]), len(changes["revoked"]))
+        return True
+
+
+    def stop(self):
+        '''
+        Stop syncing with the database
+        '''
+        self.stopped.set()
+
+
+    def stats(self):
+        '''
+        @return a dictionary describing the roster
+        '''
+        with self.lock:
+            return {
+                "cards": len(self.records) if self.records is not None else 0,
+                "revision": self.revision,
+                "synced_at": self.synced_at,
+                "syncs": self.syncs,
+                "snapshots": self.snapshots,
+                "sync_failures": self.sync_failures
+            }
+
+
+    def _run(self):
+        '''
+        Sync on startup then every sync_interval seconds until stopped
+        '''
+        while not self.stopped.is_set():
+            try:
+                self.sync()
+            except Exception as e:
+                with self.lock:
+                    self.sync_failures += 1
+                logging.info(f"Unable to sync roster: {e}")
+            self.stopped.wait(self.sync_interval)
+
+
+    def _save(self, records, revision, synced_at):
+        '''
+        Write the roster to disk, replacing the previous copy atomically
+        '''
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as roster_file:
+            json.dump({
+                "equipment_type_id": self.equipment_type_id,
+                "revision": revision,
+                "synced_at": synced_at,
+                "records": records
+            }, roster_file)
+        os.replace(temp_path, self.path)
+
+
+    def _load(self):
+        '''
+        Load the roster saved by a previous run
+        '''
+        try:
+            with open(self.path) as roster_file:
+                saved = json.load(roster_file)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logging.error("Ignoring corrupt roster file %s", self.path)
+            return
+
+        if saved["equipment_type_id"] != self.equipment_type_id:
+            logging.info("Ignoring roster saved for a different equipment type")
+            return
+
+        # JSON object keys are always strings, card ids are integers
+        self.records = {int(card_id): record for card_id, record in saved["records"].items()}
+        self.revision = saved.get("revision", 0)
+        self.synced_at = saved["synced_at"]
+        logging.info("Loaded roster of %d cards", len(self.records))
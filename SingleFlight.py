@@ -0,0 +1,91 @@
+#!python3
+
+"""
+Coalesce concurrent requests for the same thing into a single request.
+"""
+
+# from standard library
+import threading
+
+class _Call:
+    '''
+    A call in flight, shared by every caller asking for its key
+    '''
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    '''
+    Run a function at most once at a time per key
+
+    The first caller for a key runs the function. Callers asking for the same
+    key while it runs wait for it and receive its result, or have its
+    exception raised, instead of running the function again.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.executed = 0
+        self.coalesced = 0
+
+
+    def do(self, key, function, *args):
+        '''
+        Call function(*args) unless a call for key is already in flight, in
+        which case wait for and share its outcome
+
+        @param key - a hashable value identifying the request
+        @return the result of the function
+        '''
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                is_leader = False
+            else:
+                call = _Call()
+                self.calls[key] = call
+                self.executed += 1
+                is_leader = True
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+
+    def in_flight(self, key):
+        '''
+        @return True if a call for key is in flight
+        '''
+        with self.lock:
+            return key in self.calls
+
+
+    def stats(self):
+        '''
+        @return a dictionary of the number of calls made and the number of
+            calls saved by sharing an in flight call
+        '''
+        with self.lock:
+            return {
+                "executed": self.executed,
+                "coalesced": self.coalesced
+            }
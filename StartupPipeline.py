@@ -0,0 +1,115 @@
+#!python3
+
+"""
+Run the steps of starting the service concurrently, respecting the order
+some steps must run in, and time each step.
+"""
+
+# from standard library
+import logging
+import threading
+from time import monotonic
+
+class _Step:
+    '''
+    A step of the pipeline and its outcome
+    '''
+
+    def __init__(self, name, function, requires, critical, wait):
+        self.name = name
+        self.function = function
+        self.requires = requires
+        self.critical = critical
+        self.wait = wait
+        self.done = threading.Event()
+        self.error = None
+        self.skipped = False
+        self.duration = None
+
+
+class StartupPipeline:
+    '''
+    A set of steps, each run on its own thread as soon as the steps it
+    requires have completed
+
+    A step which raises an exception fails, and every step requiring it is
+    skipped. run() raises the exception of the first critical step to fail.
+    Steps which are not waited for keep running after run() returns.
+    '''
+
+    def __init__(self):
+        self.steps = {}
+        self.duration = None
+
+
+    def add(self, name, function, requires = (), critical = True, wait = True):
+        '''
+        Add a step to the pipeline
+
+        @param (string)name - the name of the step
+        @param (callable)function - called, without arguments, to run the step
+        @param (tuple)requires - the names of steps which must complete before
+            this step runs, they must already have been added
+        @param (boolean)critical - whether the pipeline fails if the step fails
+        @param (boolean)wait - whether run() waits for the step to complete
+        '''
+        if name in self.steps:
+            raise ValueError(f"Startup step {name} has already been added")
+        for requirement in requires:
+            if requirement not in self.steps:
+                raise ValueError(f"Startup step {name} requires unknown step {requirement}")
+
+        self.steps[name] = _Step(name, function, tuple(requires), critical, wait)
+
+
+    def run(self):
+        '''
+        Run the steps, waiting for those which are to be waited for
+
+        @raise the exception raised by the first critical step to fail
+        '''
+        started = monotonic()
+        for step in self.steps.values():
+            threading.Thread(target = self._run_step, args = (step,),
+                name = f"startup_{step.name}", daemon = True).start()
+
+        for step in self.steps.values():
+            if step.wait:
+                step.done.wait()
+
+        self.duration = monotonic() - started
+        logging.info("Startup steps completed in %.3f seconds", self.duration)
+
+        for step in self.steps.values():
+            if step.wait and step.critical and step.error is not None:
+                raise step.error
+
+
+    def _run_step(self, step):
+        for requirement in step.requires:
+            required = self.steps[requirement]
+            required.done.wait()
+            if required.error is not None:
+                logging.error("Skipping startup step %s, %s failed", step.name, requirement)
+                step.skipped = True
+                step.error = required.error
+                step.done.set()
+                return
+
+        started = monotonic()
+        try:
+            step.function()
+        except Exception as e:
+            step.error = e
+            logging.error("Startup step %s failed: %s", step.name, e)
+        step.duration = monotonic() - started
+        logging.info("Startup step %s took %.3f seconds", step.name, step.duration)
+        step.done.set()
+
+
+    def timings(self):
+        '''
+        @return a dictionary of the seconds each step took keyed by step name,
+            None for steps which have not completed or were skipped
+        '''
+        return {name: step.duration for name, step in self.steps.items()}
@@ -0,0 +1,94 @@
+#!python3
+
+"""
+A local copy of the last equipment profile the backend assigned to this box
+so the box can start without waiting for the backend.
+"""
+
+# from standard library
+import json
+import logging
+import os
+import time
+
+# Definitions aka constants
+DEFAULT_PATH = "startup_snapshot.json"
+
+class StartupSnapshot:
+    '''
+    Save and load the equipment profile record for a MAC address
+
+    The record is saved as received from the database so the equipment
+    profile and the equipment type's training and payment requirements are
+    restored together.
+    '''
+
+    def __init__(self, settings = {}):
+        '''
+        @param (dict)settings - a dictionary which may include the key
+            'startup_snapshot_path' the file to keep the snapshot in
+        '''
+        self.path = DEFAULT_PATH
+        if "startup_snapshot_path" in settings:
+            self.path = settings["startup_snapshot_path"]
+
+
+    def load(self, mac_address):
+        '''
+        @return the equipment profile record saved for the MAC address or None
+            if there is no usable snapshot
+        '''
+        try:
+            with open(self.path) as snapshot_file:
+                saved = json.load(snapshot_file)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logging.error("Ignoring corrupt startup snapshot %s", self.path)
+            return None
+
+        if saved.get("mac_address") != mac_address:
+            logging.info("Ignoring startup snapshot saved for a different box")
+            return None
+
+        logging.info("Loaded startup snapshot saved at %s",
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(saved["saved_at"])))
+        return saved["profile"]
+
+
+    def save(self, mac_address, profile):
+        '''
+        Save the equipment profile record, replacing the previous snapshot
+        atomically. The snapshot is only written when the record has changed.
+
+        @param (string)mac_address - the MAC address the profile is assigned to
+        @param (dict)profile - the equipment profile record from the database
+        '''
+        try:
+            with open(self.path) as snapshot_file:
+                saved = json.load(snapshot_file)
+            if saved.get("mac_address") == mac_address and saved.get("profile") == profile:
+                return
+        except (OSError, ValueError):
+            pass
+
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as snapshot_file:
+            json.dump({
+                "mac_address": mac_address,
+                "saved_at": time.time(),
+                "profile": profile
+            }, snapshot_file)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temp_path, self.path)
+
+
+    def discard(self):
+        '''
+        Remove the snapshot, so the next start waits for the backend
+        '''
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,287 @@
+#!python3
+
+"""
+The HTTP transport used to talk to the backend: bounded timeouts, retries
+with backoff and a circuit breaker so an unreachable backend fails fast.
+"""
+
+# from standard library
+import logging
+import random
+import threading
+import time
+
+# third party
+import requests
+
+# Definitions aka constants
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 10.0
+DEFAULT_RETRY_ATTEMPTS = 3
+DEFAULT_RETRY_BUDGET = 10.0
+DEFAULT_BACKOFF_BASE = 0.25
+DEFAULT_BACKOFF_MAX = 4.0
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_RESET = 30.0
+DEFAULT_POOL_CONNECTIONS = 2
+DEFAULT_POOL_MAXSIZE = 4
+
+class CircuitOpenError(Exception):
+    """
+    Exception to raise when a request is refused without being sent because
+    recent requests to the backend have failed
+    """
+
+    pass
+
+class CircuitBreaker:
+    '''
+    Track failures of requests to the backend
+
+    The breaker starts closed, letting every request through. After
+    failure_threshold consecutive failures it opens, refusing requests, for
+    reset_timeout seconds. It then lets a single probe request through; if
+    the probe succeeds the breaker closes, if it fails the breaker opens again.
+    '''
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half open"
+
+    def __init__(self, failure_threshold = DEFAULT_BREAKER_THRESHOLD, reset_timeout = DEFAULT_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.trips = 0
+        self.rejected = 0
+
+
+    def allow(self):
+        '''
+        @return True if a request may be sent
+        '''
+        with self.lock:
+            if self.state == CircuitBreaker.CLOSED:
+                return True
+
+            if self.state == CircuitBreaker.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                logging.info("Circuit breaker probing the backend")
+                self.state = CircuitBreaker.HALF_OPEN
+                return True
+
+            self.rejected += 1
+            return False
+
+
+    def record_success(self):
+        with self.lock:
+            if self.state != CircuitBreaker.CLOSED:
+                logging.info("Circuit breaker closed, the backend has recovered")
+            self.state = CircuitBreaker.CLOSED
+            self.failures = 0
+
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == CircuitBreaker.HALF_OPEN or (
+                    self.state == CircuitBreaker.CLOSED and self.failures >= self.failure_threshold):
+                logging.error("Circuit breaker opened after %d failed requests", self.failures)
+                self.state = CircuitBreaker.OPEN
+                self.opened_at = time.monotonic()
+                self.trips += 1
+
+
+    def stats(self):
+        '''
+        @return a dictionary describing the breaker
+        '''
+        with self.lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "trips": self.trips,
+                "rejected": self.rejected
+            }
+
+
+class Transport:
+    '''
+    Send HTTP requests with connect and read timeouts, retrying failed
+    requests with a jittered exponential backoff
+
+    A request is retried when it fails to connect, times out or receives a
+    5xx response, up to retry_attempts tries or until retry_budget seconds
+    have been spent, whichever comes first. The timeouts of an attempt are
+    cut short so it ends by the time the budget is spent. Only requests which are safe to
+    repeat are retried, by default GET requests. Every failure is reported to
+    a circuit breaker and while the breaker is open requests fail immediately
+    with CircuitOpenError.
+
+    Connections are kept alive and reused from a pool, so one Transport
+    should be shared by every client talking to the same backend.
+    '''
+
+    def __init__(self, settings = {}):
+        '''
+        @param (dict)settings - a dictionary which may include the keys
+            'connect_timeout', 'read_timeout', 'retry_attempts',
+            'retry_budget', 'circuit_breaker_threshold',
+            'circuit_breaker_reset', 'pool_connections', the number of hosts
+            to keep connections to, and 'pool_maxsize', the number of
+            connections to keep to each host. Times are in seconds
+        '''
+        self.connect_timeout = DEFAULT_CONNECT_TIMEOUT
+        if "connect_timeout" in settings:
+            self.connect_timeout = float(settings["connect_timeout"])
+
+        self.read_timeout = DEFAULT_READ_TIMEOUT
+        if "read_timeout" in settings:
+            self.read_timeout = float(settings["read_timeout"])
+
+        self.retry_attempts = DEFAULT_RETRY_ATTEMPTS
+        if "retry_attempts" in settings:
+            self.retry_attempts = max(1, int(settings["retry_attempts"]))
+
+        self.retry_budget = DEFAULT_RETRY_BUDGET
+        if "retry_budget" in settings:
+            self.retry_budget = float(settings["retry_budget"])
+
+        self.backoff_base = DEFAULT_BACKOFF_BASE
+        self.backoff_max = DEFAULT_BACKOFF_MAX
+
+        failure_threshold = DEFAULT_BREAKER_THRESHOLD
+        if "circuit_breaker_threshold" in settings:
+            failure_threshold = int(settings["circuit_breaker_threshold"])
+
+        reset_timeout = DEFAULT_BREAKER_RESET
+        if "circuit_breaker_reset" in settings:
+            reset_timeout = float(settings["circuit_breaker_reset"])
+
+        pool_connections = DEFAULT_POOL_CONNECTIONS
+        if "pool_connections" in settings:
+            pool_connections = int(settings["pool_connections"])
+
+        pool_maxsize = DEFAULT_POOL_MAXSIZE
+        if "pool_maxsize" in settings:
+            pool_maxsize = int(settings["pool_maxsize"])
+
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.session = requests.Session()
+        # retries are handled here so the adapter must not retry on its own
+        adapter = requests.adapters.HTTPAdapter(pool_connections = pool_connections,
+            pool_maxsize = pool_maxsize, max_retries = 0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+
+
+    def request(self, method, url, retry = None, **kwargs):
+        '''
+        Send a request
+
+        @param (string)method - the HTTP method
+        @param (string)url - the url to send the request to
+        @param (boolean)retry - whether the request may be retried, defaults
+            to True for GET requests and False otherwise
+        @param kwargs - passed on to requests.Session.request()
+        @return the requests.Response, which may be a 5xx response if retries
+            were exhausted
+        @raise CircuitOpenError if the circuit breaker is open
+        @raise requests.RequestException if the last attempt failed, any
+            other exception raised sending the request is raised without
+            retrying
+        '''
+        if retry is None:
+            retry = "GET" == method
+        attempts = self.retry_attempts if retry else 1
+        deadline = time.monotonic() + self.retry_budget
+
+        attempt = 0
+        while True:
+            # no attempt may outlast the budget, the first has all of it
+            remaining = self.retry_budget
+            if attempt > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    if error is not None:
+                        raise error
+                    return response
+
+            if not self.breaker.allow():
+                raise CircuitOpenError(f"Not sending {method} request, the backend is unavailable")
+
+            with self.lock:
+                self.requests += 1
+
+            error = None
+            response = None
+            try:
+                response = self.session.request(method, url,
+                    timeout = (min(self.connect_timeout, remaining), min(self.read_timeout, remaining)),
+                    **kwargs)
+            except OSError as e:
+                # requests.RequestException is an OSError
+                error = e
+            except Exception:
+                # not worth retrying, but a probe must still reopen the
+                # breaker or it would stay half open refusing every request
+                self.breaker.record_failure()
+                with self.lock:
+                    self.failures += 1
+                raise
+
+            if error is None and response.status_code < 500:
+                self.breaker.record_success()
+                return response
+
+            self.breaker.record_failure()
+            with self.lock:
+                self.failures += 1
+
+            attempt += 1
+            delay = min(self.backoff_max, self.backoff_base * (2 ** attempt)) * random.uniform(0.5, 1.0)
+            if attempt >= attempts or time.monotonic() + delay >= deadline:
+                if error is not None:
+                    raise error
+                return response
+
+            logging.info("%s request failed (%s), retrying in %.2f seconds", method,
+                error if error is not None else response.status_code, delay)
+            with self.lock:
+                self.retries += 1
+            time.sleep(delay)
+
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+
+    def stats(self):
+        '''
+        @return a dictionary describing the transport and its circuit breaker
+        '''
+        with self.lock:
+            stats = {
+                "requests": self.requests,
+                "retries": self.retries,
+                "failures": self.failures
+            }
+        stats["circuit_breaker"] = self.breaker.stats()
+
+        return stats
@@ -1,4 +1,4 @@
-import requests
+from Transport import Transport
 
 class NotAuthorizedError(Exception):
     """
@@ -29,7 +29,7 @@ class Client:
     An interface to the web service responsible for coordinating portalboxes.
     """
 
-    def __init__(self, url: str, mac: str) -> None:
+    def __init__(self, url: str, mac: str, transport: Transport = None) -> None:
         """
         Parameters
         ----------
@@ -37,10 +37,14 @@ class Client:
             The base url; protocol, host name, and optionally port; of the website
         mac : str
             The MAC of the portalbox the code is running on
+        transport : Transport, optional
+            The pooled transport to send requests with, share one with the
+            Database to reuse its connections. By default one is created
         """
 
         self.url = url
         self.mac = mac
+        self.transport = transport if transport else Transport()
 
     def log_startup(self) -> None:
         """Inform service that the portalbox is now online
@@ -55,7 +59,7 @@ class Client:
 
         url = f"{self.url}/api/v2/box.php"
         params = {"mac": self.mac}
-        response = requests.post(url, params = params, data = "startup")
+        response = self.transport.post(url, params = params, data = "startup")
 
         if response.status_code == 404:
             raise NotRegisteredError()
@@ -63,6 +67,52 @@ class Client:
         if response.status_code == 409:
             raise OutOfServiceError()
 
+    def hello(self, ip: str = None) -> dict:
+        """Inform service that the portalbox is now online and get its profile in one request
+
+        Services without support for the combined request are sent the
+        request made by log_startup() instead
+
+        Parameters
+        ----------
+        ip : str, optional
+            The IP address of the portalbox
+
+        Returns
+        -------
+        dict
+            with the keys "profile", the equipment profile including the
+            equipment type's policy flags, and "equipment_name"; or None if
+            the service does not support the combined request
+
+        Raises
+        ------
+        NotRegisteredError
+            if the portalbox has not been registered with the web service
+        OutOfServiceError
+            if the portalbox is marked "Out of Service" in the web service
+        Exception
+            if the web service reports any other error
+        """
+
+        url = f"{self.url}/api/v2/box-hello.php"
+        params = {"mac": self.mac}
+        response = self.transport.post(url, params = params, json = {"status": "startup", "ip": ip})
+
+        if response.status_code == 409:
+            raise OutOfServiceError()
+
+        if response.status_code in (404, 405, 501):
+            # either the service lacks the combined request or the box is
+            # not registered, the legacy request tells which
+            self.log_startup()
+            return None
+
+        if response.status_code != 200:
+            raise Exception("Error introducing portalbox to the web service")
+
+        return response.json()
+
     def begin_usage_session(self, card_id: str):
         """Request that the service begin a usage session for the user associated with the card
 
@@ -74,8 +124,8 @@ class Client:
 
         url = f"{self.url}/api/v2/box-activation.php"
         params = {"mac": self.mac}
-        headers = request_headers = {'Authorization': f'Bearer {card_id}'}
-        response = requests.put(url, params = params, headers = headers)
+        headers = {'Authorization': f'Bearer {card_id}'}
+        response = self.transport.put(url, params = params, headers = headers)
 
         if response.status_code in (401, 403):
             raise NotAuthorizedError()
@@ -91,8 +141,8 @@ class Client:
 
         url = f"{self.url}/api/v2/box-activation.php"
         params = {"mac": self.mac}
-        headers = request_headers = {'Authorization': f'Bearer {card_id}'}
-        response = requests.post(url, params = params, headers = headers)
+        headers = {'Authorization': f'Bearer {card_id}'}
+        response = self.transport.post(url, params = params, headers = headers)
 
         if response.status_code in (401, 403):
             raise NotAuthorizedError()
@@ -0,0 +1,294 @@
+#!python3
+
+"""
+Measure the cost of the box's hot paths against the simulated hardware in
+portalbox/simulator.py, so changes to them can be compared off the Pi.
+
+Usage: python3 benchmark.py BENCHMARK [COUNT]
+
+COUNT is the iterations, or for benchmarks of the driver processes the
+seconds, each case of the benchmark runs for.
+"""
+# from standard library
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+from time import perf_counter, process_time
+
+# our code
+from portalbox import simulator
+from portalbox.DriverProtocol import CommandPipe, decode, encode
+
+# Definitions aka constants
+DEFAULT_ITERATIONS = 1000
+DEFAULT_SECONDS = 3
+UID = [0x12, 0x34, 0x56, 0x78]
+IRQ_PIN = 18
+
+CLI_HELP_MSG = "Usage: python3 benchmark.py BENCHMARK [COUNT]\n\nBenchmarks: "
+
+
+def read_card(reader):
+    '''
+    Scan for a card the way PortalBox.read_RFID_card does
+    '''
+    for attempts in range(2):
+        (status, _) = reader.MFRC522_Request(reader.PICC_REQIDL)
+        if reader.MI_OK == status:
+            (status, uid) = reader.MFRC522_Anticoll()
+            if reader.MI_OK == status:
+                return uid
+    return None
+
+
+def benchmark_rfid(iterations):
+    '''
+    SPI transfers, bytes and time per card read with and without a card
+    present, polling the reader and waiting on its IRQ line
+    '''
+    print(f"{'mode':8} {'card':8} {'transfers':>10} {'bytes':>8} {'us':>8}")
+    for mode in ("polling", "irq"):
+        for present in (False, True):
+            sim = simulator.install(irq_pin = IRQ_PIN)
+            from portalbox.MFRC522 import MFRC522
+            reader = MFRC522(pin_irq = IRQ_PIN if mode == "irq" else None)
+            if present:
+                sim.present(UID)
+
+            before = sim.stats()
+            started = perf_counter()
+            for _ in range(iterations):
+                read_card(reader)
+            elapsed = perf_counter() - started
+            after = sim.stats()
+
+            print(f"{mode:8} {'present' if present else 'absent':8}"
+                f" {(after['transfers'] - before['transfers']) / iterations:10.1f}"
+                f" {(after['bytes'] - before['bytes']) / iterations:8.1f}"
+                f" {1e6 * elapsed / iterations:8.1f}")
+
+
+def benchmark_presence(iterations):
+    '''
+    SPI transfers and time per read while a card stays on the reader,
+    scanning for and identifying it every read and checking the halted card
+    is still present. The simulated chip's timer takes as long as the real
+    one would.
+    '''
+    print(f"{'read':10} {'transfers':>10} {'bytes':>8} {'ms':>8}")
+    for check in (False, True):
+        sim = simulator.install(realtime = True)
+        from portalbox.MFRC522 import MFRC522
+        reader = MFRC522()
+        sim.present(UID)
+
+        uid = read_card(reader)
+        frame = reader.MFRC522_SelectFrame(uid)
+        if check:
+            reader.MFRC522_SelectTag(uid, frame)
+            reader.MFRC522_Halt()
+
+        before = sim.stats()
+        started = perf_counter()
+        for _ in range(iterations):
+            if check:
+                reader.MFRC522_IsPresent(frame)
+            else:
+                read_card(reader)
+        elapsed = perf_counter() - started
+        after = sim.stats()
+
+        print(f"{'presence' if check else 'scan':10}"
+            f" {(after['transfers'] - before['transfers']) / iterations:10.1f}"
+            f" {(after['bytes'] - before['bytes']) / iterations:8.1f}"
+            f" {1e3 * elapsed / iterations:8.3f}")
+
+
+def run_driver(driver, args, commands, seconds):
+    '''
+    Run a driver process's main function in this process for some seconds,
+    feeding it commands through a queue, and stop it as the OS would
+
+    @return the CPU seconds used and what the driver returned
+    '''
+    handlers = (signal.getsignal(signal.SIGTERM), signal.getsignal(signal.SIGINT))
+    command_queue = queue.Queue()
+    for command in commands:
+        command_queue.put(command)
+
+    stopper = threading.Timer(seconds, os.kill, (os.getpid(), signal.SIGTERM))
+    stopper.start()
+    started = process_time()
+    try:
+        result = driver(command_queue, *args)
+    finally:
+        signal.signal(signal.SIGTERM, handlers[0])
+        signal.signal(signal.SIGINT, handlers[1])
+    return (process_time() - started, result)
+
+
+def benchmark_dotstar(seconds):
+    '''
+    SPI writes, bytes and CPU per second of the Dotstar driver showing a
+    steady color and running each effect, and how late frames were shown
+    '''
+    simulator.install()
+    from portalbox.display import DotstarDriver
+    from portalbox.display.DotstarController import LED_COUNT, SPI_BUS, SPI_DEV
+
+    cases = {
+        "idle": [encode("color", 0, 0, 255)],
+        "pulse": [encode("pulse", 0, 0, 255)],
+        "blink": [encode("blink", 255, 0, 0, int(seconds * 1000), int(seconds * 5))],
+        "wipe": [encode("wipe", 0, 255, 0, int(seconds * 1000))]
+    }
+    print(f"{'case':8} {'writes/s':>10} {'bytes/s':>10} {'cpu %':>8}"
+        f" {'jitter ms':>10} {'max ms':>8} {'missed':>6}")
+    for (case, commands) in cases.items():
+        sim = simulator.install()
+        (cpu, stats) = run_driver(DotstarDriver.strip_driver, (LED_COUNT, SPI_BUS, SPI_DEV),
+            commands, seconds)
+        spi = sim.spi_device(SPI_BUS, SPI_DEV)
+        print(f"{case:8} {spi.writes / seconds:10.1f} {spi.bytes_written / seconds:10.1f}"
+            f" {100 * cpu / seconds:8.3f} {stats['mean_jitter_ms']:10.3f}"
+            f" {stats['max_jitter_ms']:8.3f} {stats['frames_missed']:6}")
+
+
+def benchmark_display(iterations):
+    '''
+    Time taken by the caller of each DotstarController call, alone and in
+    bursts of a color change followed by a flash, with the driver process
+    running against the simulated SPI bus
+    '''
+    simulator.install()
+    from portalbox.display.DotstarController import DotstarController
+
+    controller = DotstarController()
+    calls = {
+        "color": lambda i: controller.set_display_color(bytes((i % 256, 0, 0))),
+        "burst": lambda i: (controller.set_display_color(bytes((0, i % 256, 0))),
+            controller.flash_display(bytes((255, 0, 0)), 1000, 5))
+    }
+    print(f"{'call':8} {'mean us':>10} {'max us':>10}")
+    for (call, function) in calls.items():
+        longest = 0
+        started = perf_counter()
+        for i in range(iterations):
+            call_started = perf_counter()
+            function(i)
+            longest = max(longest, perf_counter() - call_started)
+        elapsed = perf_counter() - started
+        print(f"{call:8} {1e6 * elapsed / iterations:10.1f} {1e6 * longest:10.1f}")
+    controller.shutdown_display()
+
+
+def text_driver(commands, acks):
+    '''
+    Parse text commands from a queue as the drivers did, acknowledging each
+    '''
+    while True:
+        command = commands.get()
+        tokens = command.split()
+        params = [int(token) for token in tokens[1:]]
+        acks.send_bytes(b"0")
+        if tokens[0] == "stop":
+            return
+
+
+def binary_driver(commands, acks):
+    '''
+    Decode binary commands from a pipe, acknowledging each
+    '''
+    while True:
+        (name, params) = decode(commands.get())
+        acks.send_bytes(b"0")
+        if name == "stop":
+            return
+
+
+def benchmark_ipc(iterations):
+    '''
+    Round trips a second of color commands to a driver process, which
+    acknowledges each: text through a multiprocessing queue as the
+    controllers used to send them and binary through a CommandPipe
+    '''
+    cases = {
+        "text": (multiprocessing.Queue, text_driver,
+            lambda i: f"color {i % 256} 0 255\n", "stop 0 0 0\n"),
+        "binary": (CommandPipe, binary_driver,
+            lambda i: encode("color", i % 256, 0, 255), encode("stop", True, True, True))
+    }
+    print(f"{'protocol':10} {'commands/s':>12} {'bytes':>6}")
+    for (case, (channel, driver, command, stop)) in cases.items():
+        commands = channel()
+        (acks, driver_acks) = multiprocessing.Pipe(False)
+        process = multiprocessing.Process(target = driver, args = (commands, driver_acks))
+        process.start()
+
+        started = perf_counter()
+        for i in range(iterations):
+            commands.put(command(i))
+            acks.recv_bytes()
+        elapsed = perf_counter() - started
+
+        commands.put(stop)
+        acks.recv_bytes()
+        process.join()
+        print(f"{case:10} {iterations / elapsed:12.0f} {len(command(iterations)):6}")
+
+
+def benchmark_framebuffer(iterations):
+    '''
+    Writes and reads per pixel frames of the Dotstar strip's length through
+    the shared framebuffer, and for comparison sends each pixel's color as a
+    command through a CommandPipe
+    '''
+    from portalbox.display.FrameBuffer import FrameBuffer
+    length = 15
+    framebuffer = FrameBuffer(length)
+    frame = bytearray(4 * length)
+    colors = [bytes((i, 0, 255)) for i in range(length)]
+
+    started = perf_counter()
+    for i in range(iterations):
+        framebuffer.write(colors)
+        framebuffer.read(frame)
+    elapsed = perf_counter() - started
+    framebuffer.close()
+    framebuffer.unlink()
+    print(f"{'framebuffer':12} {iterations / elapsed:10.0f} frames/s")
+
+    commands = CommandPipe()
+    started = perf_counter()
+    for i in range(iterations):
+        for color in colors:
+            commands.put(encode("color", *color))
+        for color in colors:
+            decode(commands.get())
+    elapsed = perf_counter() - started
+    print(f"{'commands':12} {iterations / elapsed:10.0f} frames/s")
+
+
+BENCHMARKS = {
+    "display": (benchmark_display, DEFAULT_ITERATIONS),
+    "dotstar": (benchmark_dotstar, DEFAULT_SECONDS),
+    "framebuffer": (benchmark_framebuffer, DEFAULT_ITERATIONS * 10),
+    "ipc": (benchmark_ipc, DEFAULT_ITERATIONS * 10),
+    "presence": (benchmark_presence, DEFAULT_ITERATIONS),
+    "rfid": (benchmark_rfid, DEFAULT_ITERATIONS)
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print(CLI_HELP_MSG + ", ".join(BENCHMARKS))
+        sys.exit()
+
+    (benchmark, count) = BENCHMARKS[sys.argv[1]]
+    if 2 < len(sys.argv):
+        count = int(sys.argv[2])
+
+    benchmark(count)
@@ -16,7 +16,9 @@ import logging
 import threading
 
 # our code
+from CardPoller import GRACE, IDLE, RUNNING
 from CardType import CardType
+from StartupPipeline import StartupPipeline
 
 class State(object):
     """The parent state for all FSM states."""
@@ -28,6 +30,16 @@ class State(object):
     training_id = -1
     user_authority_level = 0
 
+    # Whether the state checks for the grace period or the equipment timeout
+    #   expiring, so the main loop knows when to wake
+    uses_grace = False
+    uses_timeout = False
+
+    # How quickly the RFID reader is polled in this state, IDLE while the
+    #   equipment is off, RUNNING while it is on and GRACE during a grace
+    #   period when a card coming or going must be noticed quickly
+    poll_rate = IDLE
+
     # Create the FSM.
     # Create a reference to the portal box service, which includes the
     #   box itself, the database, the emailer, etc.
@@ -59,6 +71,14 @@ class State(object):
         logging.debug("Entering state {}".format(self.__class__.__name__))
 
 
+    def adopt_role(self):
+        """
+        Take the time limit and proxy policy of the service's equipment role
+        """
+        self.timeout_delta = timedelta(minutes = self.service.timeout_minutes)
+        self.allow_proxy = self.service.allow_proxy
+
+
     def timeout_expired(self):
         """
         Determines whether or not the timeout period has expired
@@ -86,6 +106,27 @@ class State(object):
             return False
 
 
+    def seconds_until_deadline(self):
+        """
+        Determines how long until the grace period or timeout checked by this
+            state expires
+        @return the number of seconds, which may be negative if it has already
+            expired, or None if this state has no deadline
+        """
+        deadlines = []
+        now = datetime.now()
+        if self.uses_grace:
+            deadlines.append(self.grace_start + self.grace_delta - now)
+        if self.uses_timeout and self.service.timeout_minutes > 0:
+            deadlines.append(self.timeout_start + self.timeout_delta - now)
+
+        if not deadlines:
+            return None
+
+        # the expiry checks are strict so wake just after the deadline
+        return min(deadlines).total_seconds() + 0.001
+
+
 class Setup(State):
     """
     The first state, tries to setup everything that needs to be setup and goes
@@ -107,20 +148,23 @@ class Setup(State):
 
         self.service.box.set_display_color(color)
         try:
-            self.service.connect_to_database()
-
-            self.service.connect_to_email()
-
-            self.service.get_equipment_role()
-
-            self.service.record_ip()
-
-            self.timeout_delta = timedelta(minutes = self.service.timeout_minutes)
+            # steps which don't depend on each other run concurrently
+            pipeline = StartupPipeline()
+            pipeline.add("hardware", self.service.box.wait_for_rfid_reader)
+            pipeline.add("database", self.service.connect_to_database)
+            pipeline.add("email", self.service.connect_to_email)
+            pipeline.add("email_server", self.service.check_email_server,
+                requires = ("email",), critical = False, wait = False)
+            pipeline.add("role", self.service.get_equipment_role,
+                requires = ("database",))
+            pipeline.run()
+
+            self.adopt_role()
             self.grace_delta = timedelta(seconds = self.service.settings.getint("user_exp","grace_period"))
-            self.allow_proxy = self.service.allow_proxy
             self.flash_rate = self.service.settings.getint("display","flash_rate")
             self.next_state(IdleNoCard, input_data)
             self.service.box.buzz_tone(500,.2)
+            self.service.log_ready_time()
         except Exception as e:
             logging.error("Unable to complete setup exception raised: \n\t{}".format(e))
             self.next_state(Shutdown, input_data)
@@ -193,6 +237,9 @@ class RunningUnknownCard(State):
     """
     A Card has been read from the no card grace period
     """
+    uses_grace = True
+    poll_rate = GRACE
+
     def __call__(self, input_data):
         logging.debug("is USER? {}".format(input_data["card_type"] == CardType.USER_CARD))
         logging.debug(f"User authority level:{self.user_authority_level}")
@@ -249,6 +296,9 @@ class RunningAuthUser(State):
     """
     An authorized user has put their card in, the machine will function
     """
+    uses_timeout = True
+    poll_rate = RUNNING
+
     def __call__(self, input_data):
         if(input_data["card_id"] <= 0):
             self.next_state(RunningNoCard, input_data)
@@ -304,6 +354,9 @@ class RunningNoCard(State):
     An authorized card has been removed, waits for a new card until the grace
         period expires, or a button is pressed
     """
+    uses_grace = True
+    poll_rate = GRACE
+
     def __call__(self, input_data):
         #Card detected
         if(input_data["card_id"] > 0 and input_data["card_type"] != CardType.INVALID_CARD):
@@ -322,7 +375,9 @@ class RunningNoCard(State):
 
     def on_enter(self, input_data):
         logging.info("Grace period started")
-        self.grace_start = datetime.now()
+        # the grace period runs from when the card was removed, not from when
+        #   the removal was handled
+        self.grace_start = input_data.get("card_removed_at", datetime.now())
 
         color = "FF FF 00"
         if "no_card_grace_color" in self.service.settings["display"]:
@@ -345,6 +400,9 @@ class RunningUnauthCard(State):
     """
     A card type which isn't allowed on this machine has been read while the machine is running, gives the user time to put back their authorized card
     """
+    uses_grace = True
+    poll_rate = GRACE
+
     def __call__(self, input_data):
         #Card detected and its the same card that was using the machine before the unauth card was inserted 
         if(
@@ -391,6 +449,9 @@ class RunningTimeout(State):
     """
     The machine has timed out, has a grace period before going to the next state
     """
+    uses_grace = True
+    poll_rate = GRACE
+
     def __call__(self, input_data):
         #If the button has been pressed, then re-read the card
         if(input_data["button_pressed"]):
@@ -461,6 +522,9 @@ class RunningProxyCard(State):
     """
     Runs the machine in the proxy mode
     """
+    uses_timeout = True
+    poll_rate = RUNNING
+
     def __call__(self, input_data):
         if(input_data["card_id"] <= 0):
             self.next_state(RunningNoCard, input_data)
@@ -489,6 +553,9 @@ class RunningTrainingCard(State):
     """
     Runs the machine in the training mode
     """
+    uses_timeout = True
+    poll_rate = RUNNING
+
     def __call__(self, input_data):
         if(input_data["card_id"] <= 0):
             self.next_state(RunningNoCard, input_data)
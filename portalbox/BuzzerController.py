@@ -13,6 +13,8 @@ import time
 import spidev
 import RPi.GPIO as GPIO
 
+from .DriverProtocol import CommandPipe, decode, encode
+
 
 #Default values
 DEFAULT_TONE = 800.0
@@ -45,7 +47,7 @@ class BuzzerController:
             if settings["display"]["buzzer_pwm"].lower() in ("no", "false", "0"):
                 pwm_enabled = False
         
-        self.command_queue = multiprocessing.JoinableQueue()
+        self.command_queue = CommandPipe()
         self.driver = multiprocessing.Process(
             target=buzzer_driver,
             name="buzzer",
@@ -56,7 +58,7 @@ class BuzzerController:
 
 
     def _transmit(self,command):
-        """Put a command string in the queue."""
+        """Send a command to the driver."""
         self.command_queue.put(command)
 
 
@@ -64,7 +66,7 @@ class BuzzerController:
         """
             Plays a song on the buzzer
         """
-        command = "sing {} {} {}".format(file_name, sn_len, spacing)
+        command = encode("sing", file_name, sn_len, spacing)
 
         self._transmit(command)
 
@@ -73,7 +75,7 @@ class BuzzerController:
         """
             Plays the specified tone on the buzzer for the specified length
         """
-        command = "buzz {} {} {} {}".format(freq, length, stop_song, stop_beeping)
+        command = encode("buzz", freq, length, stop_song, stop_beeping)
         self._transmit(command)
 
 
@@ -81,7 +83,7 @@ class BuzzerController:
         """
             Beeps the buzzer the specified number of times in the duration
         """
-        command = "beep {} {} {}".format(freq, duration, beeps)
+        command = encode("beep", freq, duration, beeps)
         self._transmit(command)
 
 
@@ -89,7 +91,7 @@ class BuzzerController:
         """
             Stops the specified effect(s) on the buzzer 
         """        
-        command = "stop {} {} {}".format(stop_singing, stop_buzzing, stop_beeping)
+        command = encode("stop", stop_singing, stop_buzzing, stop_beeping)
         self._transmit(command)
 
 
@@ -219,26 +221,26 @@ class Buzzer:
 
 def process_command(command, buzz_con):
     """
-    Process command strings from the controller.
-
-    The length of these strings is verified in the abstract base class, which
-    also verifies the integer parameter ranges.
+    Process binary commands, see DriverProtocol, from the controller.
     """
     logging.debug("Buzzer Driver is processing a command")
     errno = 0
 
-    # split the string into a list of tokens
-    tokens = command.split()
-    params = [token for token in tokens[1:]]
-    # get command part of string and determine if it is recognized
-    if tokens[0] == "buzz":
+    try:
+        (name, params) = decode(command)
+    except ValueError as e:
+        logging.error("Buzzer DRVR ignoring command: %s", e)
+        return 1
+
+    # determine if the command is recognized
+    if name == "buzz":
         #Buzz the buzzer once
-        if params[2] == "True":
+        if params[2]:
             buzz_con.is_singing = False
 
         buzz_con.is_buzzing = True
 
-        if params[3] == "True":
+        if params[3]:
             buzz_con.is_beeping = False
             
         buzz_con.buzz_info = {
@@ -246,7 +248,7 @@ def process_command(command, buzz_con):
             "num_of_loops": (float(params[1])*1000)//LOOP_MS
             }
 
-    elif tokens[0] == "beep":
+    elif name == "beep":
         #Beep the buzzer at a specified freq
         buzz_con.is_singing = False
         buzz_con.is_buzzing = False
@@ -269,18 +271,18 @@ def process_command(command, buzz_con):
             "effect_time": 0
             }
 
-    elif tokens[0] == "sing":
+    elif name == "sing":
         buzz_con.is_singing = True
         buzz_con.is_buzzing = False
         buzz_con.is_beeping = False
         buzz_con.song_list = buzz_con.create_song_string(params[0],float(params[1]),float(params[2]))
 
-    elif tokens[0] == "stop":
-        if params[0] == "True":
+    elif name == "stop":
+        if params[0]:
             buzz_con.is_singing = False
-        if params[1] == "True":
+        if params[1]:
             buzz_con.is_buzzing = False
-        if params[2] == "True":
+        if params[2]:
             buzz_con.is_beeping = False
     else:
         errno = 1
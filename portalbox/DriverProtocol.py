@@ -0,0 +1,118 @@
+"""
+The binary commands controllers send to their driver processes.
+
+Each command is a version byte, an opcode byte and the command's parameters
+packed with struct, little endian. A driver rejects a command of another
+version rather than misreading it.
+"""
+import multiprocessing
+import queue
+import struct
+import threading
+
+VERSION = 1
+
+_HEADER = struct.Struct("<BB")
+
+# name -> (opcode, format of the parameters). The name is the command's
+# name in the old text protocol and the parameters are in the same order.
+# sing's file name follows its fixed parameters as UTF-8
+COMMANDS = {
+    # display commands: red, green, blue[, duration ms[, repeats]]
+    "color": (1, struct.Struct("<BBB")),
+    "pulse": (2, struct.Struct("<BBB")),
+    "wipe": (3, struct.Struct("<BBBI")),
+    "blink": (4, struct.Struct("<BBBIH")),
+    # buzzer commands
+    "buzz": (16, struct.Struct("<ff??")),   # freq, length, stop song, stop beeping
+    "beep": (17, struct.Struct("<ffH")),    # freq, duration, beeps
+    "sing": (18, struct.Struct("<ff")),     # note length, spacing, file name
+    "stop": (19, struct.Struct("<???"))     # singing, buzzing, beeping
+}
+
+_BY_OPCODE = {opcode: (name, parameters) for (name, (opcode, parameters)) in COMMANDS.items()}
+
+
+def encode(name, *params):
+    """
+    Pack a command.
+
+    name - the command's name, a key of COMMANDS
+    params - its parameters, for sing the file name last
+    Returns the command as bytes
+    """
+    (opcode, parameters) = COMMANDS[name]
+    if name == "sing":
+        return (_HEADER.pack(VERSION, opcode) + parameters.pack(*params[1:]) +
+            params[0].encode())
+    return _HEADER.pack(VERSION, opcode) + parameters.pack(*params)
+
+
+def decode(command):
+    """
+    Unpack a command.
+
+    Returns (name, params) with params a tuple in the order encode() took
+    them. Raises ValueError if the command is of another version, unknown or
+    the wrong length
+    """
+    if len(command) < _HEADER.size:
+        raise ValueError("Command of {} bytes is too short".format(len(command)))
+    (version, opcode) = _HEADER.unpack_from(command)
+    if version != VERSION:
+        raise ValueError("Command version {} is not {}".format(version, VERSION))
+    if opcode not in _BY_OPCODE:
+        raise ValueError("Unknown command opcode {}".format(opcode))
+
+    (name, parameters) = _BY_OPCODE[opcode]
+    end = _HEADER.size + parameters.size
+    if name == "sing":
+        if len(command) < end:
+            raise ValueError("Command sing is too short")
+        return (name, (bytes(command[end:]).decode(),) + parameters.unpack_from(command, _HEADER.size))
+    if len(command) != end:
+        raise ValueError("Command {} is {} bytes not {}".format(name, len(command), end))
+    return (name, parameters.unpack_from(command, _HEADER.size))
+
+
+class CommandPipe:
+    """
+    A one way pipe carrying commands to a driver process as raw bytes,
+    without the pickling and feeder thread of a multiprocessing queue
+
+    The driver side mirrors the queue methods the drivers use.
+    """
+
+    def __init__(self):
+        (self.reader, self.writer) = multiprocessing.Pipe(False)
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # a lock can not be sent to a spawned process, the driver does not
+        # write to the pipe so needs none
+        return (self.reader, self.writer)
+
+    def __setstate__(self, state):
+        (self.reader, self.writer) = state
+        self.lock = threading.Lock()
+
+    def put(self, command):
+        """Send a command, may be called from any thread."""
+        with self.lock:
+            self.writer.send_bytes(command)
+
+    def get(self, block=True, timeout=None):
+        """
+        Receive the next command, called by the driver.
+
+        Raises queue.Empty if none arrives within timeout seconds
+        """
+        if not self.reader.poll(timeout if block else 0):
+            raise queue.Empty
+        return self.reader.recv_bytes()
+
+    def task_done(self):
+        pass
+
+    def close(self):
+        self.writer.close()
@@ -26,9 +26,14 @@
 #    Modified on 7/22/2021 by James Howe(jah083@bucknell.edu) to fix a syntax
 #    error in the while loop in the function MFRC522_ToCard() which used BITWISE
 #    operators instead of logical operators 
+#
+#    Modified to optionally wait on the chip's IRQ line, rather than polling
+#    its interrupt request register, for commands to complete, and to wait
+#    until a deadline rather than for a number of reads
 import RPi.GPIO as GPIO
 import spidev
 import signal
+import threading
 import time
 import logging
 
@@ -130,8 +135,26 @@ class MFRC522:
     Reserved34 = 0x3F
 
     serNum = []
-
-    def __init__(self, bus=0, device=0, spd=1000000, pin_mode=10, pin_rst=-1, debugLevel='WARNING'):
+    haltFrame = None
+    signature = {}
+
+    # VersionReg of the MFRC522 versions 0.0, 1.0 and 2.0, and of the FM17522
+    # and other clones found on reader boards
+    VERSIONS = (0x90, 0x91, 0x92, 0x88, 0x12)
+
+    # Registers only the driver changes, their last written values are kept
+    # so they need not be read back
+    SHADOWED = (CommIEnReg, BitFramingReg)
+
+    # The chip's timer ends a command no card answers after timeout seconds,
+    # it ticks at 13.56MHz / (2 * TPrescaler + 1) with TPrescaler 0xD3E.
+    # Commands are abandoned if the timer has not ended them by twice that
+    DEFAULT_TIMEOUT = 0.015
+    TIMER_HZ = 13560000 / (2 * 0xD3E + 1)
+    # The sleep between reads of an interrupt request register
+    POLL_SLEEP = 0.0005
+
+    def __init__(self, bus=0, device=0, spd=1000000, pin_mode=10, pin_rst=-1, debugLevel='WARNING', pin_irq=None, timeout=DEFAULT_TIMEOUT):
         self.spi = spidev.SpiDev()
         self.spi.open(bus, device)
         self.spi.max_speed_hz = spd
@@ -156,18 +179,91 @@ class MFRC522:
             
         GPIO.setup(pin_rst, GPIO.OUT)
         GPIO.output(pin_rst, 1)
+
+        self.timeout = timeout
+        self.deadline = 2 * timeout
+
+        # The IRQ line is active low; it is only used if the chip is seen to
+        # pull it low, otherwise the interrupt request register is polled
+        self.pin_irq = pin_irq
+        self.irq = threading.Event()
+        self.irq_mode = False
+        if pin_irq is not None:
+            GPIO.setup(pin_irq, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+            GPIO.add_event_detect(pin_irq, GPIO.FALLING, callback=self._irq_callback)
+
         self.MFRC522_Init()
 
+        if pin_irq is not None:
+            self.irq_mode = self.MFRC522_TestIRQ()
+            if self.irq_mode:
+                self.logger.info("Waiting on the IRQ line")
+            else:
+                GPIO.remove_event_detect(pin_irq)
+                self.logger.warning("No signal on the IRQ line, polling instead")
+
+    def _irq_callback(self, channel):
+        self.irq.set()
+
+    def MFRC522_TestIRQ(self):
+        '''
+        Start the timer with only its interrupt enabled and see whether the
+        IRQ line signals when it expires
+
+        @return True if the line signalled
+        '''
+        self.Write_MFRC522(self.CommIEnReg, 0x80 | 0x01)
+        self.Write_MFRC522(self.CommIrqReg, 0x7F)
+        self.irq.clear()
+        self.SetBitMask(self.ControlReg, 0x40)
+        signalled = self.irq.wait(self.deadline)
+        self.Write_MFRC522(self.CommIEnReg, 0x80)
+        self.Write_MFRC522(self.CommIrqReg, 0x7F)
+        return signalled
+
     def MFRC522_Reset(self):
         self.Write_MFRC522(self.CommandReg, self.PCD_RESETPHASE)
+        self.shadow = {}
 
     def Write_MFRC522(self, addr, val):
+        if addr in self.SHADOWED:
+            self.shadow[addr] = val
         val = self.spi.xfer2([(addr << 1) & 0x7E, val])
 
     def Read_MFRC522(self, addr):
         val = self.spi.xfer2([((addr << 1) & 0x7E) | 0x80, 0])
         return val[1]
 
+    def Read_MFRC522_Registers(self, addrs):
+        '''
+        Read several registers in one SPI transfer, the chip answers each
+        address byte with the value of the register addressed by the byte
+        before it
+
+        @return the values in the order of addrs
+        '''
+        val = self.spi.xfer2([((addr << 1) & 0x7E) | 0x80 for addr in addrs] + [0])
+        return val[1:]
+
+    def Write_MFRC522_FIFO(self, data):
+        '''
+        Fill the FIFO in one SPI transfer, every byte following the address
+        is written to the addressed register
+        '''
+        if len(data) > 0:
+            self.spi.xfer2([(self.FIFODataReg << 1) & 0x7E] + list(data))
+
+    def Read_MFRC522_FIFO(self, n):
+        return self.Read_MFRC522_Registers([self.FIFODataReg] * n)
+
+    def Write_MFRC522_Cached(self, addr, val):
+        '''
+        Write a register only the driver changes, skipping the transfer when
+        it already holds val
+        '''
+        if self.shadow.get(addr) != val:
+            self.Write_MFRC522(addr, val)
+
     def Close_MFRC522(self):
         self.spi.close()
         GPIO.cleanup()
@@ -188,7 +284,7 @@ class MFRC522:
     def AntennaOff(self):
         self.ClearBitMask(self.TxControlReg, 0x03)
 
-    def MFRC522_ToCard(self, command, sendData):
+    def MFRC522_ToCard(self, command, sendData, txLastBits=None):
         backData = []
         backLen = 0
         status = self.MI_ERR
@@ -203,40 +299,55 @@ class MFRC522:
         if command == self.PCD_TRANSCEIVE:
             irqEn = 0x77
             waitIRq = 0x30
+        if command == self.PCD_TRANSMIT:
+            irqEn = 0x10
+            waitIRq = 0x10
 
-        self.Write_MFRC522(self.CommIEnReg, irqEn | 0x80)
-        self.ClearBitMask(self.CommIrqReg, 0x80)
-        self.SetBitMask(self.FIFOLevelReg, 0x80)
+        if self.irq_mode:
+            # Only the interrupts which end the command may drive the line,
+            # the others stay asserted and would hide the edge
+            self.Write_MFRC522_Cached(self.CommIEnReg, waitIRq | (irqEn & 0x03) | 0x80)
+        else:
+            self.Write_MFRC522_Cached(self.CommIEnReg, irqEn | 0x80)
+        # With bit 7 clear the bits written are cleared, and only the flush
+        # bit of FIFOLevelReg is writable, so neither needs reading first
+        self.Write_MFRC522(self.CommIrqReg, 0x7F)
+        self.irq.clear()
+        self.Write_MFRC522(self.FIFOLevelReg, 0x80)
 
         self.Write_MFRC522(self.CommandReg, self.PCD_IDLE)
 
-        for i in range(len(sendData)):
-            self.Write_MFRC522(self.FIFODataReg, sendData[i])
+        self.Write_MFRC522_FIFO(sendData)
+
+        if txLastBits is None:
+            txLastBits = self.shadow.get(self.BitFramingReg, 0x00) & 0x7F
+        if command == self.PCD_TRANSMIT:
+            # Transmit starts sending at once, the framing must be set first
+            self.Write_MFRC522_Cached(self.BitFramingReg, txLastBits)
 
         self.Write_MFRC522(self.CommandReg, command)
 
         if command == self.PCD_TRANSCEIVE:
-            self.SetBitMask(self.BitFramingReg, 0x80)
+            # The framing and StartSend in one write
+            self.Write_MFRC522(self.BitFramingReg, txLastBits | 0x80)
 
-        i = 2000
-        while True:
-            n = self.Read_MFRC522(self.CommIrqReg)
-            i = i - 1
-            if not ((i != 0) and not (n & 0x01) and not (n & waitIRq)):
-                break
+        (done, n) = self._WaitFor(self.CommIrqReg, waitIRq | 0x01)
 
-        self.ClearBitMask(self.BitFramingReg, 0x80)
+        if command == self.PCD_TRANSCEIVE:
+            self.Write_MFRC522(self.BitFramingReg, txLastBits)
 
-        if i != 0:
-            if (self.Read_MFRC522(self.ErrorReg) & 0x1B) == 0x00:
+        if done:
+            (error, level, control) = self.Read_MFRC522_Registers(
+                [self.ErrorReg, self.FIFOLevelReg, self.ControlReg])
+            if (error & 0x1B) == 0x00:
                 status = self.MI_OK
 
                 if n & irqEn & 0x01:
                     status = self.MI_NOTAGERR
 
                 if command == self.PCD_TRANSCEIVE:
-                    n = self.Read_MFRC522(self.FIFOLevelReg)
-                    lastBits = self.Read_MFRC522(self.ControlReg) & 0x07
+                    n = level
+                    lastBits = control & 0x07
                     if lastBits != 0:
                         backLen = (n - 1) * 8 + lastBits
                     else:
@@ -247,22 +358,42 @@ class MFRC522:
                     if n > self.MAX_LEN:
                         n = self.MAX_LEN
 
-                    for i in range(n):
-                        backData.append(self.Read_MFRC522(self.FIFODataReg))
+                    backData = self.Read_MFRC522_FIFO(n)
             else:
                 status = self.MI_ERR
 
         return (status, backData, backLen)
 
+    def _WaitFor(self, reg, bits):
+        '''
+        Wait for any of bits to be set in an interrupt request register,
+        sleeping on the IRQ line when it is in use and between reads when it
+        is not, until the deadline passes
+
+        @return (done, n) where done is False if the deadline passed and n
+            is the last value read
+        '''
+        deadline = time.monotonic() + self.deadline
+        while True:
+            n = self.Read_MFRC522(reg)
+            if n & bits:
+                return (True, n)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return (False, n)
+            if self.irq_mode and reg == self.CommIrqReg:
+                self.irq.wait(remaining)
+                self.irq.clear()
+            else:
+                time.sleep(min(self.POLL_SLEEP, remaining))
+
     def MFRC522_Request(self, reqMode):
         status = None
         backBits = None
         TagType = []
 
-        self.Write_MFRC522(self.BitFramingReg, 0x07)
-
         TagType.append(reqMode)
-        (status, backData, backBits) = self.MFRC522_ToCard(self.PCD_TRANSCEIVE, TagType)
+        (status, backData, backBits) = self.MFRC522_ToCard(self.PCD_TRANSCEIVE, TagType, 0x07)
 
         if ((status != self.MI_OK) | (backBits != 0x10)):
             status = self.MI_ERR
@@ -275,12 +406,10 @@ class MFRC522:
 
         serNum = []
 
-        self.Write_MFRC522(self.BitFramingReg, 0x00)
-
         serNum.append(self.PICC_ANTICOLL)
         serNum.append(0x20)
 
-        (status, backData, backBits) = self.MFRC522_ToCard(self.PCD_TRANSCEIVE, serNum)
+        (status, backData, backBits) = self.MFRC522_ToCard(self.PCD_TRANSCEIVE, serNum, 0x00)
 
         if (status == self.MI_OK):
             i = 0
@@ -295,26 +424,20 @@ class MFRC522:
         return (status, backData)
 
     def CalulateCRC(self, pIndata):
-        self.ClearBitMask(self.DivIrqReg, 0x04)
-        self.SetBitMask(self.FIFOLevelReg, 0x80)
+        self.Write_MFRC522(self.DivIrqReg, 0x04)
+        self.Write_MFRC522(self.FIFOLevelReg, 0x80)
 
-        for i in range(len(pIndata)):
-            self.Write_MFRC522(self.FIFODataReg, pIndata[i])
+        self.Write_MFRC522_FIFO(pIndata)
 
         self.Write_MFRC522(self.CommandReg, self.PCD_CALCCRC)
-        i = 0xFF
-        while True:
-            n = self.Read_MFRC522(self.DivIrqReg)
-            i -= 1
-            if not ((i != 0) and not (n & 0x04)):
-                break
-        pOutData = []
-        pOutData.append(self.Read_MFRC522(self.CRCResultRegL))
-        pOutData.append(self.Read_MFRC522(self.CRCResultRegM))
-        return pOutData
-
-    def MFRC522_SelectTag(self, serNum):
-        backData = []
+        self._WaitFor(self.DivIrqReg, 0x04)
+        return self.Read_MFRC522_Registers([self.CRCResultRegL, self.CRCResultRegM])
+
+    def MFRC522_SelectFrame(self, serNum):
+        '''
+        @return the SELECT frame, with its CRC, for the card with the UID and
+            check byte in serNum
+        '''
         buf = []
         buf.append(self.PICC_SElECTTAG)
         buf.append(0x70)
@@ -325,7 +448,13 @@ class MFRC522:
         pOut = self.CalulateCRC(buf)
         buf.append(pOut[0])
         buf.append(pOut[1])
-        (status, backData, backLen) = self.MFRC522_ToCard(self.PCD_TRANSCEIVE, buf)
+        return buf
+
+    def MFRC522_SelectTag(self, serNum, selectFrame=None):
+        backData = []
+        if selectFrame is None:
+            selectFrame = self.MFRC522_SelectFrame(serNum)
+        (status, backData, backLen) = self.MFRC522_ToCard(self.PCD_TRANSCEIVE, selectFrame, 0x00)
 
         if (status == self.MI_OK) and (backLen == 0x18):
             self.logger.debug("Size: " + str(backData[0]))
@@ -333,6 +462,37 @@ class MFRC522:
         else:
             return 0
 
+    def MFRC522_Halt(self):
+        '''
+        Put the selected card in the HALT state, where only a WUPA wakes it.
+        A card does not answer HLTA so it is only transmitted
+        '''
+        if self.haltFrame is None:
+            buf = [self.PICC_HALT, 0x00]
+            self.haltFrame = buf + self.CalulateCRC(buf)
+        (status, backData, backLen) = self.MFRC522_ToCard(self.PCD_TRANSMIT, self.haltFrame, 0x00)
+        return status
+
+    def MFRC522_IsPresent(self, selectFrame):
+        '''
+        Check a card identified before, and halted, is still present: wake it
+        with WUPA, select it by its UID and halt it again. Unlike REQA and
+        anticollision this does not wait out the timer while the card stays,
+        and it confirms the card is the same one.
+
+        @param selectFrame - the card's frame from MFRC522_SelectFrame
+        @return True if the card answered its SELECT
+        '''
+        (status, backBits) = self.MFRC522_Request(self.PICC_REQALL)
+        if status != self.MI_OK:
+            return False
+
+        if self.MFRC522_SelectTag(None, selectFrame) == 0:
+            return False
+
+        self.MFRC522_Halt()
+        return True
+
     def MFRC522_Auth(self, authMode, BlockAddr, Sectorkey, serNum):
         buff = []
 
@@ -421,13 +581,28 @@ class MFRC522:
     def MFRC522_Init(self):
         self.MFRC522_Reset()
 
-        self.Write_MFRC522(self.TModeReg, 0x8D)
-        self.Write_MFRC522(self.TPrescalerReg, 0x3E)
-        self.Write_MFRC522(self.TReloadRegL, 30)
-        self.Write_MFRC522(self.TReloadRegH, 0)
-
-        self.Write_MFRC522(self.TxAutoReg, 0x40)
-        self.Write_MFRC522(self.ModeReg, 0x3D)
+        reload = max(1, min(0xFFFF, round(self.timeout * self.TIMER_HZ)))
+        self.signature = {
+            self.TModeReg: 0x8D,
+            self.TPrescalerReg: 0x3E,
+            self.TReloadRegL: reload & 0xFF,
+            self.TReloadRegH: reload >> 8,
+            self.TxAutoReg: 0x40,
+            self.ModeReg: 0x3D
+        }
+        for (reg, val) in self.signature.items():
+            self.Write_MFRC522(reg, val)
         self.AntennaOn()
 
-
+    def MFRC522_Verify(self):
+        '''
+        Check the chip reports a known version, its antennas are on and the
+        registers MFRC522_Init set still hold their values
+
+        @return True if they do
+        '''
+        regs = [self.VersionReg, self.TxControlReg] + list(self.signature)
+        vals = self.Read_MFRC522_Registers(regs)
+        if vals[0] not in self.VERSIONS or (vals[1] & 0x03) != 0x03:
+            return False
+        return vals[2:] == list(self.signature.values())
@@ -24,7 +24,7 @@
 """
 # from standard library
 import logging
-from time import sleep, time_ns, thread_time
+from time import monotonic, sleep, time_ns, thread_time
 import threading
 
 # Our libraries
@@ -49,6 +49,24 @@ GPIO_RESET_BTN_PIN = 3
 
 #FIXME Get from config file
 BLACK = "00 00 00"
+RED = "FF 00 00"
+YELLOW = "FF FF 00"
+
+# How long the RFID reader's NRST pin is held low to reset it and how long
+# the reader is given to start once it is released
+RFID_RESET_PULSE = 0.01
+RFID_STARTUP_DELAY = 0.005
+DEFAULT_RFID_RECOVERY_ATTEMPTS = 3
+
+
+class RFIDReaderError(Exception):
+    """
+    Exception to raise when the RFID reader has hung and resetting it did not
+    recover it
+    """
+
+    pass
+
 
 # Utility functions
 def get_revision():
@@ -79,16 +97,48 @@ class PortalBox:
         GPIO.setup(GPIO_SOLID_STATE_RELAY_PIN, GPIO.OUT)
 
 
-        #Sets up the buzzer controller
-        self.buzzer_controller = BuzzerController(GPIO_BUZZER_PIN, settings)
+        # Spawning the driver processes takes a while, start the buzzer's
+        # while the display's is spawned
+        buzzer_spawner = threading.Thread(
+            target = self._create_buzzer_controller,
+            args = (settings,),
+            name = "buzzer_spawn"
+            )
+        buzzer_spawner.start()
 
         #Set the button LED on for REV 3.x boards
         GPIO.setup(GPIO_BUTTON_LED_PIN, GPIO.OUT)
         GPIO.output(GPIO_BUTTON_LED_PIN, GPIO.HIGH)
 
-        # Reset the RFID card
+        # Reset the RFID card, it is brought out of reset and initialized in
+        # the background while the rest of the hardware is set up
         GPIO.setup(GPIO_RFID_NRST_PIN, GPIO.OUT)
         GPIO.output(GPIO_RFID_NRST_PIN, False)
+        rfid_settings = {}
+        if settings.has_section("rfid"):
+            rfid_settings = settings["rfid"]
+        # The reader's IRQ line is only wired on some boards
+        self.rfid_irq_pin = None
+        if "irq_pin" in rfid_settings:
+            self.rfid_irq_pin = int(rfid_settings["irq_pin"])
+        self.rfid_timeout = MFRC522.DEFAULT_TIMEOUT
+        if "command_timeout" in rfid_settings:
+            self.rfid_timeout = float(rfid_settings["command_timeout"])
+        self.rfid_recovery_attempts = DEFAULT_RFID_RECOVERY_ATTEMPTS
+        if "recovery_attempts" in rfid_settings:
+            self.rfid_recovery_attempts = int(rfid_settings["recovery_attempts"])
+        self.presence_check_enabled = False
+        if "presence_check_enabled" in rfid_settings:
+            if rfid_settings["presence_check_enabled"].lower() in ("yes", "true", "1"):
+                self.presence_check_enabled = True
+        self.RFIDReader = None
+        self.rfid_error = None
+        self.rfid_ready = threading.Event()
+        threading.Thread(
+            target = self._create_rfid_reader,
+            name = "rfid_init",
+            daemon = True
+            ).start()
 
         GPIO.setup(GPIO_BUTTON_PIN, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
         GPIO.add_event_detect(GPIO_BUTTON_PIN, GPIO.RISING)
@@ -114,22 +164,63 @@ class PortalBox:
             if settings["display"]["buzzer_enabled"].lower() in ("no", "false", "0"):
                 self.buzzer_enabled = False
 
-        # Deassert NRST
-        GPIO.output(GPIO_RFID_NRST_PIN, True)
-
-        # Create a proxy for the RFID card reader
-        logging.debug("Creating RFID reader")
-        self.RFIDReader = MFRC522()
+        buzzer_spawner.join()
 
         # set up some state
         self.sleepMode = False
         # keep track of values in RFID module registers
         self.outlist = [0] * 64
+        # the SELECT frame and id of the card last read, which was halted
+        self.rfid_select_frame = None
+        self.rfid_card_id = -1
+        # RFID reader recoveries, failed recovery attempts and the total and
+        # longest time taken to recover
+        self.rfid_recoveries = 0
+        self.rfid_failed_recoveries = 0
+        self.rfid_recovery_time = 0.0
+        self.rfid_longest_recovery = 0.0
 
         #For controlling the flashing and beeping threads
         self.flash_signal = False
 
 
+    def _create_buzzer_controller(self, settings):
+        start = time_ns()
+        self.buzzer_controller = BuzzerController(GPIO_BUZZER_PIN, settings)
+        logging.debug("Buzzer controller created in %d ms", (time_ns() - start) // 1000000)
+
+
+    def _create_rfid_reader(self):
+        start = time_ns()
+        try:
+            # Hold reset long enough for the chip to power down then
+            # deassert NRST
+            sleep(0.01)
+            GPIO.output(GPIO_RFID_NRST_PIN, True)
+
+            # Create a proxy for the RFID card reader
+            logging.debug("Creating RFID reader")
+            self.RFIDReader = MFRC522(pin_irq = self.rfid_irq_pin, timeout = self.rfid_timeout)
+            logging.debug("RFID reader created in %d ms", (time_ns() - start) // 1000000)
+        except Exception as e:
+            logging.error("Unable to initialize RFID reader: %s", e)
+            self.rfid_error = e
+        self.rfid_ready.set()
+
+
+    def wait_for_rfid_reader(self, timeout = None):
+        '''
+        Wait for the RFID reader to be initialized
+
+        @param (float) timeout - seconds to wait, None to wait indefinitely
+        @raise the exception raised initializing the reader, or TimeoutError
+        '''
+        if not self.rfid_ready.wait(timeout):
+            raise TimeoutError("RFID reader was not initialized in time")
+        if self.rfid_error:
+            raise self.rfid_error
+
+
     def set_equipment_power_on(self, state):
         '''
         Turn on/off power to the attached equipment by switching on/off relay
@@ -171,18 +262,29 @@ class PortalBox:
         return button_pressed
 
 
+    def set_button_callback(self, callback):
+        '''
+        Call callback, on a GPIO thread, whenever the button is pressed. The
+        press is still reported by has_button_been_pressed()
+        @param (callable) callback - called with the GPIO channel
+        '''
+        GPIO.add_event_callback(GPIO_BUTTON_PIN, callback)
+
+
     def read_RFID_card(self):
         '''
         @return a positive integer representing the uid from the card on a
             successful read, -1 otherwise
+        @raise RFIDReaderError if the reader hung and could not be recovered
         '''
+        self.wait_for_rfid_reader()
         rfid_hang = False
 
         # These three registers appear to change to specific values if the
         # RFID module hangs
         reglist = [17, 20, 21]
-        for reg in reglist:
-            regval = self.RFIDReader.Read_MFRC522(reg)
+        regvals = self.RFIDReader.Read_MFRC522_Registers(reglist)
+        for (reg, regval) in zip(reglist, regvals):
             # If register 20 changes from 0x83 to 0x80 then the transmit
             # antennas are turned off
             if (reg == 20) and (self.outlist[reg] == 0x83) and (regval == 0x80):
@@ -192,21 +294,25 @@ class PortalBox:
                 logging.info("Reg {0:02x} changed from {1:02x} to {2:02x}".format(reg, self.outlist[reg], regval))
                 self.outlist[reg] = regval
 
-       # If the RFID module hangs then we need to restart the portal-box
-       # service. This is an infinite loop...the watchdog timer should
-       # detect this and restart the service. Meanwhile, we beep and an
-       # flash a red and yellow display
-        while rfid_hang:
-           self.set_buzzer(True)
-           self.set_display_color(RED)
-           sleep(0.05)
-           self.set_buzzer(False)
-           self.set_display_color(YELLOW)
-           sleep(10)
-
-        # Scan for card...twice before giving up
+        # If the RFID module hangs reset it. If it cannot be recovered the
+        # service must be restarted to use it again
+        if rfid_hang and not self.recover_rfid_reader():
+            raise RFIDReaderError("RFID reader hung and could not be recovered")
+
+        # A card found by the last read was halted, rather than scanning
+        # for cards check it is still there
+        if self.rfid_select_frame:
+            if self.RFIDReader.MFRC522_IsPresent(self.rfid_select_frame):
+                return self.rfid_card_id
+            self.rfid_select_frame = None
+
+        # Scan for card...twice before giving up. A card we halted only
+        # answers a wake up, so with presence checks scan for all cards
+        request = MFRC522.PICC_REQIDL
+        if self.presence_check_enabled:
+            request = MFRC522.PICC_REQALL
         for attempts in range(2):
-            (status, TagType) = self.RFIDReader.MFRC522_Request(MFRC522.PICC_REQIDL)
+            (status, TagType) = self.RFIDReader.MFRC522_Request(request)
 
             if MFRC522.MI_OK == status:
                 # Get the UID of the card
@@ -220,10 +326,77 @@ class PortalBox:
                         result += (uid[i] << (8 * (3 - i)))
                     # If we found a valid card ID, return it
                     if result > 0:
+                        if self.presence_check_enabled:
+                            self._halt_card(uid, result)
                         return result
 
         return -1
 
+    def recover_rfid_reader(self):
+        '''
+        Reset the RFID reader by pulsing its NRST pin, initialize it again
+        and check its registers, up to rfid_recovery_attempts times
+
+        @return True if the reader recovered
+        '''
+        logging.error("RFID reader appears to have hung, resetting it")
+        started = monotonic()
+        for attempt in range(self.rfid_recovery_attempts):
+            GPIO.output(GPIO_RFID_NRST_PIN, False)
+            sleep(RFID_RESET_PULSE)
+            GPIO.output(GPIO_RFID_NRST_PIN, True)
+            sleep(RFID_STARTUP_DELAY)
+
+            try:
+                self.RFIDReader.MFRC522_Init()
+                recovered = self.RFIDReader.MFRC522_Verify()
+            except Exception as e:
+                logging.error("Unable to initialize RFID reader: %s", e)
+                recovered = False
+
+            if recovered:
+                duration = monotonic() - started
+                self.rfid_recoveries += 1
+                self.rfid_recovery_time += duration
+                self.rfid_longest_recovery = max(self.rfid_longest_recovery, duration)
+                # the card was reset with the reader
+                self.rfid_select_frame = None
+                logging.warning("RFID reader recovered in %.3f seconds after %d attempt(s)",
+                    duration, attempt + 1)
+                return True
+
+            self.rfid_failed_recoveries += 1
+            logging.error("RFID reader recovery attempt %d failed", attempt + 1)
+
+        return False
+
+
+    def stats(self):
+        '''
+        @return a dictionary of the number of times the RFID reader was
+            recovered, the number of failed attempts to recover it and the
+            mean and longest time taken to recover in seconds
+        '''
+        return {
+            "rfid_recoveries": self.rfid_recoveries,
+            "rfid_failed_recoveries": self.rfid_failed_recoveries,
+            "rfid_mean_recovery_time": self.rfid_recovery_time / self.rfid_recoveries if self.rfid_recoveries else None,
+            "rfid_longest_recovery_time": self.rfid_longest_recovery if self.rfid_recoveries else None
+        }
+
+
+    def _halt_card(self, uid, card_id):
+        '''
+        Select and halt the card just read so the next read need only check
+        it is still present
+        '''
+        frame = self.RFIDReader.MFRC522_SelectFrame(uid)
+        if self.RFIDReader.MFRC522_SelectTag(uid, frame):
+            self.RFIDReader.MFRC522_Halt()
+            self.rfid_select_frame = frame
+            self.rfid_card_id = card_id
+
+
     def wake_display(self):
         if self.display_controller:
             self.display_controller.wake_display()
@@ -5,7 +5,10 @@ import multiprocessing
 
 # Import from our module
 from .AbstractController import AbstractController, BLACK
-from .DotstarDriver import strip_driver
+from .DotstarDriver import strip_driver, REFRESH_MS
+from .FrameBuffer import FrameBuffer, MAX_BRIGHTNESS
+from .Mailbox import Mailbox
+from ..DriverProtocol import encode
 
 # Define the SPI bus and device that will be used
 SPI_BUS = 1
@@ -14,12 +17,23 @@ SPI_DEV = 0
 # Define how many LEDs are in the strip
 LED_COUNT = 15
 
+# How long, in seconds, to wait for the driver to confirm a command
+DEFAULT_ACK_TIMEOUT = 1.0
+
 
 class DotstarController(AbstractController):
     """
     Control Dotstars
 
     The order of the colors in the serial transmission is red, blue, green
+
+    Commands are sent without waiting for the driver, a command the driver
+    has not yet taken is replaced by the next. With the acknowledged setting
+    each call instead waits, up to ack_timeout seconds, for the driver to
+    process its command and returns whether it did.
+
+    Arbitrary frames are written to a framebuffer shared with the driver,
+    which shows the latest on its next tick, see set_display_pixels.
     """
 
     def __init__(self, settings={}):
@@ -33,33 +47,46 @@ class DotstarController(AbstractController):
         else:
             self.sleep_color = b"\x00\x00\xFF"
 
-        self.command_queue = multiprocessing.JoinableQueue()
+        # how often, in milliseconds, the driver sends an unchanged frame
+        refresh_ms = REFRESH_MS
+        if "refresh_ms" in settings:
+            refresh_ms = int(settings["refresh_ms"])
+
+        self.acknowledged = False
+        if "acknowledged" in settings:
+            self.acknowledged = settings["acknowledged"] in (True, "yes", "true", "1")
+        self.ack_timeout = DEFAULT_ACK_TIMEOUT
+        if "ack_timeout" in settings:
+            self.ack_timeout = float(settings["ack_timeout"])
+        self.sequence = 0
+
+        self.command_queue = Mailbox()
+        self.framebuffer = FrameBuffer(LED_COUNT)
         self.driver = multiprocessing.Process(
             target=strip_driver,
             name="dotstar_strip",
-            args=(self.command_queue, LED_COUNT, SPI_BUS, SPI_DEV),
+            args=(self.command_queue, LED_COUNT, SPI_BUS, SPI_DEV, refresh_ms,
+                self.framebuffer),
         )
         self.driver.daemon = True
         self.driver.start()
 
     def _transmit(self, command):
-        """Put a command string in the queue."""
+        """Post a command string to the driver."""
         #logging.debug("Sending: '%s' to dotstar driver", command.strip())
-        self.command_queue.put(command)
+        self.sequence = self.command_queue.put(command)
 
     def _receive(self):
         """
-        Wait until the command queue is empty, then return True.
+        Return True, once the last command has been processed if commands
+        are acknowledged.
 
-        This function blocks until the commands have been processed. There is
-        no inherent or enforced limit to the length of time needed to process
-        a command, so we can not use a timeout here. There is no recovery
-        mechanism for a command that fails, so the driver should just throw an
-        exception.
+        Returns False if the driver did not process the command within
+        ack_timeout seconds.
         """
-        #TODO are we OK with this behavior?
-        self.command_queue.join()
-        return True
+        if not self.acknowledged:
+            return True
+        return self.command_queue.wait(self.sequence, self.ack_timeout)
 
     #        try:
     #            response = self.command_queue.get(True, 10)
@@ -74,9 +101,9 @@ class DotstarController(AbstractController):
     def sleep_display(self):
         """Start a display sleeping animation (pulsing sleep color)."""
         AbstractController.sleep_display(self)
-        command = "pulse {} {} {}\n".format(self.sleep_color[2],
-                                            self.sleep_color[0],
-                                            self.sleep_color[1])
+        command = encode("pulse", self.sleep_color[2],
+                                  self.sleep_color[0],
+                                  self.sleep_color[1])
         self._transmit(command)
         return self._receive()
 
@@ -88,9 +115,9 @@ class DotstarController(AbstractController):
     def set_display_color(self, color=BLACK):
         """Set the entire strip to specified color (defaults to black)."""
         AbstractController.set_display_color(self, color)
-        command = "color {} {} {}\n".format(color[2],
-                                            color[0],
-                                            color[1])
+        command = encode("color", color[2],
+                                  color[0],
+                                  color[1])
         
         self._transmit(command)
         return self._receive()
@@ -103,20 +130,32 @@ class DotstarController(AbstractController):
         """
         AbstractController.set_display_color_wipe(self, color, duration)
 
-        command = "wipe {} {} {} {}\n".format(color[2],
-                                              color[0],
-                                              color[1],
-                                              duration)
+        command = encode("wipe", color[2],
+                                 color[0],
+                                 color[1],
+                                 duration)
         self._transmit(command)
         return self._receive()
 
+    def set_display_pixels(self, colors, brightness=MAX_BRIGHTNESS):
+        """Set each pixel to its own color, ending any effect.
+
+        colors - a sequence of red, green, blue byte values, one per pixel
+        brightness - 0 to 31
+
+        The frame is written straight into the framebuffer, an animation may
+        instead write its frames in place with framebuffer.writing()
+        """
+        self.framebuffer.write(colors, brightness)
+        return True
+
     def flash_display(self, flash_color, duration, flashes=5, end_color=BLACK):
         """Flash color across all display pixels multiple times."""
-        command = "blink {} {} {} {} {}\n".format(flash_color[2],
-                                                  flash_color[0],
-                                                  flash_color[1],
-                                                  duration,
-                                                  flashes)
+        command = encode("blink", flash_color[2],
+                                  flash_color[0],
+                                  flash_color[1],
+                                  duration,
+                                  flashes)
         self._transmit(command)
         success = self._receive()
         return success
@@ -133,16 +172,18 @@ class DotstarController(AbstractController):
     def shutdown_display(self, end_color=b"\x00\x00\x00"):
         """Set the display color and terminate the driver process."""
 
-        command = "color {} {} {}\n".format(end_color[0],
-                                            end_color[1],
-                                            end_color[2])
+        command = encode("color", end_color[0],
+                                  end_color[1],
+                                  end_color[2])
         self._transmit(command)
-        #success = self._receive()
-        sleep(1)
+        # wait for the driver to show the color
+        self.command_queue.wait(self.sequence, 1)
 
         self.command_queue.close()
         self.driver.terminate()
         sleep(1)
         if self.driver.is_alive():
             self.driver.kill()
+        self.framebuffer.close()
+        self.framebuffer.unlink()
         return
@@ -8,12 +8,15 @@
 """
 import logging
 import os
+import queue
 import signal
 
 import multiprocessing
 import time
 import spidev
 
+from ..DriverProtocol import decode
+
 # Brightness parameters
 # For Dotstars, brightness is a 5-bit value from 0 to 31
 DEFAULT_BRIGHTNESS = 16
@@ -24,10 +27,116 @@ PULSE_BRIGHTNESS_STEP = 2
 BLACK = (0, 0, 0)
 DARKRED = (16, 0, 0)
 
-# The driver runs in an infinite loop, checking for new commands or updating
-# the pixels. This is the duration of each loop, in milliseconds.
+# The driver runs in an infinite loop, checking for new commands and showing
+# a frame every LOOP_MS milliseconds. Frames are due at fixed times of the
+# monotonic clock, commands arriving in between do not delay them
 LOOP_MS = 100
 
+# An unchanged frame is only sent again after this many milliseconds, to
+# repair any glitch on the strip. 0 never sends an unchanged frame again
+REFRESH_MS = 5000
+
+
+class Effect:
+    """
+    An effect precomputed, when its command arrives, as a table of keyframes
+
+    A keyframe is a tuple of the pixels' brightness and a tuple of their
+    colors. Each keyframe is shown for step frames, starting with the first
+    at the monotonic time start. The keyframes from repeat_from on are then
+    shown repeats times, or forever if repeats is None, after which the
+    effect has ended and its last keyframe stays shown.
+
+    Which keyframe is shown is worked out from the time of the frame, so
+    the effect keeps time however late frames are or commands arrive.
+    """
+
+    def __init__(self, name, keyframes, start, step = 1, repeats = 1, repeat_from = 0):
+        self.name = name
+        self.keyframes = keyframes
+        self.start = start
+        self.step = step
+        self.repeats = repeats
+        self.repeat_from = repeat_from
+
+    def _slot(self, at):
+        """Return the keyframe index at monotonic time at, None once ended"""
+        frame = max(0, round((at - self.start) * 1000 / LOOP_MS))
+        slot = frame // self.step
+        if slot < self.repeat_from:
+            return slot
+        cycle = len(self.keyframes) - self.repeat_from
+        (repeat, slot) = divmod(slot - self.repeat_from, cycle)
+        if self.repeats is not None and self.repeats <= repeat:
+            return None
+        return self.repeat_from + slot
+
+    def keyframe(self, at):
+        """Return the keyframe to show at monotonic time at"""
+        slot = self._slot(at)
+        if slot is None:
+            return self.keyframes[-1]
+        return self.keyframes[slot]
+
+    def ended(self, at):
+        """Return True if the effect has ended by monotonic time at"""
+        return self._slot(at) is None
+
+
+def pulse_effect(color, length, start):
+    """
+    Pulse all pixels in a color: dimming from the default brightness then
+    brightening and dimming between the pulse brightness limits forever
+    """
+    colors = (color,) * length
+    levels = (list(range(DEFAULT_BRIGHTNESS - PULSE_BRIGHTNESS_STEP,
+            MIN_PULSE_BRIGHTNESS, -PULSE_BRIGHTNESS_STEP)) + [MIN_PULSE_BRIGHTNESS])
+    repeat_from = len(levels)
+    levels += (list(range(MIN_PULSE_BRIGHTNESS + PULSE_BRIGHTNESS_STEP,
+            MAX_PULSE_BRIGHTNESS, PULSE_BRIGHTNESS_STEP)) + [MAX_PULSE_BRIGHTNESS] +
+        list(range(MAX_PULSE_BRIGHTNESS - PULSE_BRIGHTNESS_STEP,
+            MIN_PULSE_BRIGHTNESS, -PULSE_BRIGHTNESS_STEP)) + [MIN_PULSE_BRIGHTNESS])
+    keyframes = [((level,) * length, colors) for level in levels]
+    return Effect("pulse", keyframes, start, repeats = None, repeat_from = repeat_from)
+
+
+def blink_effect(color, duration, repeats, length, start):
+    """
+    Blink all pixels in a color repeats times over about duration ms,
+    starting dark and ending bright
+    """
+    # Calculate the time for each half-blink, round to nearest loop
+    # duration. This is integer math!
+    wait_ms = duration // (2 * repeats)
+    wait_ms = (wait_ms + (LOOP_MS // 2)) // LOOP_MS * LOOP_MS
+    if wait_ms < LOOP_MS:
+        wait_ms = LOOP_MS
+
+    colors = (color,) * length
+    keyframes = [((MIN_PULSE_BRIGHTNESS,) * length, colors),
+        ((MAX_PULSE_BRIGHTNESS,) * length, colors)]
+    return Effect("blink", keyframes, start, wait_ms // LOOP_MS, repeats)
+
+
+def wipe_effect(color, duration, colors, start):
+    """
+    Change the pixels, from colors, to a color one pixel at a time over
+    about duration ms
+    """
+    length = len(colors)
+    # Calculate the time for each pixel, round to nearest 100ms, minimum
+    # is 100ms. This is integer math!
+    wait_ms = duration // length
+    wait_ms = (wait_ms + (LOOP_MS // 2)) // LOOP_MS * LOOP_MS
+    if wait_ms < LOOP_MS:
+        wait_ms = LOOP_MS
+
+    brightness = (DEFAULT_BRIGHTNESS,) * length
+    keyframes = [(brightness, (color,) * (pixel + 1) + tuple(colors[pixel + 1:]))
+        for pixel in range(length)]
+    return Effect("wipe", keyframes, start, wait_ms // LOOP_MS)
+
+
 
 class DotstarStrip:
     """
@@ -37,7 +146,7 @@ class DotstarStrip:
     colors are transmitted to a Dotstar is B-blue-green.
     """
 
-    def __init__(self, length, spi_bus, spi_device):
+    def __init__(self, length, spi_bus, spi_device, refresh_ms = REFRESH_MS):
         logging.info("DRVR Creating DotstarStrip")
         # number of pixels in the strip
         self.length = length
@@ -45,19 +154,32 @@ class DotstarStrip:
         self.brightness = [DEFAULT_BRIGHTNESS] * length
         self.led_colors = [BLACK] * length
 
-        self.is_pulsing = False
-        self.brightness_step = 0
-        self.pulse_rising = False
-
-        self.is_blinking = False
-        self.blink_color = BLACK
-
-        self.is_wiping = False
-        self.wipe_color = BLACK
-
-        self.total_duration = 0
-        self.step_ms = 0
-        self.effect_time = 0
+        # the effect running, if any
+        self.effect = None
+
+        # The whole frame sent to the strip: a start frame of four zero
+        # bytes, four bytes per pixel, four zero bytes for the SK9822 and an
+        # end frame of a zero byte per 16 pixels. The last frame sent is kept
+        # so an unchanged frame need not be sent again
+        self.frame = bytearray(4 + 4 * length + 4 + length // 16 + 1)
+        self.sent_frame = bytearray(len(self.frame))
+        self.sent = False
+        self.sent_at = 0
+        self.refresh_ms = refresh_ms
+        self.frames_sent = 0
+        self.frames_skipped = 0
+
+        # how late, in seconds, frames were shown
+        self.frames = 0
+        self.frames_missed = 0
+        self.total_jitter = 0
+        self.max_jitter = 0
+
+        # The last frame read from the controller's framebuffer, four bytes
+        # per pixel: brightness, red, green and blue. The framebuffer starts
+        # at sequence number 0 with nothing written
+        self.pixels = bytearray(4 * length)
+        self.pixels_sequence = 0
 
         # Create signal handlers
         signal.signal(signal.SIGTERM, self.catch_signal)
@@ -89,214 +211,235 @@ class DotstarStrip:
         """Change the color of a single pixel."""
         self.led_colors[number] = color
 
-    def show(self):
-        """Transmit the desired brightness and colors to the Dotstars.
+    def load_frame(self, framebuffer):
+        """Show the framebuffer's frame if it has changed, ending any effect.
 
-        The dotstars require a "begin frame" consisting of four all-zero
-        bytes before actual data is sent, and an "end frame" of four all-one
-        bytes after the data is sent
+        Returns True if a new frame was loaded
         """
-        self.spi.writebytes([0x00] * 4)  # begin frame
+        sequence = framebuffer.read(self.pixels, self.pixels_sequence)
+        if sequence is None:
+            return False
+        self.pixels_sequence = sequence
+
+        self.effect = None
+        pixels = self.pixels
+        for pixel in range(self.length):
+            offset = 4 * pixel
+            self.brightness[pixel] = pixels[offset] & 0x1F
+            # stored as the commands store colors, see DotstarController
+            self.led_colors[pixel] = (pixels[offset + 3], pixels[offset + 1], pixels[offset + 2])
+        return True
+
+    def advance(self, at):
+        """Set the pixels to the running effect's keyframe at monotonic time at."""
+        effect = self.effect
+        if effect is None:
+            return
+        (brightness, colors) = effect.keyframe(at)
+        self.brightness = list(brightness)
+        self.led_colors = list(colors)
+        if effect.ended(at):
+            self.effect = None
+
+    def show_frame(self, due, framebuffer = None):
+        """Show the frame due at monotonic time due.
+
+        Any new frame in the framebuffer is shown, or else the running
+        effect is advanced. How late the frame is shown is recorded.
+        """
+        jitter = time.monotonic() - due
+        self.frames += 1
+        self.total_jitter += jitter
+        self.max_jitter = max(self.max_jitter, jitter)
+
+        if framebuffer is not None:
+            self.load_frame(framebuffer)
+        self.advance(due)
+        self.show()
+
+    def stats(self):
+        """
+        Return a dictionary of the frames shown, sent, skipped as unchanged
+        and missed, and the mean and longest time in milliseconds frames
+        were shown late
+        """
+        return {
+            "frames": self.frames,
+            "frames_sent": self.frames_sent,
+            "frames_skipped": self.frames_skipped,
+            "frames_missed": self.frames_missed,
+            "mean_jitter_ms": 1000 * self.total_jitter / self.frames if self.frames else 0,
+            "max_jitter_ms": 1000 * self.max_jitter
+        }
+
+    def render(self):
+        """Write the brightness and colors of the pixels into the frame."""
+        frame = self.frame
+        offset = 4
         # for red, green, blue in self.led_colors:  # swap blue, green order
         for pixel in range(self.length):
-            self.spi.writebytes(
-                [
-                    0xE0 + self.brightness[pixel],
-                    self.led_colors[pixel][0],
-                    self.led_colors[pixel][2],
-                    self.led_colors[pixel][1],
-                ]
-            )
-        self.spi.writebytes([0x00] * 4)  # SK9822 frame
-        self.spi.writebytes([0x00] * (self.length // 16 + 1))  # end frame
+            color = self.led_colors[pixel]
+            frame[offset] = 0xE0 + self.brightness[pixel]
+            frame[offset + 1] = color[0]
+            frame[offset + 2] = color[2]
+            frame[offset + 3] = color[1]
+            offset += 4
+
+    def show(self, force = False):
+        """Transmit the desired brightness and colors to the Dotstars.
+
+        The whole frame is sent in one transfer, unless it is the same as
+        the last frame sent and that was sent less than refresh_ms ago.
+
+        force - send the frame even if it has not changed
+        Returns True if the frame was sent
+        """
+        self.render()
+        now = time.monotonic()
+        if (not force and self.sent and self.frame == self.sent_frame and
+                (self.refresh_ms <= 0 or (now - self.sent_at) * 1000 < self.refresh_ms)):
+            self.frames_skipped += 1
+            return False
+
+        self.spi.writebytes2(self.frame)
+        self.sent_frame[:] = self.frame
+        self.sent = True
+        self.sent_at = now
+        self.frames_sent += 1
+        return True
 
     def catch_signal(self, signum, frame):
         logging.info("DRVR caught signal")
         self.signalled = True
 
-def process_command(command, led_strip):
+def process_command(command, led_strip, start = None):
     """
-    Process command strings from the controller.
+    Process binary commands, see DriverProtocol, from the controller.
+
+    The integer parameter ranges are verified in the abstract base class.
 
-    The length of these strings is verified in the abstract base class, which
-    also verifies the integer parameter ranges.
+    start - the monotonic time of the first frame of an effect the command
+    starts, by default now
     """
     errno = 0
 
-    # split the string into a list of tokens
-    tokens = command.split()
-    params = [int(token) for token in tokens[1:]]
-    # get command part of string and determine if it is recognized
-    if tokens[0] == "blink":
+    try:
+        (name, params) = decode(command)
+    except ValueError as e:
+        logging.error("DRVR ignoring command: %s", e)
+        return 1
+
+    if start is None:
+        start = time.monotonic()
+    effect = led_strip.effect
+
+    # determine if the command is recognized
+    if name == "blink":
         # Receiving a blink command aborts wiping or pulsing
-        led_strip.is_wiping = False
-        led_strip.is_pulsing = False
         # the blink command requires a color tuple, a duration (ms),
         # and a repeat count as inputs
-        red, green, blue, led_strip.duration, led_strip.repeats = params
-        led_strip.fill_pixels((red, green, blue))
-        led_strip.is_blinking = True
-
-        # Initialize effect parameters
-        led_strip.effect_time = 0
-        # a blink starts will all pixels dark
-        led_strip.set_brightness(MIN_PULSE_BRIGHTNESS)
-        # Calculate the time for each half-blink, round to nearest loop
-        # duration. This is integer math!
-        led_strip.wait_ms = led_strip.duration // (2 * led_strip.repeats)
-        led_strip.wait_ms = (led_strip.wait_ms + (LOOP_MS // 2)) // LOOP_MS * LOOP_MS
-        if led_strip.wait_ms < LOOP_MS:
-            led_strip.wait_ms = LOOP_MS
-
-        # Calculate the actual duration of the effect, using the calculated
-        # duration for each blink
-        led_strip.duration = led_strip.wait_ms * 2 * led_strip.repeats
-
-    elif tokens[0] == "wipe":
+        red, green, blue, duration, repeats = params
+        led_strip.effect = blink_effect((red, green, blue), duration, repeats,
+            led_strip.length, start)
+
+    elif name == "wipe":
         # Receiving a wipe command aborts blinking or pulsing
-        led_strip.is_blinking = False
-        led_strip.is_pulsing = False
         # The wipe command changes the pixel colors one pixel at a time.
         # The command requires four integer values: red, green, blue, and
         # duration. Duration is milliseconds.
-        red, green, blue, led_strip.duration = params
-        led_strip.wipe_color = (red, green, blue)
-
-        led_strip.is_wiping = True
-        led_strip.set_brightness(DEFAULT_BRIGHTNESS)
-        led_strip.effect_time = 0
-
-        # Calculate the time for each half-blink, round to nearest 100ms,
-        # minimum is 100ms. This is integer math!
-        led_strip.wait_ms = led_strip.duration // led_strip.length
-        led_strip.wait_ms = (led_strip.wait_ms + (LOOP_MS // 2)) // LOOP_MS * LOOP_MS
-        if led_strip.wait_ms < LOOP_MS:
-            led_strip.wait_ms = LOOP_MS
-        # Calculate the actual duration of the effect, using the calculated
-        # duration for each blink
-        led_strip.duration = led_strip.wait_ms * led_strip.length
-
-        # Change the first pixel color to the wipe color
-        led_strip.set_pixel_color(led_strip.wipe_color, 0)
-
-    elif tokens[0] == "color":
+        red, green, blue, duration = params
+        led_strip.effect = wipe_effect((red, green, blue), duration,
+            led_strip.led_colors, start)
+
+    elif name == "color":
         logging.debug("got color command")
-        # Receiving a color command aborts wiping and blinking in process
-        led_strip.is_wiping = False
-        led_strip.is_blinking = False
         # The color command sets all of the pixels to the same color.
         # The command requires three integer values: red, green, and blue.
         red, green, blue = params
 
-        # Setting the color to black aborts all other effects
-        if (red, green, blue) == BLACK:
-            led_strip.is_blinking = False
-            led_strip.is_pulsing = False
-
-        # Go to default brightness if no other effect in progress
-        if not led_strip.is_blinking and not led_strip.is_pulsing:
+        # A pulse carries on in the new color, unless the color is black.
+        # Any other effect is aborted
+        if (effect is not None and effect.name == "pulse" and
+                (red, green, blue) != BLACK):
+            led_strip.effect = pulse_effect((red, green, blue), led_strip.length,
+                effect.start)
+        else:
+            led_strip.effect = None
             led_strip.set_brightness(DEFAULT_BRIGHTNESS)
-
         led_strip.fill_pixels((red, green, blue))
 
-    elif tokens[0] == "pulse":
+    elif name == "pulse":
         # Receiving a pulse command aborts blinking or wiping
-        led_strip.is_blinking = False
-        led_strip.is_wiping = False
         # The pulse command changes the brightness of all pixels so they are
         # pulsing. The pulse rate is hard coded using constant parameters.
         # The command requires three integer values: red, green, and blue.
         red, green, blue = params
-        led_strip.fill_pixels((red, green, blue))
 
-        # If already pulsing then only the color can change, else initialize
-        # all pulse parameters.
-        if not led_strip.is_pulsing:
-            led_strip.set_brightness(DEFAULT_BRIGHTNESS)
-            led_strip.is_pulsing = True
-            led_strip.pulse_rising = False
+        # If already pulsing then only the color can change
+        if effect is not None and effect.name == "pulse":
+            start = effect.start
+        led_strip.effect = pulse_effect((red, green, blue), led_strip.length, start)
     else:
         errno = 1
 
     return errno
 
 
-def strip_driver(command_queue, led_count, spi_bus, spi_dev):
+def strip_driver(command_queue, led_count, spi_bus, spi_dev, refresh_ms = REFRESH_MS,
+        framebuffer = None):
     """
     This is the main process of the driver.
 
-    It waits until a command is received or the queue "get" times out.
-    If the "get" times out then we handle a single step of any current effect.
+    It shows a frame every LOOP_MS, at a fixed time of the monotonic clock,
+    and in between waits for commands. Each frame shows any new frame in the
+    framebuffer or else the next keyframe of the current effect.
     This is an infinite loop.
+
+    Returns the strip's statistics once the OS stops the driver
     """
     # Create and initialize an LED strip
-    led_strip = DotstarStrip(led_count, spi_bus, spi_dev)
+    led_strip = DotstarStrip(led_count, spi_bus, spi_dev, refresh_ms)
     led_strip.show()
 
+    frame_s = LOOP_MS / 1000
+    due = time.monotonic() + frame_s
+
     # loop forever (until OS kills us)
     while not led_strip.signalled:
-        # Wait up to LOOP_MS for a command.
+        now = time.monotonic()
+        if due <= now:
+            led_strip.show_frame(due, framebuffer)
+            due += frame_s
+            # when too far behind, drop the frames missed rather than
+            # sending them all at once
+            now = time.monotonic()
+            if due <= now:
+                missed = int((now - due) / frame_s) + 1
+                led_strip.frames_missed += missed
+                due += missed * frame_s
+            continue
+
+        # Wait until the next frame is due for a command.
         try:
-            command = command_queue.get(True, (LOOP_MS / 1000))
-            process_command(command, led_strip)
-            command_queue.task_done()
-        except:
-            if led_strip.is_blinking:
-                # Are we done blinking?
-                if led_strip.effect_time < led_strip.duration:
-                    # Is the current effect time an even or odd multiple of
-                    # the wait_ms time? If even, go to low brightness level.
-                    if (led_strip.effect_time // led_strip.wait_ms) % 2 == 0:
-                        led_strip.set_brightness(MIN_PULSE_BRIGHTNESS)
-                    # If odd, go to high brightness level.
-                    else:
-                        led_strip.set_brightness(MAX_PULSE_BRIGHTNESS)
-
-                    led_strip.effect_time = led_strip.effect_time + LOOP_MS
-                # Done blinking.
-                else:
-                    led_strip.is_blinking = False
-
-            if led_strip.is_wiping:
-                # Are we done wiping?
-                if led_strip.effect_time < led_strip.duration:
-                    # After each wait_ms we change the color of the next LED
-                    index = led_strip.effect_time // led_strip.wait_ms
-                    led_strip.set_pixel_color(led_strip.wipe_color, index)
-                    led_strip.effect_time = led_strip.effect_time + LOOP_MS
-                # Done wiping. Maker sure all LEDs have the final color.
-                else:
-                    led_strip.is_wiping = False
-                    led_strip.fill_pixels(led_strip.wipe_color)
-
-            if led_strip.is_pulsing:
-                # All pixels will have the same brightness. Get that value
-                # from pixel 0
-                brightness = led_strip.brightness[0]
-                # If getting brighter, add to the brightness
-                if led_strip.pulse_rising:
-                    brightness += PULSE_BRIGHTNESS_STEP
-                    if brightness >= MAX_PULSE_BRIGHTNESS:
-                        led_strip.pulse_rising = False
-                        brightness = MAX_PULSE_BRIGHTNESS
-                # If getting darker, subtract from the brightness
-                else:
-                    brightness -= PULSE_BRIGHTNESS_STEP
-                    if brightness <= MIN_PULSE_BRIGHTNESS:
-                        led_strip.pulse_rising = True
-                        brightness = MIN_PULSE_BRIGHTNESS
-                # Set all pixels to the new brightness level.
-                led_strip.set_brightness(brightness)
-
-            # Send the new brightness and color values out to the Dotstars
-            led_strip.show()
+            command = command_queue.get(True, due - now)
+        except queue.Empty:
+            continue
+        # an effect starts with the next frame
+        process_command(command, led_strip, due)
+        command_queue.task_done()
 
     # Caught TERM or KILL from OS
     # Set the LEDs to a dim red
     logging.info("DRVR stopping")
+    led_strip.effect = None
     led_strip.brightness = [MIN_PULSE_BRIGHTNESS] * led_strip.length
     led_strip.led_colors = [DARKRED] * led_strip.length
-    led_strip.is_pulsing = False
-    led_strip.is_blinking = False
-    led_strip.is_wiping = False
-    led_strip.show()
+    led_strip.show(True)
+    if framebuffer is not None:
+        framebuffer.close()
+    stats = led_strip.stats()
+    logging.info("DRVR sent %d frames, skipped %d unchanged frames",
+        led_strip.frames_sent, led_strip.frames_skipped)
+    logging.info("DRVR showed %d frames %.2f ms late on average and at most %.2f ms, missed %d",
+        stats["frames"], stats["mean_jitter_ms"], stats["max_jitter_ms"], stats["frames_missed"])
+    return stats
@@ -0,0 +1,109 @@
+"""
+A framebuffer in shared memory through which a display controller sets the
+content of every pixel, read by the driver process on its next tick.
+"""
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+# Dotstar brightness is a 5-bit value from 0 to 31
+MAX_BRIGHTNESS = 31
+
+# The sequence counter is 32 bits so it is written in one store on the Pi 0
+_SEQUENCE_SIZE = 4
+_PIXEL_SIZE = 4
+
+# How many times the driver tries to read a frame being written before it
+# leaves it for its next tick
+READ_ATTEMPTS = 3
+
+
+class FrameBuffer:
+    """
+    A sequence counter followed by, per pixel, a brightness and red, green
+    and blue bytes, in shared memory
+
+    Writes are guarded by the sequence counter as a seqlock: the writer makes
+    the counter odd while it writes and even again when it is done. A reader
+    copies the frame between two reads of the counter and discards the copy
+    if the counter was odd or changed. There is one writer, the controller,
+    and readers never block it.
+    """
+
+    def __init__(self, length):
+        self._attach(shared_memory.SharedMemory(create=True,
+            size=_SEQUENCE_SIZE + _PIXEL_SIZE * length), length)
+
+    def __getstate__(self):
+        # the views of the shared memory can not be pickled, a spawned
+        # driver process attaches to the shared memory by name instead
+        return (self.memory.name, self.length)
+
+    def __setstate__(self, state):
+        (name, length) = state
+        self._attach(shared_memory.SharedMemory(name=name), length)
+
+    def _attach(self, memory, length):
+        self.length = length
+        self.memory = memory
+        self.sequence = memory.buf[:_SEQUENCE_SIZE].cast("I")
+        self.pixels = memory.buf[_SEQUENCE_SIZE:_SEQUENCE_SIZE + _PIXEL_SIZE * length]
+
+    @contextmanager
+    def writing(self):
+        """
+        Write a frame in place.
+
+        Yields a memoryview of the pixels, four bytes each: brightness, red,
+        green and blue. The driver sees the frame once the block ends.
+        """
+        self.sequence[0] = (self.sequence[0] + 1) & 0xFFFFFFFF
+        try:
+            yield self.pixels
+        finally:
+            self.sequence[0] = (self.sequence[0] + 1) & 0xFFFFFFFF
+
+    def write(self, colors, brightness=MAX_BRIGHTNESS):
+        """
+        Write a frame of colors at one brightness.
+
+        colors - one bytes object of red, green and blue per pixel
+        brightness - 0 to MAX_BRIGHTNESS
+        """
+        if len(colors) != self.length:
+            raise ValueError("A frame has {} pixels not {}".format(self.length, len(colors)))
+        with self.writing() as pixels:
+            for (pixel, color) in enumerate(colors):
+                offset = _PIXEL_SIZE * pixel
+                pixels[offset] = brightness
+                pixels[offset + 1:offset + 4] = color
+
+    def read(self, frame, last_sequence=None):
+        """
+        Copy the latest complete frame, called by the driver.
+
+        frame - a bytearray of four bytes per pixel to copy into
+        last_sequence - the sequence number of the frame read last
+        Returns the frame's sequence number, or None if the frame has not
+        changed since last_sequence or is being written
+        """
+        for attempt in range(READ_ATTEMPTS):
+            before = self.sequence[0]
+            if before == last_sequence:
+                return None
+            if before & 1:
+                continue
+            frame[:] = self.pixels
+            if self.sequence[0] == before:
+                return before
+        return None
+
+    def close(self):
+        """Detach from the shared memory."""
+        self.sequence.release()
+        self.pixels.release()
+        self.memory.close()
+
+    def unlink(self):
+        """Free the shared memory, called by the controller once done, not
+        by a process which attached to it."""
+        self.memory.unlink()
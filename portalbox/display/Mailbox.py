@@ -0,0 +1,98 @@
+"""
+A latest-wins channel carrying commands from a display controller to its
+driver process.
+"""
+import multiprocessing
+import queue
+
+# The longest command, in bytes, the mailbox holds
+DEFAULT_SIZE = 64
+
+
+class Mailbox:
+    """
+    A single command slot shared with a driver process
+
+    Posting a command never waits for the driver: it replaces any command
+    the driver has not yet taken, so a burst of commands only delivers the
+    last. The driver takes commands with get() and marks them processed with
+    task_done(), as with a queue. A caller needing confirmation waits for the
+    sequence number put() returned to be processed, a command replaced by a
+    later one counts as processed once the later one is.
+    """
+
+    def __init__(self, size=DEFAULT_SIZE):
+        self.condition = multiprocessing.Condition()
+        self.buffer = multiprocessing.RawArray("c", size)
+        self.length = multiprocessing.RawValue("i", 0)
+        # sequence numbers of the last command posted, taken and processed
+        self.posted = multiprocessing.RawValue("Q", 0)
+        self.taken = multiprocessing.RawValue("Q", 0)
+        self.processed = multiprocessing.RawValue("Q", 0)
+        self.coalesced = multiprocessing.RawValue("Q", 0)
+
+    def put(self, command):
+        """
+        Post a command, replacing any the driver has not yet taken.
+
+        command - bytes, or a str, no longer than the mailbox
+        Returns the command's sequence number
+        """
+        if isinstance(command, str):
+            command = command.encode()
+        if len(command) > len(self.buffer):
+            raise ValueError("Command of {} bytes does not fit the mailbox".format(len(command)))
+
+        with self.condition:
+            if self.posted.value != self.taken.value:
+                self.coalesced.value += 1
+            self.buffer[:len(command)] = command
+            self.length.value = len(command)
+            self.posted.value += 1
+            self.condition.notify_all()
+            return self.posted.value
+
+    def wait(self, sequence, timeout=None):
+        """
+        Wait for the command with the sequence number, or a later one, to
+        be processed.
+
+        Returns True if it was processed within timeout seconds
+        """
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: self.processed.value >= sequence, timeout)
+
+    def get(self, block=True, timeout=None):
+        """
+        Take the latest command, as bytes, called by the driver.
+
+        Raises queue.Empty if no command is posted within timeout seconds
+        """
+        with self.condition:
+            if not self.condition.wait_for(
+                    lambda: self.posted.value != self.taken.value,
+                    timeout if block else 0):
+                raise queue.Empty
+            self.taken.value = self.posted.value
+            return self.buffer[:self.length.value]
+
+    def task_done(self):
+        """Mark the command last taken as processed, called by the driver."""
+        with self.condition:
+            self.processed.value = self.taken.value
+            self.condition.notify_all()
+
+    def close(self):
+        pass
+
+    def stats(self):
+        """
+        Return a dictionary of the number of commands posted and the number
+        replaced before the driver took them
+        """
+        with self.condition:
+            return {
+                "posted": self.posted.value,
+                "coalesced": self.coalesced.value
+            }
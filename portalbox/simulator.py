@@ -0,0 +1,617 @@
+#!python3
+
+"""
+A simulated Raspberry Pi GPIO and SPI bus with an MFRC522 and a card, so the
+RFID code can be exercised without the hardware.
+
+install() puts stand ins for the RPi.GPIO and spidev modules in sys.modules;
+it must be called before portalbox.MFRC522 or portalbox.PortalBox is
+imported. Each call makes a fresh Simulator current, the stand in modules
+always delegate to the current one.
+"""
+
+# from standard library
+import sys
+import threading
+import types
+
+# Definitions aka constants
+IDLE = "IDLE"
+READY = "READY"
+ACTIVE = "ACTIVE"
+HALT = "HALT"
+
+VERSION = 0x92
+
+# The registers of the chip, and their values after a reset, which the
+# simulation gives meaning to
+COMMAND_REG = 0x01
+COMM_IEN_REG = 0x02
+DIV_IEN_REG = 0x03
+COMM_IRQ_REG = 0x04
+DIV_IRQ_REG = 0x05
+ERROR_REG = 0x06
+FIFO_DATA_REG = 0x09
+FIFO_LEVEL_REG = 0x0A
+CONTROL_REG = 0x0C
+BIT_FRAMING_REG = 0x0D
+TX_CONTROL_REG = 0x14
+CRC_RESULT_REG_M = 0x21
+CRC_RESULT_REG_L = 0x22
+T_MODE_REG = 0x2A
+VERSION_REG = 0x37
+
+RESET_VALUES = {
+    COMMAND_REG: 0x20,
+    COMM_IEN_REG: 0x80,
+    COMM_IRQ_REG: 0x14,
+    CONTROL_REG: 0x10,
+    0x0B: 0x08,     # WaterLevelReg
+    0x0E: 0x80,     # CollReg
+    0x11: 0x3F,     # ModeReg
+    TX_CONTROL_REG: 0x80,
+    0x16: 0x10,     # TxSelReg
+    0x17: 0x84,     # RxSelReg
+    0x18: 0x84,     # RxThresholdReg
+    0x19: 0x4D,     # DemodReg
+    0x1C: 0x62,     # MifareReg
+    CRC_RESULT_REG_M: 0xFF,
+    CRC_RESULT_REG_L: 0xFF,
+    0x24: 0x26,     # ModWidthReg
+    0x26: 0x48,     # RFCfgReg
+    0x27: 0x88,     # GsNReg
+    0x28: 0x20,     # CWGsPReg
+    0x29: 0x20,     # ModGsPReg
+    VERSION_REG: VERSION
+}
+
+PCD_IDLE = 0x00
+PCD_CALCCRC = 0x03
+PCD_TRANSMIT = 0x04
+PCD_TRANSCEIVE = 0x0C
+PCD_RESETPHASE = 0x0F
+
+TX_IRQ = 0x40
+RX_IRQ = 0x20
+IDLE_IRQ = 0x10
+TIMER_IRQ = 0x01
+CRC_IRQ = 0x04
+
+ATQA = [0x04, 0x00]
+SAK = 0x08
+
+def crc_a(data):
+    '''
+    @return the ISO 14443-3 CRC_A of data as a list of the low and high bytes
+    '''
+    crc = 0x6363
+    for byte in data:
+        byte ^= crc & 0xFF
+        byte = (byte ^ (byte << 4)) & 0xFF
+        crc = ((crc >> 8) ^ (byte << 8) ^ (byte << 3) ^ (byte >> 4)) & 0xFFFF
+    return [crc & 0xFF, crc >> 8]
+
+
+class SimulatedCard:
+    '''
+    A MIFARE Classic style card with a four byte UID, following the ISO
+    14443-3 states IDLE, READY, ACTIVE and HALT
+    '''
+
+    def __init__(self, uid):
+        self.uid = list(uid)
+        self.bcc = self.uid[0] ^ self.uid[1] ^ self.uid[2] ^ self.uid[3]
+        self.state = IDLE
+
+
+    def receive(self, frame):
+        '''
+        @return the card's answer to a frame from the reader, None if it does
+            not answer
+        '''
+        if frame == [0x26]:                                 # REQA
+            if self.state == IDLE:
+                self.state = READY
+                return list(ATQA)
+        elif frame == [0x52]:                               # WUPA
+            if self.state in (IDLE, HALT):
+                self.state = READY
+                return list(ATQA)
+        elif frame == [0x93, 0x20]:                         # ANTICOLLISION
+            if self.state == READY:
+                return self.uid + [self.bcc]
+        elif len(frame) == 9 and frame[:2] == [0x93, 0x70]: # SELECT
+            if (self.state == READY and frame[2:7] == self.uid + [self.bcc] and
+                    frame[7:] == crc_a(frame[:7])):
+                self.state = ACTIVE
+                return [SAK] + crc_a([SAK])
+        elif len(frame) == 4 and frame[:2] == [0x50, 0x00]: # HLTA
+            if self.state == ACTIVE and frame[2:] == crc_a(frame[:2]):
+                self.state = HALT
+                return None
+
+        # anything unexpected sends the card back to where it started
+        self.state = HALT if self.state == HALT else IDLE
+        return None
+
+
+class SimulatedMFRC522:
+    '''
+    The registers, FIFO and commands of an MFRC522 as seen over SPI, enough of
+    them for the commands used by portalbox.MFRC522
+    '''
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.lock = threading.RLock()
+        self.card = None
+        self.powered = True
+        self.transfers = 0
+        self.bytes_transferred = 0
+        self.commands = 0
+        self.transceives = 0
+        # bumped by each transceive and reset, outdating any running timer
+        self.generation = 0
+        self.reset()
+
+
+    def reset(self):
+        self.generation += 1
+        self.registers = [0] * 64
+        for address, value in RESET_VALUES.items():
+            self.registers[address] = value
+        self.fifo = []
+
+
+    def set_powered(self, powered):
+        '''
+        Follow the NRST pin, holding the chip in reset while it is low
+        '''
+        with self.lock:
+            if powered and not self.powered:
+                self.reset()
+                if self.card:
+                    # the field was off so the card lost power too
+                    self.card.state = IDLE
+            self.powered = powered
+            self._update_irq()
+
+
+    def xfer2(self, data):
+        '''
+        One SPI transfer. A transfer starting with a read address reads the
+        address sent in each following byte, but the last, with each result
+        one byte later. A transfer starting with a write address writes every
+        following byte to that address.
+        '''
+        with self.lock:
+            self.transfers += 1
+            self.bytes_transferred += len(data)
+            if not self.powered:
+                return [0] * len(data)
+
+            address = (data[0] >> 1) & 0x3F
+            if data[0] & 0x80:
+                result = [0]
+                for byte in data[1:]:
+                    result.append(self.read(address))
+                    address = (byte >> 1) & 0x3F
+                return result
+
+            for byte in data[1:]:
+                self.write(address, byte)
+            return [0] * len(data)
+
+
+    def read(self, address):
+        if address == FIFO_DATA_REG:
+            return self.fifo.pop(0) if self.fifo else 0
+        if address == FIFO_LEVEL_REG:
+            return len(self.fifo)
+        return self.registers[address]
+
+
+    def write(self, address, value):
+        if address == FIFO_DATA_REG:
+            if len(self.fifo) < 64:
+                self.fifo.append(value)
+        elif address == FIFO_LEVEL_REG:
+            if value & 0x80:
+                self.fifo = []
+        elif address in (COMM_IRQ_REG, DIV_IRQ_REG):
+            # bit 7 chooses whether the marked bits are set or cleared
+            if value & 0x80:
+                self.registers[address] |= value & 0x7F
+            else:
+                self.registers[address] &= ~value & 0x7F
+            self._update_irq()
+        elif address == COMMAND_REG:
+            self.registers[COMMAND_REG] = (self.registers[COMMAND_REG] & 0xF0) | (value & 0x0F)
+            self._command(value & 0x0F)
+        elif address == BIT_FRAMING_REG:
+            self.registers[BIT_FRAMING_REG] = value & 0x7F
+            if value & 0x80 and (self.registers[COMMAND_REG] & 0x0F) == PCD_TRANSCEIVE:
+                self._transceive()
+        elif address == CONTROL_REG:
+            self.registers[CONTROL_REG] = value & 0x3F
+            if value & 0x40:
+                # TStartNow, the simulated timer expires at once
+                self._set_irq(COMM_IRQ_REG, TIMER_IRQ)
+        elif address == VERSION_REG:
+            pass
+        else:
+            self.registers[address] = value
+            if address in (COMM_IEN_REG, DIV_IEN_REG):
+                self._update_irq()
+
+
+    def _command(self, command):
+        self.commands += 1
+        if command == PCD_RESETPHASE:
+            self.reset()
+            self._update_irq()
+        elif command == PCD_CALCCRC:
+            result = crc_a(self.fifo)
+            self.fifo = []
+            self.registers[CRC_RESULT_REG_L] = result[0]
+            self.registers[CRC_RESULT_REG_M] = result[1]
+            self._set_irq(DIV_IRQ_REG, CRC_IRQ)
+        elif command == PCD_TRANSMIT:
+            self._send()
+            self.registers[COMMAND_REG] &= 0xF0
+            self._set_irq(COMM_IRQ_REG, TX_IRQ | IDLE_IRQ)
+
+
+    def _send(self):
+        '''
+        Transmit the FIFO to the card
+        @return the card's answer or None
+        '''
+        frame = self.fifo
+        self.fifo = []
+        if self.card is None or not self.registers[TX_CONTROL_REG] & 0x03:
+            return None
+        return self.card.receive(frame)
+
+
+    def _transceive(self):
+        self.transceives += 1
+        self.generation += 1
+        answer = self._send()
+        self._set_irq(COMM_IRQ_REG, TX_IRQ)
+        if answer is None:
+            if self.registers[T_MODE_REG] & 0x80:
+                # the timer started automatically at the end of transmission
+                # and expires without an answer
+                if self.simulator.realtime:
+                    timer = threading.Timer(self.timer_period(), self._expire, (self.generation,))
+                    timer.daemon = True
+                    timer.start()
+                else:
+                    self._set_irq(COMM_IRQ_REG, TIMER_IRQ)
+            return
+
+        self.fifo = answer
+        self.registers[CONTROL_REG] &= ~0x07
+        self._set_irq(COMM_IRQ_REG, RX_IRQ)
+
+
+    def timer_period(self):
+        '''
+        @return the seconds the timer takes to expire as configured
+        '''
+        prescaler = ((self.registers[T_MODE_REG] & 0x0F) << 8) | self.registers[0x2B]
+        reload = (self.registers[0x2C] << 8) | self.registers[0x2D]
+        return (reload + 1) * (2 * prescaler + 1) / 13560000
+
+
+    def _expire(self, generation):
+        with self.lock:
+            # a timer outlived by the next transceive or a reset never expires
+            if generation == self.generation and self.powered:
+                self._set_irq(COMM_IRQ_REG, TIMER_IRQ)
+
+
+    def _set_irq(self, register, bits):
+        self.registers[register] |= bits
+        self._update_irq()
+
+
+    def _update_irq(self):
+        '''
+        Drive the IRQ pin from the interrupt request and enable registers
+        '''
+        active = self.powered and bool(
+            (self.registers[COMM_IRQ_REG] & self.registers[COMM_IEN_REG] & 0x7F) or
+            (self.registers[DIV_IRQ_REG] & self.registers[DIV_IEN_REG] & 0x14))
+        inverted = bool(self.registers[COMM_IEN_REG] & 0x80)
+        self.simulator.drive_irq(0 if active == inverted else 1)
+
+
+class FakeGPIO:
+    '''
+    The parts of RPi.GPIO used by the portal box. Pins driven by the
+    simulation are set with drive(); edge detection and callbacks follow them.
+    '''
+
+    BOARD = 10
+    BCM = 11
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.lock = threading.RLock()
+        self.mode = None
+        self.levels = {}
+        # channel -> [edge, detected, callbacks]
+        self.detections = {}
+
+
+    def setmode(self, mode):
+        self.mode = mode
+
+
+    def getmode(self):
+        return self.mode
+
+
+    def setwarnings(self, flag):
+        pass
+
+
+    def setup(self, channel, direction, pull_up_down = PUD_OFF, initial = None):
+        with self.lock:
+            if direction == FakeGPIO.IN and channel not in self.levels:
+                self.levels[channel] = 1 if pull_up_down == FakeGPIO.PUD_UP else 0
+            elif initial is not None:
+                self.output(channel, initial)
+
+
+    def output(self, channel, state):
+        self.drive(channel, 1 if state else 0)
+        self.simulator.pin_changed(channel, 1 if state else 0)
+
+
+    def input(self, channel):
+        with self.lock:
+            return self.levels.get(channel, 0)
+
+
+    def drive(self, channel, level):
+        '''
+        Set the level of a pin, firing any edge detection on it
+        '''
+        with self.lock:
+            previous = self.levels.get(channel, 0)
+            self.levels[channel] = level
+            detection = self.detections.get(channel)
+            if detection is None or previous == level:
+                return
+            edge = FakeGPIO.RISING if level else FakeGPIO.FALLING
+            if detection[0] not in (edge, FakeGPIO.BOTH):
+                return
+            detection[1] = True
+            callbacks = list(detection[2])
+
+        for callback in callbacks:
+            callback(channel)
+
+
+    def add_event_detect(self, channel, edge, callback = None, bouncetime = None):
+        with self.lock:
+            if channel in self.detections:
+                raise RuntimeError("Conflicting edge detection already enabled for this GPIO channel")
+            self.detections[channel] = [edge, False, [callback] if callback else []]
+
+
+    def add_event_callback(self, channel, callback):
+        with self.lock:
+            self.detections[channel][2].append(callback)
+
+
+    def remove_event_detect(self, channel):
+        with self.lock:
+            self.detections.pop(channel, None)
+
+
+    def event_detected(self, channel):
+        with self.lock:
+            detection = self.detections.get(channel)
+            if detection is None or not detection[1]:
+                return False
+            detection[1] = False
+            return True
+
+
+    def cleanup(self, channel = None):
+        with self.lock:
+            self.detections = {}
+
+
+    class PWM:
+        def __init__(self, channel, frequency):
+            self.channel = channel
+            self.frequency = frequency
+
+        def start(self, duty_cycle):
+            pass
+
+        def stop(self):
+            pass
+
+        def ChangeDutyCycle(self, duty_cycle):
+            pass
+
+        def ChangeFrequency(self, frequency):
+            self.frequency = frequency
+
+
+class FakeSpiDev:
+    '''
+    The parts of spidev.SpiDev used by the portal box. Full duplex transfers
+    go to the simulated chip, writes, as to the Dotstars, are counted and the
+    last one kept.
+    '''
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.max_speed_hz = 0
+        self.mode = 0
+        self.is_open = False
+        self.bus = None
+        self.device = None
+        self.writes = 0
+        self.bytes_written = 0
+        self.written = b""
+
+
+    def open(self, bus, device):
+        self.is_open = True
+        self.bus = bus
+        self.device = device
+        self.simulator.spi_devices.append(self)
+
+
+    def close(self):
+        self.is_open = False
+
+
+    def xfer2(self, data):
+        return self.simulator.chip.xfer2(list(data))
+
+
+    def writebytes(self, data):
+        if len(data) > 4096:
+            raise OverflowError("Argument list size exceeds 4096 bytes.")
+        self.writebytes2(data)
+
+
+    def writebytes2(self, data):
+        self.writes += 1
+        self.bytes_written += len(data)
+        self.written = bytes(data)
+
+
+class Simulator:
+    '''
+    A simulated portal box: GPIO, an SPI bus, an MFRC522 on the bus whose
+    NRST is wired to nrst_pin and IRQ, optionally, to irq_pin, and a card
+    which may be placed on the reader
+
+    The chip's timer expires at once unless realtime, when it takes as long
+    as it is configured to.
+    '''
+
+    def __init__(self, irq_pin = None, nrst_pin = 13, realtime = False):
+        self.irq_pin = irq_pin
+        self.nrst_pin = nrst_pin
+        self.realtime = realtime
+        self.spi_devices = []
+        self.gpio = FakeGPIO(self)
+        self.chip = SimulatedMFRC522(self)
+
+
+    def SpiDev(self):
+        return FakeSpiDev(self)
+
+
+    def present(self, uid):
+        '''
+        Place a card with the given four byte UID on the reader
+        '''
+        with self.chip.lock:
+            self.chip.card = SimulatedCard(uid)
+
+
+    def remove(self):
+        '''
+        Take the card off the reader
+        '''
+        with self.chip.lock:
+            self.chip.card = None
+
+
+    def drive_irq(self, level):
+        if self.irq_pin is not None:
+            self.gpio.drive(self.irq_pin, level)
+
+
+    def pin_changed(self, channel, level):
+        if channel == self.nrst_pin:
+            self.chip.set_powered(bool(level))
+
+
+    def spi_device(self, bus, device):
+        '''
+        @return the FakeSpiDev last opened on the bus and device, None if none
+            has been
+        '''
+        for spi in reversed(self.spi_devices):
+            if (spi.bus, spi.device) == (bus, device):
+                return spi
+        return None
+
+
+    def stats(self):
+        '''
+        @return a dictionary of the SPI transfers, bytes and chip commands
+            seen by the simulated chip
+        '''
+        with self.chip.lock:
+            return {
+                "transfers": self.chip.transfers,
+                "bytes": self.chip.bytes_transferred,
+                "commands": self.chip.commands,
+                "transceives": self.chip.transceives
+            }
+
+
+class _Delegate(types.ModuleType):
+    '''
+    A module whose attributes are looked up on an attribute of the current
+    simulator
+    '''
+
+    def __init__(self, name, attribute):
+        types.ModuleType.__init__(self, name)
+        self._attribute = attribute
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(getattr(_current, self._attribute), name)
+
+
+_current = None
+
+def install(irq_pin = None, nrst_pin = 13, realtime = False):
+    '''
+    Make a new Simulator current, installing stand ins for RPi.GPIO and
+    spidev in sys.modules if they are not there yet
+
+    @return the Simulator
+    '''
+    global _current
+    _current = Simulator(irq_pin, nrst_pin, realtime)
+
+    if not isinstance(sys.modules.get("RPi.GPIO"), _Delegate):
+        gpio = _Delegate("RPi.GPIO", "gpio")
+        rpi = types.ModuleType("RPi")
+        rpi.__path__ = []
+        rpi.GPIO = gpio
+        spidev = types.ModuleType("spidev")
+        spidev.SpiDev = lambda: _current.SpiDev()
+        sys.modules["RPi"] = rpi
+        sys.modules["RPi.GPIO"] = gpio
+        sys.modules["spidev"] = spidev
+
+    return _current
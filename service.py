@@ -27,19 +27,23 @@
 
 # from the standard library
 import configparser
+from datetime import datetime, timedelta
 import logging
 import os
 import signal
 import sys
 import threading
-from time import sleep, time
+from time import monotonic, sleep, time
 from uuid import getnode as get_mac_address
 import socket
 
 # our code
 import portal_fsm as fsm
-from portalbox.PortalBox import PortalBox
+from CardPoller import CardPoller
+from EventLoop import EventLoop
+from portalbox.PortalBox import PortalBox, RFIDReaderError
 from Database import Database
+from WebService import NotRegisteredError, OutOfServiceError
 from Emailer import Emailer
 from CardType import CardType
 
@@ -76,6 +80,23 @@ class PortalBoxApplication():
         self.settings = settings
         self.running = False
         self.card_id = 0
+        self.started_at = monotonic()
+        self.started_from_snapshot = False
+
+        # the main loop blocks on events rather than polling continuously
+        loop_settings = {}
+        if settings.has_section("loop"):
+            loop_settings = settings["loop"]
+        self.events = EventLoop(loop_settings)
+        self.box.set_button_callback(lambda channel: self.events.post(EventLoop.BUTTON, block = False))
+        # the RFID reader is polled on a thread of its own, started once the
+        # box is set up
+        self.card_poller = CardPoller(self.box.read_RFID_card, self.events, loop_settings,
+            (RFIDReaderError,))
+        # the card most recently read, its details may still be being looked up
+        self.card_present = -1
+        # when the card most recently read was removed
+        self.card_removed_at = datetime.now()
 
 
     def __del__(self):
@@ -118,6 +139,18 @@ class PortalBoxApplication():
         logging.info("Successfully connected to email")
 
 
+    def check_email_server(self):
+        """
+        Check that the email server can be reached, so a misconfiguration is
+        found at startup rather than when an email needs to be sent
+        """
+        if not self.emailer:
+            return
+
+        self.emailer.check_connection()
+        logging.info("Email server is reachable")
+
+
     def getmac(self, interface):
         """From Julio SChurt on https://stackoverflow.com/questions/159137/getting-mac-address"""
         try:
@@ -128,30 +161,51 @@ class PortalBoxApplication():
         return mac[0:17]
 
 
-    def record_ip(self):
+    def get_ip_address(self):
         """
-        This gets the IP address for the box and then records it in the database
+        This gets the IP address for the box
+
+        @return the IP address as a string or None if it can't be determined
         """
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        ip_address = s.getsockname()[0]
-        self.db.record_ip(self.equipment_id, ip_address)
+        try:
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.connect(("8.8.8.8", 80))
+            return s.getsockname()[0]
+        except OSError as e:
+            logging.error(f"Unable to determine IP address: {e}")
+            return None
 
 
     def get_equipment_role(self):
         """
-        Gets the equipments role from the database with the given mac address
+        Gets the equipments role from the database with the given mac address,
+        telling the database that the box has started and its IP address in
+        the same exchange
+
+        If the startup snapshot holds a role for this box, the role is taken
+        from the snapshot and checked with the database in the background so
+        the box can start while the database is unreachable
         """
+        # Step 1 Figure out our identity
+        logging.debug("Attempting to get mac address")
+        mac_address = self.getmac("wlan0").replace(":","")
+        logging.debug("Successfully got mac address: {}".format(mac_address))
+
+        profile = self.db.load_equipment_profile(mac_address)
+        if profile:
+            logging.info("Starting from the startup snapshot")
+            self.started_from_snapshot = True
+            self.set_equipment_role(profile)
+            threading.Thread(target = self.revalidate_equipment_role,
+                args = (mac_address, profile), name = "revalidate_role",
+                daemon = True).start()
+            return
+
         # Determine what we are
         profile = (-1,)
         while profile[0] < 0:
           try:
-              # Step 1 Figure out our identity
-              logging.debug("Attempting to get mac address")
-              mac_address = self.getmac("wlan0").replace(":","")
-              logging.debug("Successfully got mac address: {}".format(mac_address))
-
-              profile = self.db.get_equipment_profile(mac_address)
+              profile, _ = self.db.hello(mac_address, self.get_ip_address())
           except Exception as e:
             logging.debug(f"{e}")
             logging.debug("Didn't get profile, trying again in 5 seconds")
@@ -161,25 +215,78 @@ class PortalBoxApplication():
         # shutdown before we discovered a role
         if profile[0] < 0:
             raise RuntimeError("Cannot start, no role has been assigned")
+
+        self.set_equipment_role(profile)
+
+
+    def revalidate_equipment_role(self, mac_address, profile):
+        """
+        Check the role taken from the startup snapshot with the database,
+        retrying until the database answers. The database is told that the
+        box has started once it answers
+
+        A changed role is posted to the main loop, which adopts it. If the
+        database no longer accepts the box the snapshot is discarded and the
+        main loop is told to stop the service
+        """
+        while True:
+            try:
+                current, _ = self.db.hello(mac_address, self.get_ip_address())
+                break
+            except (NotRegisteredError, OutOfServiceError) as e:
+                logging.error("The database no longer accepts this box (%s), "
+                    "discarding the startup snapshot", e.__class__.__name__)
+                self.db.forget_equipment_profile()
+                self.events.post(EventLoop.FATAL, e)
+                return
+            except Exception as e:
+                logging.warning(f"Unable to revalidate the startup snapshot, trying again in 5 seconds: {e}")
+                sleep(5)
+
+        if current != profile:
+            logging.warning("Equipment profile has changed since the startup snapshot")
+            self.events.post(EventLoop.PROFILE, current)
         else:
-            self.equipment_id = profile[0]
-            self.equipment_type_id = profile[1]
-            self.equipment_type = profile[2]
-            self.location = profile[4]
-            self.timeout_minutes = profile[5]
-            self.allow_proxy = profile[6]
+            logging.info("Startup snapshot revalidated")
+
+
+    def set_equipment_role(self, profile):
+        """
+        Adopt the role described by an equipment profile
+        """
+        self.equipment_id = profile[0]
+        self.equipment_type_id = profile[1]
+        self.equipment_type = profile[2]
+        self.location = profile[4]
+        self.timeout_minutes = profile[5]
+        self.allow_proxy = profile[6]
+        self.db.start_roster(self.equipment_type_id)
 
         logging.info("Discovered identity. Type: %s(%s) Timeout: %s m Allows Proxy: %d",
             self.equipment_type,
             self.equipment_type_id,
             self.timeout_minutes,
             self.allow_proxy)
-        self.db.log_started_status(self.equipment_id)
 
 
-    def get_inputs(self, old_input_data):
+    def log_ready_time(self):
         """
-        Gets new inputs for the FSM and returns the dictionary
+        Log how long the box took to become ready for a card
+        """
+        logging.info("Ready for cards %.2f seconds after the service started, from the %s",
+            monotonic() - self.started_at,
+            "startup snapshot" if self.started_from_snapshot else "database")
+
+
+    def get_inputs(self, event, old_input_data):
+        """
+        Gets new inputs for the FSM in response to an event from the main loop
+        and returns the dictionary
+
+        Cards are reported by CARD_PRESENT and CARD_REMOVED events from the
+        card poller. The details of a newly read card are looked up in the
+        background and only become an input once they arrive, as a
+        CARD_DETAILS event, while the card is still present
 
         @returns a dictionary of the form
                 "card_id": (int)The card ID which was read,
@@ -189,20 +296,25 @@ class PortalBoxApplication():
                 "user_authority_level": (int) The authority of the user, 1 for normal user, 2 for trainer, 3 for admin
                 "button_pressed": (boolean) whether or not the button has been
                     pressed since the last time it was checked
+                "card_removed_at": (datetime) when the last card was removed,
+                    only present when no card is
         """
 
-        #Check for a card and get its ID
-        card_id = self.box.read_RFID_card()
-
-        #If a card is present, and old_input_data showed either no card present, or a different card present
-        if(card_id > 0 and card_id != old_input_data["card_id"]):
-            logging.info("Card with ID: %d read, Getting info from DB", card_id)
-            while True:
-                try:
-                    details = self.db.get_card_details(card_id, self.equipment_type_id)
-                    break
-                except Exception as e:
-                    logging.info(f"Exception: {e}\n trying again")
+        card_id = old_input_data["card_id"]
+        if event.kind == EventLoop.CARD_PRESENT:
+            self.card_present = event.data
+            logging.info("Card with ID: %d read, Getting info from DB", event.data)
+            threading.Thread(target = self.look_up_card, args = (event.data,),
+                name = "card_lookup", daemon = True).start()
+
+        elif event.kind == EventLoop.CARD_REMOVED and event.data == self.card_present:
+            self.card_present = -1
+            # the event may have waited in the queue, date the removal from
+            # when it was read
+            self.card_removed_at = datetime.now() - timedelta(seconds = monotonic() - event.time)
+
+        if(event.kind == EventLoop.CARD_DETAILS and event.data[0] == self.card_present):
+            card_id, details = event.data
             new_input_data = {
                 "card_id": card_id,
                 "user_is_authorized": details["user_is_authorized"],
@@ -217,13 +329,14 @@ class PortalBoxApplication():
                 new_input_data["card_id"])
 
         #If no card is present, just update the button
-        elif(card_id <= 0):
+        elif(card_id <= 0 or self.card_present <= 0):
             new_input_data = {
                 "card_id": -1,
                 "user_is_authorized": False,
                 "card_type": CardType.INVALID_CARD,
                 "user_authority_level": 0,
-                "button_pressed": self.box.has_button_been_pressed()
+                "button_pressed": self.box.has_button_been_pressed(),
+                "card_removed_at": self.card_removed_at
             }
         #Else just use the old data and update the button
         #ie, if there is a card, but its the same as before
@@ -234,6 +347,23 @@ class PortalBoxApplication():
         return new_input_data
 
 
+    def look_up_card(self, card_id):
+        """
+        Get the details of a card from the database and post them to the main
+        loop
+        """
+        # The transport retries within its budget, if the database still
+        # can't be reached treat the card as unauthorized. The card is
+        # looked up again when it is next inserted
+        try:
+            details = self.db.get_card_details(card_id, self.equipment_type_id)
+        except Exception as e:
+            logging.error(f"Unable to get details for card: {e}")
+            details = self.db.card_details_from_record(None)
+
+        self.events.post(EventLoop.CARD_DETAILS, (card_id, details))
+
+
     def get_user_auths(self, card_id):
         '''
         Determines whether or not the user is authorized for the equipment type
@@ -318,11 +448,17 @@ class PortalBoxApplication():
         Stops the program
         '''
         logging.info("Service Exiting")
+        self.card_poller.stop()
         self.box.cleanup()
 
         if self.equipment_id:
             logging.info("Logging exit-while-running to DB")
             self.db.log_shutdown_status(self.equipment_id,card_id)
+            logging.info("Database statistics: %s", self.db.stats())
+            self.db.close()
+        logging.info("Main loop statistics: %s", self.events.stats())
+        logging.info("Card poller statistics: %s", self.card_poller.stats())
+        logging.info("Portal box statistics: %s", self.box.stats())
         self.running = False
 
 
@@ -377,10 +513,32 @@ if __name__ == "__main__":
 
     # Run service
     logging.debug("Running the FSM")
+    service.card_poller.set_state(fsm.__class__.__name__, fsm.poll_rate)
+    service.card_poller.start()
     service.running = True
+    transitioned = False
+    exit_status = 0
     while service.running:
-        input_data = service.get_inputs(input_data)
+        # a new state runs its checks straight away rather than waiting for
+        # the next event
+        timeout = 0 if transitioned else fsm.seconds_until_deadline()
+        event = service.events.wait(timeout)
+        if event.kind == EventLoop.FATAL:
+            # exit with an error so systemd restarts the service
+            logging.critical("Stopping the service: %s", event.data)
+            service.box.set_equipment_power_on(False)
+            service.shutdown(input_data["card_id"])
+            exit_status = 1
+            break
+        if event.kind == EventLoop.PROFILE:
+            # adopted here so the role never changes under the FSM
+            service.set_equipment_role(event.data)
+            fsm.adopt_role()
+        input_data = service.get_inputs(event, input_data)
+        state = fsm.__class__
         fsm(input_data)
+        transitioned = fsm.__class__ is not state
+        service.card_poller.set_state(fsm.__class__.__name__, fsm.poll_rate)
         #If the FSM is in the Shutdown state, then stop running the while loop
         if(fsm.__class__ == "Shutdown"):
             break
@@ -390,4 +548,4 @@ if __name__ == "__main__":
     logging.info("Shutting down logger")
     logging.shutdown()
 
-    sys.exit()
+    sys.exit(exit_status)
@@ -0,0 +1,77 @@
+import asyncio
+import time
+import unittest
+
+from .context import AsyncDatabase
+from .stand_in_server import StandInServer
+
+PROFILE = {
+    "id": "7",
+    "type_id": "5",
+    "name": ["Laser Cutter", "Makerspace"],
+    "location_id": "2",
+    "timeout": "60",
+    "allow_proxy": "1",
+    "requires_training": "1",
+    "charge_policy": "0"
+}
+
+AUTHORIZED = {"card_id": "1234", "user_role": 1, "card_type": 4, "user_balance": "0.00", "user_auth": 1, "user_active": 1}
+
+class TestAsyncDatabase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.server = StandInServer().__enter__()
+        self.server.backend.profiles["abcdef123456"] = PROFILE
+        self.server.backend.set_card(1234, AUTHORIZED)
+        self.server.backend.users[1234] = ("Ada", "ada@example.com")
+        self.server.backend.equipment_names[7] = "Laser 1"
+        self.db = AsyncDatabase.AsyncDatabase({"website": self.server.url, "bearer_token": "token"})
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        self.server.__exit__()
+
+    async def test_same_surface_as_database(self):
+        profile = await self.db.get_equipment_profile("abcdef123456")
+        self.assertEqual((7, 5, "Laser Cutter", 2, "Makerspace", 60, 1), profile)
+
+        details = await self.db.get_card_details(1234, 5)
+        self.assertTrue(details["user_is_authorized"])
+        self.assertEqual(("Ada", "ada@example.com"), await self.db.get_user(1234))
+        self.assertEqual("Laser 1", await self.db.get_equipment_name(7))
+
+        await self.db.log_started_status(7)
+        await self.db.log_access_attempt(1234, 7, True)
+        await self.db.log_access_completion(1234, 7)
+        await self.db.log_shutdown_status(7, 1234)
+        await self.db.record_ip(7, "10.0.0.2")
+        self.assertEqual(
+            ["log_started_status", "log_access_attempt", "log_access_completion", "log_shutdown_status", "record_ip"],
+            [params["mode"] for params in self.server.backend.logs])
+
+    async def test_requests_are_in_flight_concurrently(self):
+        await self.db.get_equipment_profile("abcdef123456")
+        self.server.backend.delay = 0.2
+
+        start = time.monotonic()
+        await asyncio.gather(
+            self.db.get_card_details(1234, 5),
+            self.db.get_user(1234),
+            self.db.get_equipment_name(7))
+
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    async def test_deadline_expires(self):
+        self.server.backend.delay = 0.5
+
+        with self.assertRaises(asyncio.TimeoutError):
+            await self.db.get_user(1234, timeout = 0.05)
+
+    async def test_cancellation(self):
+        self.server.backend.delay = 0.5
+        task = asyncio.ensure_future(self.db.get_equipment_name(7))
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+        with self.assertRaises(asyncio.CancelledError):
+            await task
@@ -0,0 +1,50 @@
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from .context import AttemptAggregator, Database
+from .stand_in_server import StandInServer
+
+class TestAttemptAggregator(unittest.TestCase):
+    def test_repeats_are_counted_once_per_window(self):
+        send = MagicMock()
+        aggregator = AttemptAggregator.AttemptAggregator(send, {"failed_attempt_window": "0.1"})
+
+        self.assertTrue(aggregator.add(1234, 7))
+        self.assertFalse(aggregator.add(1234, 7))
+        self.assertFalse(aggregator.add(1234, 7))
+        self.assertTrue(aggregator.add(5678, 7))
+        time.sleep(0.3)
+
+        send.assert_called_once_with(1234, 7, 2)
+        self.assertTrue(aggregator.add(1234, 7))
+        aggregator.close()
+
+        self.assertEqual({"windows": 0, "aggregated": 2, "summaries": 1}, aggregator.stats())
+
+    def test_flush_sends_count_early(self):
+        send = MagicMock()
+        aggregator = AttemptAggregator.AttemptAggregator(send, {"failed_attempt_window": "60"})
+
+        aggregator.add(1234, 7)
+        aggregator.add(1234, 7)
+        aggregator.flush(1234, 7)
+
+        send.assert_called_once_with(1234, 7, 1)
+        self.assertEqual(0, aggregator.stats()["windows"])
+
+    def test_database_logs_one_counted_record(self):
+        with StandInServer() as server:
+            db = Database.Database({
+                "website": server.url,
+                "bearer_token": "token",
+                "failed_attempt_window": "60"
+            })
+
+            for _ in range(4):
+                db.log_access_attempt(1234, 7, False)
+            db.log_access_attempt(1234, 7, True)
+            db.close()
+
+            logs = [(log["successful"], log.get("attempts")) for log in server.backend.logs]
+            self.assertEqual([("0", None), ("0", "3"), ("1", None)], logs)
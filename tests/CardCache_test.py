@@ -0,0 +1,199 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from .context import CardCache, Database
+
+RECORD = {
+    "user_role": 1,
+    "card_type": 4,
+    "user_balance": "10.00",
+    "user_auth": 1,
+    "user_active": 1
+}
+
+UNKNOWN = {
+    "user_role": None,
+    "card_type": None,
+    "user_balance": "0.00",
+    "user_auth": 0,
+    "user_active": None
+}
+
+class TestCardCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "cards.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_miss_then_hit(self):
+        cache = CardCache.CardCache({"card_cache_path": self.path})
+
+        self.assertEqual((None, False), cache.get(1234, 5))
+        cache.put(1234, 5, RECORD)
+        self.assertEqual((RECORD, True), cache.get(1234, 5))
+
+        stats = cache.stats()
+        self.assertEqual(1, stats["hits"])
+        self.assertEqual(1, stats["misses"])
+        cache.close()
+
+    def test_entry_goes_stale_after_ttl(self):
+        cache = CardCache.CardCache({"card_cache_path": self.path, "card_cache_ttl": "0"})
+
+        cache.put(1234, 5, RECORD)
+        time.sleep(0.01)
+        self.assertEqual((RECORD, False), cache.get(1234, 5))
+        self.assertEqual(1, cache.stats()["stale"])
+        cache.close()
+
+    def test_entry_too_stale_is_a_miss(self):
+        cache = CardCache.CardCache({"card_cache_path": self.path,
+            "card_cache_ttl": "0", "card_cache_max_stale": "0.05"})
+
+        cache.put(1234, 5, RECORD)
+        time.sleep(0.1)
+        self.assertEqual((None, False), cache.get(1234, 5))
+        cache.close()
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = CardCache.CardCache({"card_cache_path": self.path, "card_cache_max_entries": "2"})
+
+        cache.put(1, 5, RECORD)
+        cache.put(2, 5, RECORD)
+        cache.get(1, 5)
+        cache.put(3, 5, RECORD)
+
+        self.assertEqual((None, False), cache.get(2, 5))
+        self.assertIsNotNone(cache.get(1, 5)[0])
+        self.assertIsNotNone(cache.get(3, 5)[0])
+        self.assertEqual(1, cache.stats()["evictions"])
+        cache.close()
+
+    def test_invalidate_card(self):
+        cache = CardCache.CardCache({"card_cache_path": self.path})
+
+        cache.put(1, 5, RECORD)
+        cache.put(1, 6, RECORD)
+        cache.put(2, 5, RECORD)
+        cache.invalidate(card_id = 1)
+
+        self.assertIsNone(cache.get(1, 5)[0])
+        self.assertIsNone(cache.get(1, 6)[0])
+        self.assertIsNotNone(cache.get(2, 5)[0])
+        cache.close()
+
+    def test_entries_survive_reopening(self):
+        cache = CardCache.CardCache({"card_cache_path": self.path})
+        cache.put(1234, 5, RECORD)
+        cache.close()
+
+        cache = CardCache.CardCache({"card_cache_path": self.path})
+        self.assertEqual((RECORD, True), cache.get(1234, 5))
+        cache.close()
+
+    def test_negative_entry_expires_to_a_miss(self):
+        cache = CardCache.CardCache({"card_cache_path": self.path, "card_cache_negative_ttl": "0.05"})
+
+        cache.put(1234, 5, UNKNOWN, negative = True)
+        self.assertEqual((UNKNOWN, True), cache.get(1234, 5))
+        time.sleep(0.1)
+        self.assertEqual((None, False), cache.get(1234, 5))
+
+        stats = cache.stats()
+        self.assertEqual(1, stats["negative_hits"])
+        self.assertEqual(1, stats["stale"])
+        cache.close()
+
+    def test_negative_entries_can_be_disabled(self):
+        cache = CardCache.CardCache({"card_cache_path": self.path, "card_cache_negative_ttl": "0"})
+
+        cache.put(1234, 5, RECORD)
+        cache.put(1234, 5, UNKNOWN, negative = True)
+
+        self.assertEqual((None, False), cache.get(1234, 5))
+        cache.close()
+
+    @patch("Transport.requests")
+    def test_database_caches_refused_card(self, mock_requests):
+        response = MagicMock()
+        response.status_code = 200
+        response.json.return_value = [UNKNOWN]
+        session = mock_requests.Session.return_value
+        session.request.return_value = response
+
+        db = Database.Database({
+            "website": "http://127.0.0.1",
+            "bearer_token": "token",
+            "card_cache_enabled": "True",
+            "card_cache_path": self.path,
+            "card_cache_negative_ttl": "60"
+        })
+        db.requires_training = 1
+        db.requires_payment = 0
+
+        for _ in range(3):
+            self.assertFalse(db.get_card_details(1234, 5)["user_is_authorized"])
+
+        self.assertEqual(1, session.request.call_count)
+        self.assertEqual(2, db.stats()["card_cache"]["negative_hits"])
+        db.close()
+
+    @patch("Transport.requests")
+    def test_database_answers_repeat_tap_from_cache(self, mock_requests):
+        response = MagicMock()
+        response.status_code = 200
+        response.json.return_value = [RECORD]
+        session = mock_requests.Session.return_value
+        session.request.return_value = response
+
+        db = Database.Database({
+            "website": "http://127.0.0.1",
+            "bearer_token": "token",
+            "card_cache_enabled": "True",
+            "card_cache_path": self.path
+        })
+        db.requires_training = 1
+        db.requires_payment = 0
+
+        first = db.get_card_details(1234, 5)
+        second = db.get_card_details(1234, 5)
+
+        self.assertEqual(first, second)
+        self.assertTrue(second["user_is_authorized"])
+        self.assertEqual(1, session.request.call_count)
+        db.close()
+
+    @patch("Transport.requests")
+    def test_database_denies_card_too_stale_to_refresh(self, mock_requests):
+        response = MagicMock()
+        response.status_code = 200
+        response.json.return_value = [RECORD]
+        session = mock_requests.Session.return_value
+        session.request.return_value = response
+
+        db = Database.Database({
+            "website": "http://127.0.0.1",
+            "bearer_token": "token",
+            "card_cache_enabled": "True",
+            "card_cache_path": self.path,
+            "card_cache_ttl": "0",
+            "card_cache_max_stale": "0.2"
+        })
+        db.requires_training = 1
+        db.requires_payment = 0
+        self.assertTrue(db.get_card_details(1234, 5)["user_is_authorized"])
+
+        # the backend fails, the stale record is used until it is too old
+        failure = MagicMock()
+        failure.status_code = 500
+        session.request.return_value = failure
+        time.sleep(0.01)
+        self.assertTrue(db.get_card_details(1234, 5)["user_is_authorized"])
+        time.sleep(0.3)
+        self.assertFalse(db.get_card_details(1234, 5)["user_is_authorized"])
+        db.close()
@@ -0,0 +1,114 @@
+import time
+import unittest
+
+from .context import CardPoller, EventLoop
+
+class TestCardPoller(unittest.TestCase):
+    def test_changes_are_posted_once(self):
+        readings = iter([-1, 1234, 1234, 1234, -1, -1, 5678, 9012])
+        loop = EventLoop.EventLoop()
+        poller = CardPoller.CardPoller(lambda: next(readings), loop)
+
+        for _ in range(8):
+            poller.poll()
+
+        events = []
+        while not loop.events.empty():
+            event = loop.events.get()
+            events.append((event.kind, event.data))
+        self.assertEqual([
+            (EventLoop.EventLoop.CARD_PRESENT, 1234),
+            (EventLoop.EventLoop.CARD_REMOVED, 1234),
+            (EventLoop.EventLoop.CARD_PRESENT, 5678),
+            (EventLoop.EventLoop.CARD_REMOVED, 5678),
+            (EventLoop.EventLoop.CARD_PRESENT, 9012)
+        ], events)
+
+    def test_change_is_retried_with_original_time_when_queue_full(self):
+        loop = EventLoop.EventLoop({"queue_size": "1"})
+        loop.post(EventLoop.EventLoop.BUTTON)
+        poller = CardPoller.CardPoller(lambda: 1234, loop)
+
+        poller.poll()
+        first_seen = poller.changed_at
+        loop.wait()
+        time.sleep(0.01)
+        poller.poll()
+
+        event = loop.wait()
+        self.assertEqual((EventLoop.EventLoop.CARD_PRESENT, 1234), (event.kind, event.data))
+        self.assertEqual(first_seen, event.time)
+
+    def test_fatal_error_stops_polling(self):
+        reads = []
+        def read_card():
+            reads.append(1)
+            raise KeyError("reader gone")
+        loop = EventLoop.EventLoop()
+        poller = CardPoller.CardPoller(read_card, loop, {"idle_poll_interval": "0.01"},
+            (KeyError,))
+        poller.start()
+
+        event = loop.wait(1)
+        time.sleep(0.05)
+        poller.stop()
+
+        self.assertEqual(EventLoop.EventLoop.FATAL, event.kind)
+        self.assertIsInstance(event.data, KeyError)
+        self.assertEqual(1, len(reads))
+
+    def test_removal_is_noticed_while_loop_is_busy(self):
+        card = [1234]
+        loop = EventLoop.EventLoop()
+        poller = CardPoller.CardPoller(lambda: card[0], loop, {"idle_poll_interval": "0.01"})
+        poller.start()
+
+        self.assertEqual(EventLoop.EventLoop.CARD_PRESENT, loop.wait().kind)
+        card[0] = -1
+        removed_at = time.monotonic()
+        # the main loop is busy, say sending an email
+        time.sleep(0.2)
+        event = loop.wait()
+        poller.stop()
+
+        self.assertEqual(EventLoop.EventLoop.CARD_REMOVED, event.kind)
+        self.assertLess(event.time - removed_at, 0.05)
+        self.assertGreater(poller.stats()["reads"], 10)
+
+    def test_rate_follows_state(self):
+        reads = []
+        loop = EventLoop.EventLoop()
+        poller = CardPoller.CardPoller(lambda: reads.append(time.monotonic()) or -1, loop, {
+            "idle_poll_interval": "10",
+            "grace_poll_interval": "0.01"
+        })
+        poller.set_state("IdleNoCard", CardPoller.IDLE)
+        poller.start()
+        time.sleep(0.1)
+        self.assertEqual(1, len(reads))
+
+        # a faster rate takes effect without waiting out the idle interval
+        poller.set_state("RunningNoCard", CardPoller.GRACE)
+        time.sleep(0.2)
+        poller.stop()
+
+        self.assertGreater(len(reads), 5)
+        states = poller.stats()["states"]
+        self.assertEqual(1, states["IdleNoCard"]["reads"])
+        self.assertEqual(len(reads) - 1, states["RunningNoCard"]["reads"])
+
+    def test_detection_latency_bound_per_state(self):
+        card = [-1]
+        loop = EventLoop.EventLoop()
+        poller = CardPoller.CardPoller(lambda: card[0], loop)
+
+        poller.set_state("RunningNoCard", CardPoller.GRACE)
+        poller.poll()
+        time.sleep(0.05)
+        card[0] = 1234
+        poller.poll()
+
+        latency = poller.stats()["states"]["RunningNoCard"]
+        self.assertEqual(1, latency["changes"])
+        self.assertGreaterEqual(latency["max_latency"], 0.05)
+        self.assertLess(latency["max_latency"], 0.5)
@@ -0,0 +1,80 @@
+import unittest
+from unittest.mock import MagicMock
+
+from .context import Database, WebService
+from .stand_in_server import StandInServer
+
+MAC = "abcdef123456"
+
+PROFILE = {
+    "id": "7",
+    "type_id": "5",
+    "name": ["Laser Cutter", "Makerspace"],
+    "location_id": "2",
+    "timeout": "60",
+    "allow_proxy": "1",
+    "requires_training": "1",
+    "charge_policy": "1"
+}
+
+class TestDatabaseHello(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer()
+        self.server.__enter__()
+        self.server.backend.profiles[MAC] = PROFILE
+        self.server.backend.equipment_names[7] = "Laser 1"
+        self.db = Database.Database({"website": self.server.url, "bearer_token": "token"})
+
+    def tearDown(self):
+        self.db.close()
+        self.server.__exit__(None, None, None)
+
+    def test_hello_is_one_request(self):
+        profile, name = self.db.hello(MAC, "10.0.0.2")
+
+        self.assertEqual((7, 5, "Laser Cutter", 2, "Makerspace", 60, 1), profile)
+        self.assertEqual("Laser 1", name)
+        self.assertEqual(1, self.db.requires_training)
+        self.assertEqual(1, self.db.requires_payment)
+        self.assertEqual("Laser 1", self.db.get_equipment_name(7))
+
+        self.assertEqual(1, len(self.server.requests))
+        log = self.server.backend.logs[0]
+        self.assertEqual(("hello", "10.0.0.2"), (log["mode"], log["ip_address"]))
+
+    def test_hello_error_when_not_registered(self):
+        self.server.backend.hello_supported = False
+        del self.server.backend.profiles[MAC]
+
+        with self.assertRaises(WebService.NotRegisteredError):
+            self.db.hello(MAC, "10.0.0.2")
+
+    def test_hello_error_on_server_error(self):
+        response = MagicMock()
+        response.status_code = 503
+        transport = MagicMock()
+        transport.post.return_value = response
+        db = Database.Database({"website": "http://127.0.0.1", "bearer_token": "token"}, transport)
+
+        with self.assertRaises(Exception):
+            db.hello(MAC, "10.0.0.2")
+        # a server error does not fall back to the legacy requests
+        self.assertTrue(db.hello_supported)
+        transport.get.assert_not_called()
+        self.assertEqual(1, transport.post.call_count)
+        db.close()
+
+    def test_hello_falls_back_to_legacy_requests(self):
+        self.server.backend.hello_supported = False
+
+        profile, name = self.db.hello(MAC, "10.0.0.2")
+
+        self.assertEqual(7, profile[0])
+        self.assertIsNone(name)
+        self.assertEqual(["log_started_status", "record_ip"],
+            [log["mode"] for log in self.server.backend.logs])
+
+        # the database is not asked again
+        self.db.hello(MAC, "10.0.0.2")
+        modes = [request[2]["mode"] for request in self.server.requests]
+        self.assertEqual(1, modes.count("hello"))
@@ -0,0 +1,179 @@
+import os
+import signal
+import threading
+import time
+import unittest
+
+from .context import simulator
+
+class TestDotstarStrip(unittest.TestCase):
+    def setUp(self):
+        # the strip catches the signals the OS stops the driver with
+        self.handlers = (signal.getsignal(signal.SIGTERM), signal.getsignal(signal.SIGINT))
+        self.sim = simulator.install()
+
+    def tearDown(self):
+        signal.signal(signal.SIGTERM, self.handlers[0])
+        signal.signal(signal.SIGINT, self.handlers[1])
+
+    def create_strip(self, length = 3, refresh_ms = 0):
+        from portalbox.display.DotstarDriver import DotstarStrip
+        strip = DotstarStrip(length, 1, 0, refresh_ms)
+        return (strip, self.sim.spi_device(1, 0))
+
+    def test_frame_sent_in_one_transfer(self):
+        (strip, spi) = self.create_strip()
+        strip.set_brightness(16)
+        strip.fill_pixels((1, 2, 3))
+        strip.set_pixel_color((4, 5, 6), 2)
+
+        self.assertTrue(strip.show())
+        self.assertEqual(1, spi.writes)
+        self.assertEqual(bytes([0, 0, 0, 0,
+            0xF0, 1, 3, 2,
+            0xF0, 1, 3, 2,
+            0xF0, 4, 6, 5,
+            0, 0, 0, 0,
+            0]), spi.written)
+
+    def test_unchanged_frame_not_sent(self):
+        (strip, spi) = self.create_strip()
+        strip.fill_pixels((1, 2, 3))
+        strip.show()
+        self.assertFalse(strip.show())
+        self.assertEqual(1, spi.writes)
+
+        strip.set_pixel_brightness(8, 1)
+        self.assertTrue(strip.show())
+        self.assertTrue(strip.show(True))
+        self.assertEqual(3, spi.writes)
+        self.assertEqual(1, strip.frames_skipped)
+
+    def test_unchanged_frame_refreshed(self):
+        (strip, spi) = self.create_strip(refresh_ms = 20)
+        strip.show()
+        self.assertFalse(strip.show())
+        time.sleep(0.03)
+        self.assertTrue(strip.show())
+        self.assertEqual(2, spi.writes)
+
+    def test_binary_commands(self):
+        from portalbox.display.DotstarDriver import process_command
+        from portalbox.DriverProtocol import encode
+        (strip, spi) = self.create_strip()
+
+        self.assertEqual(0, process_command(encode("color", 1, 2, 3), strip))
+        self.assertEqual([(1, 2, 3)] * 3, strip.led_colors)
+        self.assertEqual(0, process_command(encode("wipe", 4, 5, 6, 300), strip))
+        self.assertEqual("wipe", strip.effect.name)
+        # commands for the buzzer and of other versions are refused
+        self.assertEqual(1, process_command(encode("beep", 440.0, 1.0, 2), strip))
+        self.assertEqual(1, process_command(b"\x00\x01\x01\x02\x03", strip))
+
+    def test_frame_loaded_from_framebuffer(self):
+        from portalbox.display.DotstarDriver import Effect
+        from portalbox.display.FrameBuffer import FrameBuffer
+        (strip, spi) = self.create_strip(length = 2)
+        framebuffer = FrameBuffer(2)
+        try:
+            # nothing is loaded before the controller writes a frame
+            self.assertFalse(strip.load_frame(framebuffer))
+            strip.effect = Effect("pulse", [((1, 1), ((1, 2, 3), (1, 2, 3)))], 0, repeats = None)
+            framebuffer.write([b"\x01\x02\x03", b"\x04\x05\x06"], 8)
+            self.assertTrue(strip.load_frame(framebuffer))
+            self.assertFalse(strip.load_frame(framebuffer))
+        finally:
+            framebuffer.close()
+            framebuffer.unlink()
+
+        self.assertIsNone(strip.effect)
+        strip.show()
+        # sent blue, green, red
+        self.assertEqual(bytes([0, 0, 0, 0,
+            0xE8, 3, 2, 1,
+            0xE8, 6, 5, 4,
+            0, 0, 0, 0,
+            0]), spi.written)
+
+    def brightness_at(self, strip, frames, start = 100):
+        # the brightness of the first pixel at each of a number of frames
+        levels = []
+        for frame in range(frames):
+            strip.advance(start + frame * 0.1)
+            levels.append(strip.brightness[0])
+        return levels
+
+    def test_blink_keeps_time(self):
+        from portalbox.display.DotstarDriver import process_command
+        from portalbox.DriverProtocol import encode
+        (strip, spi) = self.create_strip()
+
+        process_command(encode("blink", 1, 2, 3, 800, 2), strip, 100)
+        self.assertEqual([1, 1, 30, 30], self.brightness_at(strip, 4))
+        # frames shown late, or not at all, do not delay the effect
+        strip.advance(100.59)
+        self.assertEqual(30, strip.brightness[0])
+        self.assertIsNotNone(strip.effect)
+        strip.advance(100.8)
+        self.assertIsNone(strip.effect)
+        self.assertEqual([30, 30, 30], strip.brightness)
+        self.assertEqual([(1, 2, 3)] * 3, strip.led_colors)
+
+    def test_wipe_keyframes(self):
+        from portalbox.display.DotstarDriver import process_command
+        from portalbox.DriverProtocol import encode
+        (strip, spi) = self.create_strip()
+        strip.fill_pixels((1, 1, 1))
+
+        process_command(encode("wipe", 4, 5, 6, 600), strip, 100)
+        strip.advance(100.2)
+        self.assertEqual([(4, 5, 6), (4, 5, 6), (1, 1, 1)], strip.led_colors)
+        strip.advance(100.6)
+        self.assertIsNone(strip.effect)
+        self.assertEqual([(4, 5, 6)] * 3, strip.led_colors)
+
+    def test_pulse_color_change_keeps_phase(self):
+        from portalbox.display.DotstarDriver import process_command
+        from portalbox.DriverProtocol import encode
+        (strip, spi) = self.create_strip()
+
+        process_command(encode("pulse", 1, 2, 3), strip, 100)
+        self.assertEqual([14, 12, 10, 8, 6, 4, 2, 1, 3, 5], self.brightness_at(strip, 10))
+        # a later color command only changes the color
+        process_command(encode("color", 4, 5, 6), strip, 105)
+        process_command(encode("pulse", 7, 8, 9), strip, 106)
+        strip.advance(100.9)
+        self.assertEqual(5, strip.brightness[0])
+        self.assertEqual([(7, 8, 9)] * 3, strip.led_colors)
+        # the pulse repeats forever
+        strip.advance(100 + 0.1 * (7 + 30 * 1000))
+        self.assertEqual(1, strip.brightness[0])
+
+        process_command(encode("color", 0, 0, 0), strip, 200)
+        self.assertIsNone(strip.effect)
+        self.assertEqual([16] * 3, strip.brightness)
+
+    def test_driver_frames_keep_time(self):
+        from portalbox.display.DotstarDriver import strip_driver, LOOP_MS
+        from portalbox.DriverProtocol import encode
+
+        class Commands:
+            # a color command every 10 ms, to the driver's queue
+            def get(self, block, timeout):
+                time.sleep(min(timeout, 0.01))
+                return encode("color", 1, 2, 3)
+
+            def task_done(self):
+                pass
+
+        stopper = threading.Timer(1.05, os.kill, (os.getpid(), signal.SIGTERM))
+        stopper.start()
+        stats = strip_driver(Commands(), 3, 1, 0, 0)
+
+        # the commands neither delay nor add frames
+        self.assertEqual(1000 // LOOP_MS, stats["frames"] + stats["frames_missed"])
+        self.assertLess(stats["mean_jitter_ms"], LOOP_MS / 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
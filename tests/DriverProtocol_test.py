@@ -0,0 +1,45 @@
+import queue
+import struct
+import unittest
+
+from .context import DriverProtocol
+
+class TestDriverProtocol(unittest.TestCase):
+    def test_round_trip(self):
+        commands = [
+            ("color", (1, 2, 3)),
+            ("pulse", (0, 0, 255)),
+            ("wipe", (4, 5, 6, 1000)),
+            ("blink", (255, 0, 0, 2000, 10)),
+            ("buzz", (800.0, 0.25, True, False)),
+            ("beep", (440.0, 2.0, 10)),
+            ("stop", (True, False, True)),
+            ("sing", ("songs/start.txt", 0.125, 0.0625))
+        ]
+        for (name, params) in commands:
+            command = DriverProtocol.encode(name, *params)
+            self.assertEqual(DriverProtocol.VERSION, command[0])
+            self.assertEqual((name, params), DriverProtocol.decode(command))
+
+        self.assertEqual(5, len(DriverProtocol.encode("color", 1, 2, 3)))
+
+    def test_rejects_bad_commands(self):
+        color = DriverProtocol.encode("color", 1, 2, 3)
+        self.assertRaises(ValueError, DriverProtocol.decode, b"\x01")
+        self.assertRaises(ValueError, DriverProtocol.decode, bytes([DriverProtocol.VERSION + 1]) + color[1:])
+        self.assertRaises(ValueError, DriverProtocol.decode, bytes([DriverProtocol.VERSION, 255]))
+        self.assertRaises(ValueError, DriverProtocol.decode, color + b"\x00")
+        self.assertRaises(struct.error, DriverProtocol.encode, "color", 256, 0, 0)
+
+    def test_command_pipe(self):
+        pipe = DriverProtocol.CommandPipe()
+        self.assertRaises(queue.Empty, pipe.get, True, 0.01)
+        pipe.put(b"\x01\x01\x00\x00\x00")
+        pipe.put(b"\x01\x02\x00\x00\xff")
+        self.assertEqual(b"\x01\x01\x00\x00\x00", pipe.get(True, 1))
+        self.assertEqual(b"\x01\x02\x00\x00\xff", pipe.get(False))
+        self.assertRaises(queue.Empty, pipe.get, False)
+
+
+if __name__ == '__main__':
+    unittest.main()
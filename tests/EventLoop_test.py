@@ -0,0 +1,57 @@
+import threading
+import time
+import unittest
+
+from .context import EventLoop
+
+class TestEventLoop(unittest.TestCase):
+    def test_posted_event_wakes_loop(self):
+        loop = EventLoop.EventLoop({"idle_interval": "10"})
+
+        threading.Timer(0.05, loop.post, (EventLoop.EventLoop.CARD_DETAILS, (1234, {}))).start()
+        started = time.monotonic()
+        event = loop.wait()
+
+        self.assertEqual(EventLoop.EventLoop.CARD_DETAILS, event.kind)
+        self.assertEqual((1234, {}), event.data)
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_deadline(self):
+        loop = EventLoop.EventLoop({"idle_interval": "10"})
+
+        started = time.monotonic()
+        event = loop.wait(0.05)
+
+        self.assertEqual(EventLoop.EventLoop.TIMEOUT, event.kind)
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+
+    def test_idle_loop_wakes_rarely(self):
+        loop = EventLoop.EventLoop({"idle_interval": "0.05"})
+
+        started = time.monotonic()
+        kinds = [loop.wait().kind for _ in range(4)]
+
+        self.assertEqual([EventLoop.EventLoop.TIMEOUT] * 4, kinds)
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+
+        stats = loop.stats()
+        self.assertEqual(4, stats["wakeups"])
+        self.assertLess(stats["wakeups_per_second"], 30)
+        self.assertLess(stats["cpu_utilization"], 0.5)
+
+    def test_full_queue_drops_non_blocking_posts(self):
+        loop = EventLoop.EventLoop({"queue_size": "1"})
+
+        self.assertTrue(loop.post(EventLoop.EventLoop.BUTTON, block = False))
+        self.assertFalse(loop.post(EventLoop.EventLoop.BUTTON, block = False))
+        self.assertEqual(1, loop.stats()["dropped"])
+
+    def test_latency_is_measured_from_event_time(self):
+        loop = EventLoop.EventLoop()
+
+        loop.post(EventLoop.EventLoop.CARD_REMOVED, 1234, time.monotonic() - 0.5)
+        event = loop.wait()
+
+        latency = loop.stats()["latency"][EventLoop.EventLoop.CARD_REMOVED]
+        self.assertEqual(1, latency["count"])
+        self.assertGreaterEqual(latency["max"], 0.5)
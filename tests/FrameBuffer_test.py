@@ -0,0 +1,78 @@
+import multiprocessing
+import pickle
+import unittest
+
+from .context import FrameBuffer
+
+def frame_reader(framebuffer, replies):
+    # wait for the first frame written and send it back
+    frame = bytearray(4 * framebuffer.length)
+    while framebuffer.read(frame, 0) is None:
+        pass
+    replies.put(bytes(frame))
+    framebuffer.close()
+
+
+class TestFrameBuffer(unittest.TestCase):
+    def setUp(self):
+        self.framebuffer = FrameBuffer.FrameBuffer(2)
+        self.frame = bytearray(8)
+
+    def tearDown(self):
+        self.framebuffer.close()
+        self.framebuffer.unlink()
+
+    def test_frame_read_once(self):
+        self.framebuffer.write([b"\x01\x02\x03", b"\x04\x05\x06"], 8)
+
+        sequence = self.framebuffer.read(self.frame, 0)
+        self.assertEqual(2, sequence)
+        self.assertEqual(bytes([8, 1, 2, 3, 8, 4, 5, 6]), self.frame)
+        self.assertIsNone(self.framebuffer.read(self.frame, sequence))
+
+    def test_frame_written_in_place(self):
+        with self.framebuffer.writing() as pixels:
+            pixels[4:8] = b"\x1F\xFF\x00\x00"
+            # a frame being written is not read
+            self.assertIsNone(self.framebuffer.read(self.frame, 0))
+        self.assertEqual(2, self.framebuffer.read(self.frame, 0))
+        self.assertEqual(bytes([0, 0, 0, 0, 31, 255, 0, 0]), self.frame)
+
+    def test_wrong_length_refused(self):
+        self.assertRaises(ValueError, self.framebuffer.write, [b"\x01\x02\x03"])
+
+    def test_frame_shared_with_driver_process(self):
+        replies = multiprocessing.Queue()
+        reader = multiprocessing.Process(target = frame_reader, args = (self.framebuffer, replies))
+        reader.start()
+        try:
+            self.framebuffer.write([b"\x01\x02\x03", b"\x04\x05\x06"])
+            self.assertEqual(bytes([31, 1, 2, 3, 31, 4, 5, 6]), replies.get(True, 5))
+        finally:
+            reader.join(5)
+        self.assertEqual(0, reader.exitcode)
+
+    def test_pickled_framebuffer_shares_memory(self):
+        copy = pickle.loads(pickle.dumps(self.framebuffer))
+        try:
+            self.framebuffer.write([b"\x01\x02\x03", b"\x04\x05\x06"])
+            self.assertEqual(2, copy.read(self.frame, 0))
+            self.assertEqual(bytes([31, 1, 2, 3, 31, 4, 5, 6]), self.frame)
+        finally:
+            copy.close()
+
+    def test_frame_shared_with_spawned_process(self):
+        context = multiprocessing.get_context("spawn")
+        replies = context.Queue()
+        reader = context.Process(target = frame_reader, args = (self.framebuffer, replies))
+        reader.start()
+        try:
+            self.framebuffer.write([b"\x01\x02\x03", b"\x04\x05\x06"])
+            self.assertEqual(bytes([31, 1, 2, 3, 31, 4, 5, 6]), replies.get(True, 10))
+        finally:
+            reader.join(10)
+        self.assertEqual(0, reader.exitcode)
+
+
+if __name__ == '__main__':
+    unittest.main()
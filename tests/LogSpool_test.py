@@ -0,0 +1,71 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from .context import LogSpool
+
+class RecordingSender:
+    """Stand in for Database.post_log which fails a set number of times"""
+
+    def __init__(self, failures = 0):
+        self.failures = failures
+        self.delivered = []
+        self.lock = threading.Lock()
+
+    def __call__(self, params, idempotency_key):
+        with self.lock:
+            if self.failures > 0:
+                self.failures -= 1
+                raise ConnectionError("backend unreachable")
+            self.delivered.append((params, idempotency_key))
+            return True
+
+class TestLogSpool(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = {
+            "log_spool_path": os.path.join(self.directory.name, "spool.jsonl"),
+            "log_spool_min_retry_delay": "0.01",
+            "log_spool_max_retry_delay": "0.02"
+        }
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_requests_are_delivered_in_order(self):
+        sender = RecordingSender()
+        spool = LogSpool.LogSpool(sender, self.settings)
+
+        for i in range(50):
+            spool.append({"mode": "log_access_attempt", "card_id": i})
+        spool.close()
+
+        self.assertEqual(list(range(50)), [params["card_id"] for params, _ in sender.delivered])
+        self.assertEqual(50, spool.stats()["sent"])
+        self.assertEqual(0, os.path.getsize(self.settings["log_spool_path"]))
+
+    def test_failed_requests_are_retried(self):
+        sender = RecordingSender(failures = 3)
+        spool = LogSpool.LogSpool(sender, self.settings)
+
+        key = spool.append({"mode": "record_ip", "ip_address": "10.0.0.2"})
+        spool.close()
+
+        self.assertEqual([({"mode": "record_ip", "ip_address": "10.0.0.2"}, key)], sender.delivered)
+        self.assertEqual(3, spool.stats()["retries"])
+
+    def test_undelivered_requests_survive_restart(self):
+        offline = RecordingSender(failures = 1000)
+        spool = LogSpool.LogSpool(offline, self.settings)
+        first = spool.append({"mode": "log_started_status", "equipment_id": 1})
+        second = spool.append({"mode": "log_shutdown_status", "equipment_id": 1})
+        spool.close(timeout = 0.05)
+        self.assertEqual(2, spool.stats()["pending"])
+
+        online = RecordingSender()
+        spool = LogSpool.LogSpool(online, self.settings)
+        third = spool.append({"mode": "log_started_status", "equipment_id": 1})
+        spool.close()
+
+        self.assertEqual([first, second, third], [key for _, key in online.delivered])
@@ -0,0 +1,166 @@
+import time
+import unittest
+
+from .context import simulator
+
+UID = [0x12, 0x34, 0x56, 0x78]
+IRQ_PIN = 18
+
+def create_reader(wired = True, pin_irq = IRQ_PIN, **kwargs):
+    '''
+    @return a simulator, with the IRQ line wired to IRQ_PIN if wired, and an
+        MFRC522 connected to it
+    '''
+    sim = simulator.install(irq_pin = IRQ_PIN if wired else None)
+    from portalbox.MFRC522 import MFRC522
+    reader = MFRC522(pin_irq = pin_irq, **kwargs)
+    reader.logger.setLevel("ERROR")
+    return (sim, reader)
+
+
+def read_uid(reader):
+    (status, _) = reader.MFRC522_Request(reader.PICC_REQIDL)
+    if status != reader.MI_OK:
+        return None
+    (status, uid) = reader.MFRC522_Anticoll()
+    return uid[:4] if status == reader.MI_OK else None
+
+
+class TestMFRC522(unittest.TestCase):
+    def test_polling_reads_card(self):
+        (sim, reader) = create_reader(pin_irq = None)
+        self.assertFalse(reader.irq_mode)
+        self.assertIsNone(read_uid(reader))
+
+        sim.present(UID)
+        self.assertEqual(UID, read_uid(reader))
+
+    def test_irq_mode_reads_card(self):
+        (sim, reader) = create_reader()
+        self.assertTrue(reader.irq_mode)
+        self.assertIsNone(read_uid(reader))
+
+        sim.present(UID)
+        self.assertEqual(UID, read_uid(reader))
+        self.assertEqual(UID + [0x12 ^ 0x34 ^ 0x56 ^ 0x78], reader.MFRC522_Anticoll()[1])
+        self.assertEqual(0x08, reader.MFRC522_SelectTag(UID + [0x12 ^ 0x34 ^ 0x56 ^ 0x78]))
+
+    def test_falls_back_to_polling_when_irq_not_wired(self):
+        (sim, reader) = create_reader(wired = False)
+        self.assertFalse(reader.irq_mode)
+        self.assertNotIn(IRQ_PIN, sim.gpio.detections)
+
+        sim.present(UID)
+        self.assertEqual(UID, read_uid(reader))
+
+    def test_timer_ends_request_without_card(self):
+        (sim, reader) = create_reader(pin_irq = None)
+        reader.MFRC522_Request(reader.PICC_REQIDL)
+        before = sim.stats()["transfers"]
+        self.assertEqual(reader.MI_ERR, reader.MFRC522_Request(reader.PICC_REQIDL)[0])
+        # the first read of CommIrqReg sees the timer has expired
+        self.assertEqual(10, sim.stats()["transfers"] - before)
+
+    def test_timeout_sets_timer(self):
+        (sim, reader) = create_reader(pin_irq = None)
+        self.assertEqual([0x00, 30], reader.Read_MFRC522_Registers([reader.TReloadRegH, reader.TReloadRegL]))
+
+        (sim, reader) = create_reader(pin_irq = None, timeout = 0.5)
+        self.assertEqual(1.0, reader.deadline)
+        self.assertEqual(1000, sum(v << s for (v, s) in zip(
+            reader.Read_MFRC522_Registers([reader.TReloadRegH, reader.TReloadRegL]), (8, 0))))
+
+    def test_deadline_bounds_request_when_timer_stops(self):
+        for pin_irq in (None, IRQ_PIN):
+            (sim, reader) = create_reader(pin_irq = pin_irq, timeout = 0.01)
+            # without the chip's timer nothing ends a request no card answers
+            reader.Write_MFRC522(reader.TModeReg, 0x0D)
+            before = sim.stats()["transfers"]
+            started = time.monotonic()
+            status = reader.MFRC522_Request(reader.PICC_REQIDL)[0]
+            elapsed = time.monotonic() - started
+            transfers = sim.stats()["transfers"] - before
+
+            self.assertEqual(reader.MI_ERR, status)
+            self.assertGreaterEqual(elapsed, 0.02)
+            self.assertLess(elapsed, 0.2)
+            # sleeping between reads rather than spinning
+            self.assertLess(transfers, 60)
+            if pin_irq:
+                self.assertLess(transfers, 15)
+
+    def test_request_is_batched(self):
+        (sim, reader) = create_reader(pin_irq = None)
+        sim.present(UID)
+        before = sim.stats()["transfers"]
+        self.assertEqual(UID, read_uid(reader))
+        # two transceives of nine transfers, the FIFO read of each answer and
+        # enabling the interrupts the first time
+        self.assertEqual(21, sim.stats()["transfers"] - before)
+
+    def test_registers_read_in_one_transfer(self):
+        (sim, reader) = create_reader(pin_irq = None)
+        before = sim.stats()["transfers"]
+        values = reader.Read_MFRC522_Registers([reader.VersionReg, reader.TModeReg, reader.TxControlReg])
+        self.assertEqual([simulator.VERSION, 0x8D, 0x83], values)
+        self.assertEqual(1, sim.stats()["transfers"] - before)
+
+        reader.Write_MFRC522_FIFO([1, 2, 3])
+        self.assertEqual([1, 2, 3], reader.Read_MFRC522_FIFO(3))
+        self.assertEqual(3, sim.stats()["transfers"] - before)
+
+    def test_presence_check_follows_identified_card(self):
+        (sim, reader) = create_reader(pin_irq = None)
+        sim.present(UID)
+        reader.MFRC522_Request(reader.PICC_REQIDL)
+        uid = reader.MFRC522_Anticoll()[1]
+        frame = reader.MFRC522_SelectFrame(uid)
+        self.assertEqual(simulator.SAK, reader.MFRC522_SelectTag(uid, frame))
+        self.assertEqual(reader.MI_OK, reader.MFRC522_Halt())
+        self.assertEqual(simulator.HALT, sim.chip.card.state)
+
+        before = sim.stats()
+        for _ in range(3):
+            self.assertTrue(reader.MFRC522_IsPresent(frame))
+        after = sim.stats()
+        # a WUPA and a SELECT each check, the HLTA is only transmitted
+        self.assertEqual(6, after["transceives"] - before["transceives"])
+        self.assertEqual(simulator.HALT, sim.chip.card.state)
+
+        # another card does not answer the SELECT
+        sim.present([0x87, 0x65, 0x43, 0x21])
+        self.assertFalse(reader.MFRC522_IsPresent(frame))
+        sim.remove()
+        self.assertFalse(reader.MFRC522_IsPresent(frame))
+
+
+class TestSimulator(unittest.TestCase):
+    def test_card_follows_iso14443_states(self):
+        card = simulator.SimulatedCard(UID)
+        self.assertEqual(simulator.ATQA, card.receive([0x26]))
+        # a REQA in READY is not answered and returns the card to IDLE
+        self.assertIsNone(card.receive([0x26]))
+        self.assertEqual(simulator.IDLE, card.state)
+
+        card.receive([0x52])
+        select = [0x93, 0x70] + UID + [card.bcc]
+        self.assertEqual([simulator.SAK] + simulator.crc_a([simulator.SAK]),
+            card.receive(select + simulator.crc_a(select)))
+        self.assertIsNone(card.receive([0x50, 0x00] + simulator.crc_a([0x50, 0x00])))
+        self.assertEqual(simulator.HALT, card.state)
+        # only a WUPA wakes a halted card
+        self.assertIsNone(card.receive([0x26]))
+        self.assertEqual(simulator.ATQA, card.receive([0x52]))
+
+    def test_reset_pin_resets_chip(self):
+        sim = simulator.install()
+        sim.chip.xfer2([simulator.T_MODE_REG << 1, 0x8D])
+        sim.gpio.output(sim.nrst_pin, 0)
+        self.assertEqual([0, 0], sim.chip.xfer2([0x80 | (simulator.VERSION_REG << 1), 0]))
+        sim.gpio.output(sim.nrst_pin, 1)
+        self.assertEqual([0, 0, simulator.VERSION],
+            sim.chip.xfer2([0x80 | (simulator.T_MODE_REG << 1), 0x80 | (simulator.VERSION_REG << 1), 0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import multiprocessing
+import queue
+import unittest
+
+from .context import Mailbox
+
+def echo_driver(mailbox, replies):
+    # take commands until told to stop, echoing each through a queue
+    while True:
+        command = mailbox.get(True, 5)
+        replies.put(command)
+        mailbox.task_done()
+        if command == b"stop":
+            return
+
+
+class TestMailbox(unittest.TestCase):
+    def setUp(self):
+        self.mailbox = Mailbox.Mailbox(16)
+
+    def test_latest_command_wins(self):
+        self.mailbox.put("color 1 2 3")
+        sequence = self.mailbox.put(b"blink 4 5 6")
+        self.assertEqual(2, sequence)
+
+        self.assertEqual(b"blink 4 5 6", self.mailbox.get(True, 0))
+        self.assertRaises(queue.Empty, self.mailbox.get, True, 0.01)
+        self.assertEqual({"posted": 2, "coalesced": 1}, self.mailbox.stats())
+
+    def test_command_too_long(self):
+        self.assertRaises(ValueError, self.mailbox.put, "x" * 17)
+
+    def test_wait_for_processing(self):
+        first = self.mailbox.put("color 1 2 3")
+        second = self.mailbox.put("color 4 5 6")
+        self.assertFalse(self.mailbox.wait(first, 0.01))
+
+        self.mailbox.get()
+        self.assertFalse(self.mailbox.wait(second, 0.01))
+        self.mailbox.task_done()
+        # the replaced command counts as processed
+        self.assertTrue(self.mailbox.wait(first, 0))
+        self.assertTrue(self.mailbox.wait(second, 0))
+
+    def test_driver_process(self):
+        replies = multiprocessing.Queue()
+        driver = multiprocessing.Process(target = echo_driver, args = (self.mailbox, replies))
+        driver.start()
+        try:
+            sequence = self.mailbox.put("color 1 2 3")
+            self.assertTrue(self.mailbox.wait(sequence, 5))
+            self.assertEqual(b"color 1 2 3", replies.get(True, 5))
+            self.assertTrue(self.mailbox.wait(self.mailbox.put("stop"), 5))
+        finally:
+            driver.join(5)
+        self.assertEqual(0, driver.exitcode)
+
+
+if __name__ == '__main__':
+    unittest.main()
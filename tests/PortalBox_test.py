@@ -0,0 +1,100 @@
+import configparser
+import unittest
+
+from .context import simulator
+
+UID = [0x12, 0x34, 0x56, 0x78]
+CARD_ID = 0x12345678
+
+def create_box(rfid = {}):
+    '''
+    @return a simulator and a PortalBox without a display connected to it
+    '''
+    sim = simulator.install()
+    from portalbox.PortalBox import PortalBox
+    settings = configparser.ConfigParser()
+    settings.read_dict({
+        "display": {"led_type": "NONE", "buzzer_enabled": "false"},
+        "rfid": rfid
+    })
+    box = PortalBox(settings)
+    box.wait_for_rfid_reader(5)
+    return (sim, box)
+
+
+class TestPortalBox(unittest.TestCase):
+    def setUp(self):
+        self.box = None
+
+    def tearDown(self):
+        if self.box:
+            self.box.cleanup()
+
+    def test_hung_reader_is_recovered(self):
+        (sim, self.box) = create_box()
+        sim.present(UID)
+        self.assertEqual(CARD_ID, self.box.read_RFID_card())
+
+        # the reader's antennas turn off when it hangs
+        sim.chip.registers[simulator.TX_CONTROL_REG] = 0x80
+        self.assertEqual(CARD_ID, self.box.read_RFID_card())
+
+        stats = self.box.stats()
+        self.assertEqual(1, stats["rfid_recoveries"])
+        self.assertEqual(0, stats["rfid_failed_recoveries"])
+        self.assertGreater(stats["rfid_longest_recovery_time"], 0)
+        self.assertTrue(self.box.RFIDReader.MFRC522_Verify())
+
+    def test_recovery_gives_up_after_attempts(self):
+        (sim, self.box) = create_box({"recovery_attempts": "2"})
+        self.box.RFIDReader.MFRC522_Verify = lambda: False
+
+        self.assertFalse(self.box.recover_rfid_reader())
+        stats = self.box.stats()
+        self.assertEqual(0, stats["rfid_recoveries"])
+        self.assertEqual(2, stats["rfid_failed_recoveries"])
+        self.assertIsNone(stats["rfid_mean_recovery_time"])
+
+    def test_unrecoverable_reader_raises(self):
+        (sim, self.box) = create_box({"recovery_attempts": "1"})
+        from portalbox.PortalBox import RFIDReaderError
+        self.box.RFIDReader.MFRC522_Verify = lambda: False
+        self.assertEqual(-1, self.box.read_RFID_card())
+
+        # the reader's antennas turn off when it hangs
+        sim.chip.registers[simulator.TX_CONTROL_REG] = 0x80
+        with self.assertRaises(RFIDReaderError):
+            self.box.read_RFID_card()
+
+    def test_presence_check(self):
+        (sim, self.box) = create_box({"presence_check_enabled": "yes"})
+        sim.present(UID)
+        self.assertEqual(CARD_ID, self.box.read_RFID_card())
+        self.assertEqual(simulator.HALT, sim.chip.card.state)
+
+        before = sim.stats()["transceives"]
+        self.assertEqual(CARD_ID, self.box.read_RFID_card())
+        # WUPA and SELECT, no REQA or anticollision
+        self.assertEqual(2, sim.stats()["transceives"] - before)
+
+        sim.remove()
+        self.assertEqual(-1, self.box.read_RFID_card())
+        self.assertIsNone(self.box.rfid_select_frame)
+
+    def test_halted_card_found_after_failed_presence_check(self):
+        (sim, self.box) = create_box({"presence_check_enabled": "yes"})
+        sim.present(UID)
+        self.assertEqual(CARD_ID, self.box.read_RFID_card())
+
+        # a glitch fails the presence check of the halted card, still there
+        is_present = self.box.RFIDReader.MFRC522_IsPresent
+        self.box.RFIDReader.MFRC522_IsPresent = lambda frame: False
+        self.box.read_RFID_card()
+        self.box.RFIDReader.MFRC522_IsPresent = is_present
+
+        self.assertEqual(CARD_ID, self.box.read_RFID_card())
+        self.assertEqual(CARD_ID, self.box.read_RFID_card())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from .context import Database, Roster
+from .stand_in_server import StandInServer
+
+AUTHORIZED = {"card_id": "1234", "user_role": 1, "card_type": 4, "user_balance": "0.00", "user_auth": 1, "user_active": 1}
+UNTRAINED = {"card_id": "5678", "user_role": 1, "card_type": 4, "user_balance": "0.00", "user_auth": 0, "user_active": 1}
+
+class TestRoster(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = {
+            "website": "http://127.0.0.1",
+            "bearer_token": "token",
+            "offline_roster_enabled": "True",
+            "roster_path": os.path.join(self.directory.name, "roster.json"),
+            "retry_attempts": "1"
+        }
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def make_database(self, mock_requests, records):
+        response = MagicMock()
+        response.status_code = 200
+        response.json.return_value = records
+        mock_requests.Session.return_value.request.return_value = response
+
+        db = Database.Database(self.settings)
+        db.requires_training = 1
+        db.requires_payment = 0
+        return db
+
+    @patch("Transport.requests")
+    def test_cards_are_authorized_from_the_roster(self, mock_requests):
+        db = self.make_database(mock_requests, [AUTHORIZED, UNTRAINED])
+        db.start_roster(5)
+        db.roster.syncer.join(0.5)
+        db.roster.stop()
+        session = mock_requests.Session.return_value
+        session.request.reset_mock()
+
+        self.assertTrue(db.get_card_details(1234, 5)["user_is_authorized"])
+        self.assertFalse(db.get_card_details(5678, 5)["user_is_authorized"])
+        self.assertEqual(Database.CardType.INVALID_CARD, db.get_card_details(9999, 5)["card_type"])
+        session.request.assert_not_called()
+
+    @patch("Transport.requests")
+    def test_roster_is_loaded_from_disk_when_database_unreachable(self, mock_requests):
+        db = self.make_database(mock_requests, [AUTHORIZED])
+        roster = Roster.Roster(db, 5, self.settings)
+        roster.stop()
+        roster.syncer.join(0.5)
+
+        mock_requests.Session.return_value.request.side_effect = ConnectionError("unreachable")
+        roster = Roster.Roster(db, 5, self.settings)
+        roster.stop()
+
+        self.assertTrue(roster.is_loaded())
+        self.assertEqual(AUTHORIZED, roster.lookup(1234))
+
+    @patch("Transport.requests")
+    def test_roster_for_other_equipment_type_is_ignored(self, mock_requests):
+        db = self.make_database(mock_requests, [AUTHORIZED])
+        roster = Roster.Roster(db, 5, self.settings)
+        roster.stop()
+        roster.syncer.join(0.5)
+
+        mock_requests.Session.return_value.request.side_effect = ConnectionError("unreachable")
+        roster = Roster.Roster(db, 6, self.settings)
+        roster.stop()
+        roster.syncer.join(0.5)
+
+        self.assertFalse(roster.is_loaded())
+
+
+class TestRosterDeltaSync(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = {
+            "bearer_token": "token",
+            "offline_roster_enabled": "True",
+            "roster_path": os.path.join(self.directory.name, "roster.json"),
+            "roster_sync_interval": "3600"
+        }
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def make_roster(self, server):
+        self.settings["website"] = server.url
+        db = Database.Database(self.settings)
+        roster = Roster.Roster(db, 5, self.settings)
+        roster.stop()
+        roster.syncer.join(1)
+        return roster
+
+    def test_changes_since_cursor_are_applied(self):
+        with StandInServer() as server:
+            server.backend.set_card(1234, AUTHORIZED)
+            server.backend.set_card(5678, UNTRAINED)
+            roster = self.make_roster(server)
+            self.assertEqual(2, roster.revision)
+
+            trained = dict(UNTRAINED, user_auth = 1)
+            server.backend.set_card(5678, trained)
+            server.backend.revoke_card(1234)
+            self.assertTrue(roster.sync())
+
+            self.assertEqual("2", server.requests[-1][2]["since"])
+            self.assertEqual(4, roster.revision)
+            self.assertIsNone(roster.lookup(1234))
+            self.assertEqual(trained, roster.lookup(5678))
+            self.assertEqual(1, roster.stats()["snapshots"])
+
+    def test_changes_without_a_roster_are_ignored(self):
+        db = MagicMock()
+        db.get_roster_changes.return_value = {"revision": 3, "snapshot": False,
+            "cards": {1234: AUTHORIZED}, "revoked": []}
+        roster = Roster.Roster(db, 5, self.settings)
+        roster.stop()
+        roster.syncer.join(1)
+
+        failures = roster.stats()["sync_failures"]
+        self.assertFalse(roster.sync())
+        self.assertFalse(roster.is_loaded())
+        self.assertEqual(0, roster.revision)
+        self.assertEqual(failures + 1, roster.stats()["sync_failures"])
+
+    def test_snapshot_when_cursor_too_old(self):
+        with StandInServer() as server:
+            server.backend.set_card(1234, AUTHORIZED)
+            roster = self.make_roster(server)
+
+            server.backend.revoke_card(1234)
+            server.backend.set_card(5678, UNTRAINED)
+            server.backend.compact()
+            self.assertTrue(roster.sync())
+
+            self.assertIsNone(roster.lookup(1234))
+            self.assertEqual(UNTRAINED, roster.lookup(5678))
+            self.assertEqual(2, roster.stats()["snapshots"])
+
+    def test_cursor_survives_restart(self):
+        with StandInServer() as server:
+            server.backend.set_card(1234, AUTHORIZED)
+            self.make_roster(server)
+
+            server.backend.set_card(5678, UNTRAINED)
+            roster = self.make_roster(server)
+
+            self.assertEqual("1", server.requests[-1][2]["since"])
+            self.assertEqual(UNTRAINED, roster.lookup(5678))
+            self.assertEqual(AUTHORIZED, roster.lookup(1234))
@@ -0,0 +1,72 @@
+import threading
+import time
+import unittest
+
+from .context import Database, SingleFlight
+from .stand_in_server import StandInServer
+
+AUTHORIZED = {"card_id": "1234", "user_role": 1, "card_type": 4, "user_balance": "0.00", "user_auth": 1, "user_active": 1}
+
+def run_concurrently(count, function):
+    results = [None] * count
+    def worker(i):
+        try:
+            results[i] = function()
+        except Exception as e:
+            results[i] = e
+    threads = [threading.Thread(target = worker, args = (i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_callers_share_one_call(self):
+        single_flight = SingleFlight.SingleFlight()
+        calls = []
+        def slow_lookup(card_id):
+            calls.append(card_id)
+            time.sleep(0.1)
+            return card_id * 2
+
+        results = run_concurrently(5, lambda: single_flight.do(("card", 21), slow_lookup, 21))
+
+        self.assertEqual([42] * 5, results)
+        self.assertEqual([21], calls)
+        self.assertEqual({"executed": 1, "coalesced": 4}, single_flight.stats())
+
+    def test_error_is_shared(self):
+        single_flight = SingleFlight.SingleFlight()
+        def failing_lookup():
+            time.sleep(0.1)
+            raise ConnectionError("unreachable")
+
+        results = run_concurrently(3, lambda: single_flight.do("card", failing_lookup))
+
+        self.assertTrue(all(isinstance(result, ConnectionError) for result in results))
+        self.assertEqual(1, single_flight.stats()["executed"])
+
+    def test_sequential_calls_are_not_shared(self):
+        single_flight = SingleFlight.SingleFlight()
+
+        self.assertEqual(1, single_flight.do("card", lambda: 1))
+        self.assertEqual(2, single_flight.do("card", lambda: 2))
+        self.assertEqual({"executed": 2, "coalesced": 0}, single_flight.stats())
+
+    def test_database_coalesces_card_lookups(self):
+        with StandInServer() as server:
+            server.backend.set_card(1234, AUTHORIZED)
+            server.backend.users[1234] = ("Ada", "ada@example.com")
+            server.backend.delay = 0.1
+            db = Database.Database({"website": server.url, "bearer_token": "token"})
+            db.requires_training = 1
+            db.requires_payment = 0
+
+            details = run_concurrently(4, lambda: db.get_card_details(1234, 5))
+            users = run_concurrently(4, lambda: db.get_user(1234))
+
+            self.assertTrue(all(detail["user_is_authorized"] for detail in details))
+            self.assertEqual([("Ada", "ada@example.com")] * 4, users)
+            self.assertEqual(2, len(server.requests))
+            self.assertEqual(6, db.stats()["single_flight"]["coalesced"])
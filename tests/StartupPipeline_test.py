@@ -0,0 +1,57 @@
+import time
+import unittest
+
+from .context import StartupPipeline
+
+class TestStartupPipeline(unittest.TestCase):
+    def test_independent_steps_run_concurrently(self):
+        pipeline = StartupPipeline.StartupPipeline()
+        pipeline.add("hardware", lambda: time.sleep(0.2))
+        pipeline.add("database", lambda: time.sleep(0.2))
+        pipeline.add("email", lambda: time.sleep(0.2))
+
+        started = time.monotonic()
+        pipeline.run()
+
+        self.assertLess(time.monotonic() - started, 0.4)
+        timings = pipeline.timings()
+        self.assertEqual(["hardware", "database", "email"], list(timings))
+        self.assertTrue(all(0.2 <= duration for duration in timings.values()))
+
+    def test_steps_wait_for_their_requirements(self):
+        order = []
+        pipeline = StartupPipeline.StartupPipeline()
+        pipeline.add("database", lambda: (time.sleep(0.1), order.append("database")))
+        pipeline.add("role", lambda: order.append("role"), requires = ("database",))
+        pipeline.add("announce", lambda: order.append("announce"), requires = ("role",))
+        pipeline.run()
+
+        self.assertEqual(["database", "role", "announce"], order)
+
+    def test_failure_skips_dependent_steps(self):
+        def fail():
+            raise ConnectionError("unreachable")
+
+        ran = []
+        pipeline = StartupPipeline.StartupPipeline()
+        pipeline.add("database", fail)
+        pipeline.add("role", lambda: ran.append("role"), requires = ("database",))
+        pipeline.add("email", lambda: ran.append("email"))
+
+        with self.assertRaises(ConnectionError):
+            pipeline.run()
+        self.assertEqual(["email"], ran)
+        self.assertIsNone(pipeline.timings()["role"])
+
+    def test_non_critical_failure_is_tolerated(self):
+        def fail():
+            raise ConnectionError("unreachable")
+
+        pipeline = StartupPipeline.StartupPipeline()
+        pipeline.add("email_server", fail, critical = False)
+        pipeline.run()
+
+    def test_unknown_requirement_is_rejected(self):
+        pipeline = StartupPipeline.StartupPipeline()
+        with self.assertRaises(ValueError):
+            pipeline.add("role", lambda: None, requires = ("database",))
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+
+from .context import Database, StartupSnapshot
+from .stand_in_server import StandInServer
+
+PROFILE = {
+    "id": "7",
+    "type_id": "5",
+    "name": ["Laser Cutter", "Makerspace"],
+    "location_id": "2",
+    "timeout": "60",
+    "allow_proxy": "1",
+    "requires_training": "1",
+    "charge_policy": "0"
+}
+
+class TestStartupSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "snapshot.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_save_then_load(self):
+        snapshot = StartupSnapshot.StartupSnapshot({"startup_snapshot_path": self.path})
+
+        self.assertIsNone(snapshot.load("abcdef123456"))
+        snapshot.save("abcdef123456", PROFILE)
+
+        self.assertEqual(PROFILE, snapshot.load("abcdef123456"))
+        self.assertIsNone(snapshot.load("000000000000"))
+
+    def test_discarded_snapshot_is_not_loaded(self):
+        snapshot = StartupSnapshot.StartupSnapshot({"startup_snapshot_path": self.path})
+        snapshot.save("abcdef123456", PROFILE)
+
+        snapshot.discard()
+        self.assertIsNone(snapshot.load("abcdef123456"))
+        # discarding again is harmless
+        snapshot.discard()
+
+    def test_corrupt_snapshot_is_ignored(self):
+        with open(self.path, "w") as snapshot_file:
+            snapshot_file.write('{"mac_address": "abc')
+
+        snapshot = StartupSnapshot.StartupSnapshot({"startup_snapshot_path": self.path})
+        self.assertIsNone(snapshot.load("abcdef123456"))
+
+    def test_database_starts_from_snapshot_without_backend(self):
+        settings = {
+            "bearer_token": "token",
+            "startup_snapshot_enabled": "True",
+            "startup_snapshot_path": self.path
+        }
+        with StandInServer() as server:
+            server.backend.profiles["abcdef123456"] = PROFILE
+            db = Database.Database(dict(settings, website = server.url))
+            profile = db.get_equipment_profile("abcdef123456")
+            db.close()
+
+        # the stand in server has gone, nothing is listening
+        db = Database.Database(dict(settings, website = server.url))
+        self.assertIsNone(db.load_equipment_profile("000000000000"))
+        self.assertEqual(profile, db.load_equipment_profile("abcdef123456"))
+        self.assertEqual(1, db.requires_training)
+        self.assertEqual(0, db.requires_payment)
+        db.close()
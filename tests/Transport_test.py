@@ -0,0 +1,130 @@
+import time
+import unittest
+from unittest.mock import MagicMock
+
+import requests
+
+from .context import Transport
+from .stand_in_server import StandInServer
+
+def make_response(status_code):
+    response = MagicMock()
+    response.status_code = status_code
+    return response
+
+class TestTransport(unittest.TestCase):
+    def make_transport(self, **settings):
+        transport = Transport.Transport(settings)
+        transport.backoff_base = 0.001
+        transport.session = MagicMock()
+        return transport
+
+    def test_timeouts_are_sent(self):
+        transport = self.make_transport(connect_timeout = "1", read_timeout = "2")
+        transport.session.request.return_value = make_response(200)
+
+        transport.get("http://127.0.0.1/api/box.php", params = {"mode": "get_profile"})
+
+        transport.session.request.assert_called_with("GET", "http://127.0.0.1/api/box.php",
+            timeout = (1.0, 2.0), params = {"mode": "get_profile"})
+
+    def test_get_is_retried(self):
+        transport = self.make_transport(retry_attempts = "3")
+        transport.session.request.side_effect = [
+            requests.ConnectionError("refused"),
+            make_response(503),
+            make_response(200)
+        ]
+
+        self.assertEqual(200, transport.get("http://127.0.0.1").status_code)
+        self.assertEqual(2, transport.stats()["retries"])
+
+    def test_retries_are_bounded(self):
+        transport = self.make_transport(retry_attempts = "2")
+        transport.session.request.side_effect = requests.Timeout("timed out")
+
+        with self.assertRaises(requests.Timeout):
+            transport.get("http://127.0.0.1")
+        self.assertEqual(2, transport.session.request.call_count)
+
+    def test_retries_stay_within_budget(self):
+        with StandInServer() as server:
+            server.backend.delay = 1
+            transport = Transport.Transport({"read_timeout": "0.2",
+                "retry_attempts": "10", "retry_budget": "0.7"})
+            transport.backoff_base = 0.001
+
+            started = time.monotonic()
+            with self.assertRaises(requests.Timeout):
+                transport.get(server.url + "/api/box.php")
+            elapsed = time.monotonic() - started
+
+        # the last attempt is cut short rather than given the read timeout
+        self.assertGreaterEqual(len(server.requests), 3)
+        self.assertLess(elapsed, 0.7 + 0.05)
+
+    def test_attempt_timeout_limited_to_budget(self):
+        with StandInServer() as server:
+            server.backend.delay = 1
+            transport = Transport.Transport({"retry_budget": "0.3"})
+
+            started = time.monotonic()
+            with self.assertRaises(requests.Timeout):
+                transport.get(server.url + "/api/box.php")
+            elapsed = time.monotonic() - started
+
+        self.assertEqual(1, len(server.requests))
+        self.assertLess(elapsed, 0.3 + 0.05)
+
+    def test_post_is_not_retried_by_default(self):
+        transport = self.make_transport(retry_attempts = "3")
+        transport.session.request.return_value = make_response(502)
+
+        self.assertEqual(502, transport.post("http://127.0.0.1").status_code)
+        self.assertEqual(1, transport.session.request.call_count)
+
+    def test_breaker_opens_and_recovers(self):
+        transport = self.make_transport(retry_attempts = "1",
+            circuit_breaker_threshold = "2", circuit_breaker_reset = "0.05")
+        transport.session.request.side_effect = requests.ConnectionError("refused")
+
+        for _ in range(2):
+            with self.assertRaises(requests.ConnectionError):
+                transport.get("http://127.0.0.1")
+        self.assertEqual("open", transport.stats()["circuit_breaker"]["state"])
+
+        # fails fast without sending the request
+        with self.assertRaises(Transport.CircuitOpenError):
+            transport.get("http://127.0.0.1")
+        self.assertEqual(2, transport.session.request.call_count)
+
+        # after the reset timeout a probe is let through
+        time.sleep(0.06)
+        transport.session.request.side_effect = None
+        transport.session.request.return_value = make_response(200)
+        transport.get("http://127.0.0.1")
+
+        stats = transport.stats()["circuit_breaker"]
+        self.assertEqual("closed", stats["state"])
+        self.assertEqual(1, stats["trips"])
+        self.assertEqual(1, stats["rejected"])
+
+    def test_probe_failing_otherwise_reopens_breaker(self):
+        transport = self.make_transport(retry_attempts = "1",
+            circuit_breaker_threshold = "1", circuit_breaker_reset = "0.05")
+        transport.session.request.side_effect = requests.ConnectionError("refused")
+        with self.assertRaises(requests.ConnectionError):
+            transport.get("http://127.0.0.1")
+
+        time.sleep(0.06)
+        transport.session.request.side_effect = ValueError("bad hook")
+        with self.assertRaises(ValueError):
+            transport.get("http://127.0.0.1")
+        self.assertEqual("open", transport.stats()["circuit_breaker"]["state"])
+
+        # the next probe is let through once the breaker resets again
+        time.sleep(0.06)
+        transport.session.request.side_effect = None
+        transport.session.request.return_value = make_response(200)
+        self.assertEqual(200, transport.get("http://127.0.0.1").status_code)
+        self.assertEqual("closed", transport.stats()["circuit_breaker"]["state"])
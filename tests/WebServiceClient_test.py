@@ -1,10 +1,11 @@
 import unittest
 from unittest.mock import MagicMock, patch
 
-from .context import WebService
+from .context import Database, Transport, WebService
+from .stand_in_server import StandInServer
 
 class TestWebService(unittest.TestCase):
-    @patch("WebService.requests")
+    @patch("Transport.requests")
     def test_log_startup_error_when_not_registered(self, mock_requests):
         url = "http://127.0.0.1"
         mac = "abcdef123456"
@@ -12,20 +13,22 @@ class TestWebService(unittest.TestCase):
         response = MagicMock()
         response.status_code = 404
 
-        mock_requests.post.return_value = response
+        mock_requests.Session.return_value.request.return_value = response
 
         client = WebService.Client(url, mac)
 
         with self.assertRaises(WebService.NotRegisteredError):
             client.log_startup()
 
-        mock_requests.post.assert_called_with(
+        mock_requests.Session.return_value.request.assert_called_with(
+            "POST",
             f"{url}/api/v2/box.php",
+            timeout = (Transport.DEFAULT_CONNECT_TIMEOUT, Transport.DEFAULT_READ_TIMEOUT),
             params = {"mac": mac},
             data = "startup"
         )
 
-    @patch("WebService.requests")
+    @patch("Transport.requests")
     def test_log_startup_error_when_out_of_service(self, mock_requests):
         url = "http://127.0.0.1"
         mac = "abcdef123456"
@@ -33,20 +36,22 @@ class TestWebService(unittest.TestCase):
         response = MagicMock()
         response.status_code = 409
 
-        mock_requests.post.return_value = response
+        mock_requests.Session.return_value.request.return_value = response
 
         client = WebService.Client(url, mac)
 
         with self.assertRaises(WebService.OutOfServiceError):
             client.log_startup()
 
-        mock_requests.post.assert_called_with(
+        mock_requests.Session.return_value.request.assert_called_with(
+            "POST",
             f"{url}/api/v2/box.php",
+            timeout = (Transport.DEFAULT_CONNECT_TIMEOUT, Transport.DEFAULT_READ_TIMEOUT),
             params = {"mac": mac},
             data = "startup"
         )
 
-    @patch("WebService.requests")
+    @patch("Transport.requests")
     def test_log_startup_success(self, mock_requests):
         url = "http://127.0.0.1"
         mac = "abcdef123456"
@@ -54,18 +59,20 @@ class TestWebService(unittest.TestCase):
         response = MagicMock()
         response.status_code = 200
 
-        mock_requests.post.return_value = response
+        mock_requests.Session.return_value.request.return_value = response
 
         client = WebService.Client(url, mac)
         client.log_startup()
 
-        mock_requests.post.assert_called_with(
+        mock_requests.Session.return_value.request.assert_called_with(
+            "POST",
             f"{url}/api/v2/box.php",
+            timeout = (Transport.DEFAULT_CONNECT_TIMEOUT, Transport.DEFAULT_READ_TIMEOUT),
             params = {"mac": mac},
             data = "startup"
         )
 
-    @patch("WebService.requests")
+    @patch("Transport.requests")
     def test_begin_usage_session_error_when_not_token_garbled(self, mock_requests):
         url = "http://127.0.0.1"
         mac = "abcdef123456"
@@ -74,20 +81,22 @@ class TestWebService(unittest.TestCase):
         response = MagicMock()
         response.status_code = 401
 
-        mock_requests.put.return_value = response
+        mock_requests.Session.return_value.request.return_value = response
 
         client = WebService.Client(url, mac)
 
         with self.assertRaises(WebService.NotAuthorizedError):
             client.begin_usage_session(card_id)
 
-        mock_requests.put.assert_called_with(
+        mock_requests.Session.return_value.request.assert_called_with(
+            "PUT",
             f"{url}/api/v2/box-activation.php",
+            timeout = (Transport.DEFAULT_CONNECT_TIMEOUT, Transport.DEFAULT_READ_TIMEOUT),
             params = {"mac": mac},
             headers = {"Authorization": f"Bearer {card_id}"}
         )
 
-    @patch("WebService.requests")
+    @patch("Transport.requests")
     def test_begin_usage_session_error_when_not_authorized(self, mock_requests):
         url = "http://127.0.0.1"
         mac = "abcdef123456"
@@ -96,20 +105,22 @@ class TestWebService(unittest.TestCase):
         response = MagicMock()
         response.status_code = 403
 
-        mock_requests.put.return_value = response
+        mock_requests.Session.return_value.request.return_value = response
 
         client = WebService.Client(url, mac)
 
         with self.assertRaises(WebService.NotAuthorizedError):
             client.begin_usage_session(card_id)
 
-        mock_requests.put.assert_called_with(
+        mock_requests.Session.return_value.request.assert_called_with(
+            "PUT",
             f"{url}/api/v2/box-activation.php",
+            timeout = (Transport.DEFAULT_CONNECT_TIMEOUT, Transport.DEFAULT_READ_TIMEOUT),
             params = {"mac": mac},
             headers = {"Authorization": f"Bearer {card_id}"}
         )
 
-    @patch("WebService.requests")
+    @patch("Transport.requests")
     def test_begin_usage_session_success(self, mock_requests):
         url = "http://127.0.0.1"
         mac = "abcdef123456"
@@ -118,18 +129,20 @@ class TestWebService(unittest.TestCase):
         response = MagicMock()
         response.status_code = 200
 
-        mock_requests.put.return_value = response
+        mock_requests.Session.return_value.request.return_value = response
 
         client = WebService.Client(url, mac)
         client.begin_usage_session(card_id)
 
-        mock_requests.put.assert_called_with(
+        mock_requests.Session.return_value.request.assert_called_with(
+            "PUT",
             f"{url}/api/v2/box-activation.php",
+            timeout = (Transport.DEFAULT_CONNECT_TIMEOUT, Transport.DEFAULT_READ_TIMEOUT),
             params = {"mac": mac},
             headers = {"Authorization": f"Bearer {card_id}"}
         )
 
-    @patch("WebService.requests")
+    @patch("Transport.requests")
     def test_end_usage_session_error_when_not_token_garbled(self, mock_requests):
         url = "http://127.0.0.1"
         mac = "abcdef123456"
@@ -138,20 +151,22 @@ class TestWebService(unittest.TestCase):
         response = MagicMock()
         response.status_code = 401
 
-        mock_requests.post.return_value = response
+        mock_requests.Session.return_value.request.return_value = response
 
         client = WebService.Client(url, mac)
 
         with self.assertRaises(WebService.NotAuthorizedError):
             client.end_usage_session(card_id)
 
-        mock_requests.post.assert_called_with(
+        mock_requests.Session.return_value.request.assert_called_with(
+            "POST",
             f"{url}/api/v2/box-activation.php",
+            timeout = (Transport.DEFAULT_CONNECT_TIMEOUT, Transport.DEFAULT_READ_TIMEOUT),
             params = {"mac": mac},
             headers = {"Authorization": f"Bearer {card_id}"}
         )
 
-    @patch("WebService.requests")
+    @patch("Transport.requests")
     def test_end_usage_session_error_when_not_authorized(self, mock_requests):
         url = "http://127.0.0.1"
         mac = "abcdef123456"
@@ -160,20 +175,22 @@ class TestWebService(unittest.TestCase):
         response = MagicMock()
         response.status_code = 403
 
-        mock_requests.post.return_value = response
+        mock_requests.Session.return_value.request.return_value = response
 
         client = WebService.Client(url, mac)
 
         with self.assertRaises(WebService.NotAuthorizedError):
             client.end_usage_session(card_id)
 
-        mock_requests.post.assert_called_with(
+        mock_requests.Session.return_value.request.assert_called_with(
+            "POST",
             f"{url}/api/v2/box-activation.php",
+            timeout = (Transport.DEFAULT_CONNECT_TIMEOUT, Transport.DEFAULT_READ_TIMEOUT),
             params = {"mac": mac},
             headers = {"Authorization": f"Bearer {card_id}"}
         )
 
-    @patch("WebService.requests")
+    @patch("Transport.requests")
     def test_end_usage_session_success(self, mock_requests):
         url = "http://127.0.0.1"
         mac = "abcdef123456"
@@ -182,13 +199,123 @@ class TestWebService(unittest.TestCase):
         response = MagicMock()
         response.status_code = 200
 
-        mock_requests.post.return_value = response
+        mock_requests.Session.return_value.request.return_value = response
 
         client = WebService.Client(url, mac)
         client.end_usage_session(card_id)
 
-        mock_requests.post.assert_called_with(
+        mock_requests.Session.return_value.request.assert_called_with(
+            "POST",
             f"{url}/api/v2/box-activation.php",
+            timeout = (Transport.DEFAULT_CONNECT_TIMEOUT, Transport.DEFAULT_READ_TIMEOUT),
             params = {"mac": mac},
             headers = {"Authorization": f"Bearer {card_id}"}
         )
+
+
+class TestWebServiceConnectionReuse(unittest.TestCase):
+    mac = "abcdef123456"
+    card_id = "f6e5d4c3b2a100"
+
+    def test_client_reuses_connection(self):
+        with StandInServer() as server:
+            server.backend.registered_macs.add(self.mac)
+            server.backend.activation_cards.add(self.card_id)
+            client = WebService.Client(server.url, self.mac)
+
+            client.log_startup()
+            for _ in range(5):
+                client.begin_usage_session(self.card_id)
+                client.end_usage_session(self.card_id)
+
+            self.assertEqual(11, len(server.requests))
+            self.assertEqual(1, server.connections)
+
+    def test_client_shares_transport_with_database(self):
+        with StandInServer() as server:
+            server.backend.registered_macs.add(self.mac)
+            server.backend.equipment_names[7] = "Laser 1"
+            transport = Transport.Transport()
+            client = WebService.Client(server.url, self.mac, transport)
+            db = Database.Database({"website": server.url, "bearer_token": "token"}, transport)
+
+            client.log_startup()
+            self.assertEqual("Laser 1", db.get_equipment_name(7))
+            db.record_ip(7, "10.0.0.2")
+
+            self.assertEqual(3, len(server.requests))
+            self.assertEqual(1, server.connections)
+
+    def test_separate_clients_open_separate_connections(self):
+        with StandInServer() as server:
+            server.backend.registered_macs.add(self.mac)
+
+            for _ in range(3):
+                WebService.Client(server.url, self.mac).log_startup()
+
+            self.assertEqual(3, server.connections)
+
+
+class TestWebServiceHello(unittest.TestCase):
+    mac = "abcdef123456"
+    profile = {
+        "id": "7",
+        "type_id": "5",
+        "name": ["Laser Cutter", "Makerspace"],
+        "location_id": "2",
+        "timeout": "60",
+        "allow_proxy": "1",
+        "requires_training": "1",
+        "charge_policy": "0"
+    }
+
+    def test_hello_returns_profile_in_one_request(self):
+        with StandInServer() as server:
+            server.backend.registered_macs.add(self.mac)
+            server.backend.profiles[self.mac] = self.profile
+            server.backend.equipment_names[7] = "Laser 1"
+            client = WebService.Client(server.url, self.mac)
+
+            greeting = client.hello("10.0.0.2")
+
+            self.assertEqual(self.profile, greeting["profile"])
+            self.assertEqual("Laser 1", greeting["equipment_name"])
+            self.assertEqual(1, len(server.requests))
+            self.assertEqual("10.0.0.2", server.backend.logs[0]["ip"])
+
+    def test_hello_falls_back_to_log_startup(self):
+        with StandInServer() as server:
+            server.backend.registered_macs.add(self.mac)
+            server.backend.hello_supported = False
+            client = WebService.Client(server.url, self.mac)
+
+            self.assertIsNone(client.hello("10.0.0.2"))
+            self.assertEqual("/api/v2/box.php", server.requests[-1][1])
+
+    def test_hello_error_when_not_registered(self):
+        with StandInServer() as server:
+            client = WebService.Client(server.url, self.mac)
+
+            with self.assertRaises(WebService.NotRegisteredError):
+                client.hello("10.0.0.2")
+
+    def test_hello_error_when_out_of_service(self):
+        with StandInServer() as server:
+            server.backend.registered_macs.add(self.mac)
+            server.backend.out_of_service_macs.add(self.mac)
+            client = WebService.Client(server.url, self.mac)
+
+            with self.assertRaises(WebService.OutOfServiceError):
+                client.hello("10.0.0.2")
+
+    def test_hello_error_on_server_error(self):
+        response = MagicMock()
+        response.status_code = 503
+        transport = MagicMock()
+        transport.post.return_value = response
+        client = WebService.Client("http://127.0.0.1", self.mac, transport)
+
+        with self.assertRaises(Exception):
+            client.hello("10.0.0.2")
+        # a server error does not fall back to the legacy request
+        self.assertEqual(1, transport.post.call_count)
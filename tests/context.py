@@ -2,4 +2,19 @@ import os
 import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+import AsyncDatabase
+import AttemptAggregator
+import CardPoller
+import CardCache
+import Database
+import EventLoop
+import LogSpool
+import Roster
+import SingleFlight
+import StartupPipeline
+import StartupSnapshot
+import Transport
 import WebService
+
+from portalbox import DriverProtocol, simulator
+from portalbox.display import FrameBuffer, Mailbox
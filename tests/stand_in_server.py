@@ -0,0 +1,218 @@
+"""
+A stand in for the box API of the portalbox website, just enough of it to
+exercise the clients against a real HTTP server without the real website.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+class StandInBackend:
+    """
+    The data served by the stand in server
+
+    Changes to card records are kept in a log of (revision, card_id, record)
+    where a record of None is a tombstone for a revoked card. Only changes
+    after oldest_revision are retained, clients with an older cursor are sent
+    a full snapshot.
+    """
+
+    LOG_MODES = (
+        "log_started_status",
+        "log_shutdown_status",
+        "log_access_attempt",
+        "log_access_completion",
+        "record_ip"
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cards = {}
+        self.changes = []
+        self.revision = 0
+        self.oldest_revision = 0
+        # mac address -> profile record
+        self.profiles = {}
+        # card id -> (name, email)
+        self.users = {}
+        # equipment id -> name
+        self.equipment_names = {}
+        # the parameters of every logging request received
+        self.logs = []
+        # seconds to wait before answering each request
+        self.delay = 0
+        # v2 api: registered boxes, those out of service and the cards which
+        # may start a usage session
+        self.registered_macs = set()
+        self.out_of_service_macs = set()
+        self.activation_cards = set()
+        # whether the combined startup request is understood
+        self.hello_supported = True
+
+    def set_card(self, card_id, record):
+        with self.lock:
+            self.revision += 1
+            self.cards[card_id] = record
+            self.changes.append((self.revision, card_id, record))
+
+    def revoke_card(self, card_id):
+        with self.lock:
+            self.revision += 1
+            del self.cards[card_id]
+            self.changes.append((self.revision, card_id, None))
+
+    def compact(self):
+        """Forget the change log, as a real backend might after a while"""
+        with self.lock:
+            self.changes = []
+            self.oldest_revision = self.revision
+
+    def card_record(self, card_id):
+        with self.lock:
+            if card_id in self.cards:
+                return self.cards[card_id]
+        return {"user_role": None, "card_type": None, "user_balance": "0.00", "user_auth": 0, "user_active": None}
+
+    def roster_since(self, since):
+        with self.lock:
+            if since <= 0 or since < self.oldest_revision:
+                return {
+                    "revision": self.revision,
+                    "snapshot": True,
+                    "cards": list(self.cards.values()),
+                    "revoked": []
+                }
+
+            latest = {}
+            for revision, card_id, record in self.changes:
+                if revision > since:
+                    latest[card_id] = record
+            return {
+                "revision": self.revision,
+                "snapshot": False,
+                "cards": [record for record in latest.values() if record is not None],
+                "revoked": [card_id for card_id, record in latest.items() if record is None]
+            }
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_request(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+
+        self.server.requests.append((self.command, url.path, params, body))
+        backend = self.server.backend
+        if backend.delay:
+            time.sleep(backend.delay)
+
+        mode = params.get("mode")
+        if url.path.startswith("/api/v2/"):
+            self.handle_v2_request(url.path, params, body)
+        elif url.path != "/api/box.php":
+            self.send_json(404, None)
+        elif mode == "get_roster":
+            self.send_json(200, backend.roster_since(int(params.get("since", 0))))
+        elif mode == "get_card_details":
+            self.send_json(200, [backend.card_record(int(params["card_id"]))])
+        elif mode == "get_profile" and params.get("mac_adr") in backend.profiles:
+            self.send_json(200, [backend.profiles[params["mac_adr"]]])
+        elif mode == "get_user" and int(params["card_id"]) in backend.users:
+            name, email = backend.users[int(params["card_id"])]
+            self.send_json(200, [{"name": name, "email": email}])
+        elif mode == "get_equipment_name" and int(params["equipment_id"]) in backend.equipment_names:
+            self.send_json(200, [{"name": backend.equipment_names[int(params["equipment_id"])]}])
+        elif mode == "hello" and backend.hello_supported and params.get("mac_adr") in backend.profiles:
+            backend.logs.append(params)
+            self.send_hello(params["mac_adr"])
+        elif mode in StandInBackend.LOG_MODES:
+            backend.logs.append(params)
+            self.send_json(200, True)
+        else:
+            self.send_json(404, None)
+
+    def send_hello(self, mac):
+        backend = self.server.backend
+        profile = backend.profiles[mac]
+        self.send_json(200, {
+            "profile": profile,
+            "equipment_name": backend.equipment_names.get(int(profile["id"]))
+        })
+
+    def handle_v2_request(self, path, params, body):
+        backend = self.server.backend
+        mac = params.get("mac")
+        if mac not in backend.registered_macs:
+            self.send_json(404, None)
+        elif path == "/api/v2/box-hello.php" and not backend.hello_supported:
+            self.send_json(404, None)
+        elif path in ("/api/v2/box.php", "/api/v2/box-hello.php") and mac in backend.out_of_service_macs:
+            self.send_json(409, None)
+        elif path == "/api/v2/box-hello.php" and self.command == "POST":
+            backend.logs.append(dict(params, **json.loads(body)))
+            self.send_hello(mac)
+        elif path == "/api/v2/box.php" and self.command == "POST":
+            self.send_json(200, None)
+        elif path == "/api/v2/box-activation.php" and self.command in ("PUT", "POST"):
+            card_id = self.headers.get("Authorization", "").replace("Bearer ", "")
+            self.send_json(200 if card_id in backend.activation_cards else 403, None)
+        else:
+            self.send_json(404, None)
+
+    do_GET = handle_request
+    do_POST = handle_request
+    do_PUT = handle_request
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Serve a StandInBackend on an ephemeral port of the loopback interface
+
+    Use as a context manager; url is the base url to give to a client and
+    connections is the number of connections accepted.
+    """
+
+    daemon_threads = True
+    block_on_close = False
+
+    def __init__(self, backend = None):
+        ThreadingHTTPServer.__init__(self, ("127.0.0.1", 0), StandInHandler)
+        self.backend = backend if backend else StandInBackend()
+        self.requests = []
+        self.connections = 0
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        ThreadingHTTPServer.process_request(self, request, client_address)
+
+    def handle_error(self, request, client_address):
+        # clients abandoning a request, by timing out or cancelling it, are
+        # expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            ThreadingHTTPServer.handle_error(self, request, client_address)
+
+    def __enter__(self):
+        threading.Thread(target = self.serve_forever, args = (0.05,), daemon = True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()